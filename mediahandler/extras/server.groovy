@@ -0,0 +1,56 @@
+// EM Media Handler - Filebot script server
+//
+// Runs inside a single long-lived Filebot JVM. Reads one JSON request per
+// line from stdin, converted from the addmedia CLI arguments by
+// mediahandler.util.filebot, in the form:
+//
+//     {"id": 1, "paths": ["/path/to/files"], "recursive": true,
+//      "options": {"db": "thetvdb", "format": "...", "action": "copy",
+//                  "strict": false}, "log_level": "all", "log_file": null}
+//
+// runs the rename, and writes the Filebot output followed by a line
+// containing "@@MH-DONE <id>" to stdout.
+
+import groovy.io.FileType
+import groovy.json.JsonSlurper
+import java.util.logging.Level
+
+System.setErr(System.out)
+
+def slurper = new JsonSlurper()
+def reader = new BufferedReader(new InputStreamReader(System.in, 'UTF-8'))
+
+println '@@MH-READY'
+System.out.flush()
+
+def line
+while ((line = reader.readLine()) != null) {
+    def request = slurper.parseText(line)
+    def files = []
+
+    // Set the log level, like 'filebot --log <level>'
+    if (request.log_level) {
+        log.level = Level.parse(request.log_level.toUpperCase())
+    }
+
+    // Rename the files in folders, like 'filebot -rename <folder> [-r]'
+    request.paths.each { path ->
+        def file = new File(path)
+        if (!file.isDirectory()) {
+            files << file
+        } else if (request.recursive) {
+            file.eachFileRecurse(FileType.FILES) { files << it }
+        } else {
+            file.eachFile(FileType.FILES) { files << it }
+        }
+    }
+
+    try {
+        rename(request.options + [file: files.sort()])
+    } catch (Throwable e) {
+        println "Failed to process ${request.paths}: ${e.message}"
+    }
+
+    println "@@MH-DONE ${request.id}"
+    System.out.flush()
+}
@@ -31,14 +31,17 @@ Module contains:
 
 import re
 import sys
+import copy
 import logging
-from shutil import rmtree
-from os import path, listdir, remove
+from os import path
 
 import mediahandler as mh
 import mediahandler.util.args as Args
+import mediahandler.util.inventory as Inventory
 import mediahandler.util.notify as Notify
+import mediahandler.util.filebot as Filebot
 from mediahandler.util.config import make_config, parse_config
+from mediahandler.util.config import print_app_report
 
 
 class MHandler(mh.MHObject):
@@ -63,6 +66,22 @@ class MHandler(mh.MHObject):
         - extract_files()
             Wrapper function for accessing the
             mediahandler.util.extract module
+
+        - watch()
+            Runs as a long-running daemon which watches the media
+            type drop folders and adds new downloads as they arrive.
+
+        - listen()
+            Runs as a long-running daemon which adds downloads as
+            their torrents finish in Deluge.
+
+        - add_media_batch()
+            Adds several downloads of the same media type with a
+            single call to Filebot.
+
+        - new_job()
+            Returns a copy of the handler with its own settings, for
+            running add_media() alongside other jobs.
     """
 
     def __init__(self, config):
@@ -82,7 +101,8 @@ class MHandler(mh.MHObject):
 
         # Extract settings from config
         self.config = make_config(config)
-        self.set_settings(parse_config(self.config))
+        self._settings = parse_config(self.config)
+        self.set_settings(copy.deepcopy(self._settings))
 
         # Set up notify instance
         self.push = Notify.MHPush(self.notifications)
@@ -90,6 +110,8 @@ class MHandler(mh.MHObject):
         # Placeholders members
         self.single_file = False
         self.extracted = None
+        self.torrent_hash = None
+        self.inventory = None
 
     def add_media(self, media, **kwargs):
         """Entry point function for adding media via the MHandler object.
@@ -127,6 +149,12 @@ class MHandler(mh.MHObject):
                 the "enabled" config file setting.
         """
 
+        # Reset values left over from any previous call
+        self.single_file = False
+        self.extracted = None
+        self.torrent_hash = None
+        self.inventory = None
+
         # Set object info from input
         self._parse_args_from_dict(media, **kwargs)
         logging.debug("Media: %s", self.media)
@@ -148,6 +176,173 @@ class MHandler(mh.MHObject):
 
         return new_files
 
+    def watch(self):
+        """Runs as a long-running daemon which watches the media type
+        drop folders and adds new downloads as they arrive.
+
+        Uses the 'Daemon' section of the user configuration file. The
+        configuration, notification credentials and application paths are
+        only loaded once, for the life of the process. New downloads are
+        sent to a mediahandler.util.jobs job queue.
+        """
+
+        logging.info("Starting daemon mode")
+
+        # Import daemon modules
+        import mediahandler.util.jobs as Jobs
+        import mediahandler.util.watch as Watch
+        import mediahandler.util.torrent as Torrent
+
+        # Set up job queue & watcher
+        queue = Jobs.MHJobQueue(self)
+        try:
+            watcher = Watch.MHWatcher(self.daemon, queue.submit)
+        except ValueError as err:
+            self.push.failure(str(err))
+
+        # Keep a Filebot process running, if enabled
+        filebot = self._get_filebot()
+        if self.daemon.filebot_server and filebot:
+            Filebot.start_server(filebot)
+
+        # Run until interrupted
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            watcher.stop()
+        finally:
+            queue.close()
+            Filebot.stop_server()
+            Torrent.stop_client()
+
+    def listen(self):
+        """Runs as a long-running daemon which connects to Deluge once and
+        adds downloads as their torrents finish.
+
+        Uses the 'Deluge' section of the user configuration file to connect.
+        Finished torrents are sent to a mediahandler.util.jobs job queue,
+        and removed from Deluge afterwards if the 'Deluge' settings allow
+        it. Torrents which finish while Deluge is not connected are added
+        when it reconnects.
+        """
+
+        logging.info("Starting Deluge listener")
+
+        # Import daemon modules
+        import mediahandler.util.jobs as Jobs
+        import mediahandler.util.torrent as Torrent
+
+        # Set up job queue & listener
+        queue = Jobs.MHJobQueue(self)
+        listener = Torrent.MHDelugeListener(
+            self._settings['Deluge'],
+            lambda torrent_hash, media: queue.submit(
+                media, torrent_hash=torrent_hash))
+
+        # Keep a Filebot process running, if enabled
+        filebot = self._get_filebot()
+        if self.daemon.filebot_server and filebot:
+            Filebot.start_server(filebot)
+
+        # Run until interrupted
+        try:
+            listener.run()
+        except KeyboardInterrupt:
+            listener.stop()
+        finally:
+            queue.close()
+            Filebot.stop_server()
+            Torrent.stop_client()
+
+    def add_media_batch(self, batch):
+        """Adds several downloads of the same media type with a single
+        call to Filebot, so the JVM only starts once.
+
+        Required argument:
+
+            - batch
+                List of dicts of validated add_media() arguments. All
+                must be of the same TV or Movies media type.
+
+        Returns a list of the add_media() result for each download, or the
+        SystemExit raised if it could not be added. Downloads containing
+        compressed files are added on their own.
+        """
+
+        logging.info("Starting batch of %s downloads", len(batch))
+        outcomes = [None] * len(batch)
+
+        # Every download is listed in one shared inventory
+        inventory = Inventory.MHInventory()
+
+        # Set up a job for each download
+        jobs = {}
+        for (index, args) in enumerate(batch):
+            job = self.new_job()
+            job.inventory = inventory
+            try:
+                job._parse_args_from_dict(validated=True, **args)
+
+                # Check that file was downloaded
+                if not path.exists(job.media):
+                    job.push.failure(
+                        "No media files found: {0}".format(job.name))
+
+                # Compressed files are handled separately
+                if job._has_zipped(job.media):
+                    outcomes[index] = job._file_handler(job.media)
+                    continue
+
+                job._check_files(job.media)
+                jobs[index] = job
+
+            except SystemExit as err:
+                outcomes[index] = err
+
+        if not jobs:
+            return outcomes
+
+        # Send all remaining downloads to Filebot at once
+        first = jobs[min(jobs)]
+        try:
+            media = first._get_media_type()
+            results = media.add_batch([job.media for job in jobs.values()])
+        except SystemExit as err:
+            for index in jobs:
+                outcomes[index] = err
+            return outcomes
+
+        # Check each download's results
+        for (index, job) in jobs.items():
+            result = results[job.media]
+            if isinstance(result, SystemExit):
+                outcomes[index] = result
+                continue
+            try:
+                outcomes[index] = job._check_success(job.media, result)
+            except SystemExit as err:
+                outcomes[index] = err
+
+        return outcomes
+
+    def new_job(self):
+        """Returns a copy of the handler with its own settings, for
+        running add_media() alongside other jobs.
+
+        The configuration file is not parsed again.
+        """
+
+        job = copy.copy(self)
+        job.set_settings(copy.deepcopy(self._settings))
+
+        # Reset per-job values
+        job.single_file = False
+        job.extracted = None
+        job.torrent_hash = None
+        job.inventory = None
+
+        return job
+
     def _parse_args_from_dict(self, media, **kwargs):
         """Validate arguments from the add_media() function via the CLI
         argparse object in the mediahandler.util.args module.
@@ -184,82 +379,154 @@ class MHandler(mh.MHObject):
             - Checks that media folder is not empty
             - Sends media files to _add_media_files()
             - Checks for success
+
+        Extracted files and any other media in the download are added
+        together, with a single call to _add_media_files(). Files extracted
+        outside of the download are added from each folder they were
+        extracted to.
         """
 
         logging.info("Starting files handler")
 
-        # Look for zipped file first
-        self._find_zipped(files)
+        # Extract zipped files first
+        media = self._find_zipped(files)
+
+        # Check files
+        for new_media in media:
+            self._check_files(new_media)
+
+        # Add files
+        (added_files, skipped_files) = ([], [])
+        for new_media in media:
+            (new_added, new_skipped) = self._add_media_files(new_media)
+            added_files.extend(new_added)
+            skipped_files.extend(new_skipped)
+
+        return self._check_success(files, (added_files, skipped_files))
+
+    def _check_files(self, files):
+        """Sets the single_file flag and checks that media folders are
+        not empty.
+        """
+
+        inventory = self._get_inventory(files)
 
         # Only set this flag for single files
-        if path.isfile(files):
+        if inventory.is_file(files):
             self.single_file = True
 
         # Make sure folders have files
-        elif not listdir(files):
+        elif not inventory.listdir(files):
             self.push.failure(
                 "No {0} files found for: {1}".format(self.stype, self.name))
 
-        # Add files
-        results = self._add_media_files(files)
-
-        return self._check_success(files, results)
-
     def _find_zipped(self, files):
         """Looks for compressed file types and sends them to extract_files().
 
-        File types supported: .zip, .rar, .7z
+        Returns a list of the media to add: the folders the files were
+        extracted to for a compressed file, or the download folder itself,
+        which now holds the extracted files alongside any other media.
+
+        File types supported: .zip, .rar, .7z, .tar and compressed .tar,
+        including multi-volume archives.
         """
 
         logging.info("Looking for zipped files")
-        file_string = files
 
-        # Override if folder
-        if not path.isfile(files):
-            file_string = '\n'.join(listdir(files))
+        # Look for zipped files
+        if not self._has_zipped(files):
+            return [files]
 
-        # Set up regex
-        flags = re.I | re.MULTILINE
-        regex = r"^(.*.(zip|rar|7z))$"
+        logging.debug("Zipped file type detected")
 
-        # Look for zipped files in file string
-        if re.search(regex, file_string, flags):
-            logging.debug("Zipped file type detected")
-            # Send to extractor
-            get_files = self.extract_files(files)
-            # Rescan files
-            self._file_handler(get_files)
+        # Send to extractor
+        return self.extract_files(files)
+
+    def _has_zipped(self, files):
+        """Returns True if a file, or anything in a folder, is a
+        compressed file type.
+        """
+
+        # Import extract module
+        import mediahandler.util.extract as Extract
+
+        inventory = self._get_inventory(files)
+
+        return len(Extract.find_archives(files, inventory)) > 0
 
     def extract_files(self, raw):
         """Wrapper function for sending compressed files for extraction via
         the mediahandler.util.extract module.
 
-        Requires the Filebot application for extraction.
+        Archives are extracted in-process where possible. The Filebot
+        application is required for any others.
+
+        Returns a list of the media to add: every folder the files were
+        extracted to, or the download folder itself if they are all
+        inside it.
         """
 
         logging.info("Extracting files from compressed file")
-        self.extracted = raw
+
+        # Import extract module
+        import mediahandler.util.extract as Extract
+
+        inventory = self._get_inventory(raw)
 
         # Look for filebot
-        if hasattr(self.tv, 'filebot'):
-            filebot = self.tv.filebot
-        elif hasattr(self.movies, 'filebot'):
-            filebot = self.movies.filebot
-        if not filebot:
+        filebot = self._get_filebot()
+        if not filebot and not Extract.can_extract(raw, inventory):
             self.push.failure(
                 "Filebot required to extract: {0}".format(self.name))
 
-        # Import extract module
-        import mediahandler.util.extract as Extract
-
         # Send to handler
-        extracted = Extract.get_files(filebot, raw)
-        if extracted is None:
+        extracted = Extract.get_files(filebot, raw, inventory)
+        if not extracted:
             self.push.failure(
                 "Unable to extract files: {0}".format(self.name))
 
+        # Add any files extracted by Filebot to the inventory
+        for new_files in extracted:
+            if not inventory.exists(new_files):
+                inventory.scan(new_files)
+
+        # Add the whole download if the files were extracted inside it
+        if path.isdir(raw):
+            folder = path.join(path.abspath(raw), '')
+            if all(path.abspath(new_files).startswith(folder)
+                   for new_files in extracted):
+                return [raw]
+
+        # Remember extracted files for removal
+        self.extracted = extracted
+
         return extracted
 
+    def _get_inventory(self, files):
+        """Returns the job's MHInventory, scanning the files into it if
+        they have not been already.
+        """
+
+        if self.inventory is None:
+            self.inventory = Inventory.MHInventory()
+
+        if not self.inventory.exists(files):
+            self.inventory.scan(files)
+
+        return self.inventory
+
+    def _get_filebot(self):
+        """Returns the path to the Filebot application, if found.
+        """
+
+        filebot = None
+        if hasattr(self.tv, 'filebot'):
+            filebot = self.tv.filebot
+        elif hasattr(self.movies, 'filebot'):
+            filebot = self.movies.filebot
+
+        return filebot
+
     def _add_media_files(self, files):
         """Sends media files to the correct mediahandler.types submodule
         based on media type.
@@ -269,6 +536,17 @@ class MHandler(mh.MHObject):
         """
 
         logging.info("Getting media information")
+
+        # Set up media type object
+        media = self._get_media_type()
+
+        return media.add(files)
+
+    def _get_media_type(self):
+        """Returns the configured MHMediaType subclass object for the
+        media type.
+        """
+
         use_type = self.stype.lower()
 
         # Check for forced single import (Music)
@@ -299,9 +577,10 @@ class MHandler(mh.MHObject):
 
         # Initiate class
         media = const(getattr(self, use_type), self.push)
+        media.inventory = self.inventory
         logging.debug("Configured media type: %s", media.type)
 
-        return media.add(files)
+        return media
 
     def _get_class_name(self):
         """Return the MHMediaType subclass name based on the media type.
@@ -335,7 +614,10 @@ class MHandler(mh.MHObject):
         # Remove old files
         self._remove_files(files, skip)
 
-        return self.push.success(added_files, skipped_files)
+        # Remove torrent from Deluge
+        self._remove_torrent(skip)
+
+        return self.push.success(added_files, skipped_files, self.stype)
 
     def _remove_files(self, files, skip):
         """Removes left over files from processing.
@@ -357,24 +639,45 @@ class MHandler(mh.MHObject):
 
         # Otherwise, remove
         if path.exists(files):
+            inventory = self._get_inventory(files)
 
             # Remove any extracted files
-            if self.extracted is not None:
-                logging.debug("Removing extracted files folder")
-                rmtree(self.extracted)
+            for extracted in self.extracted or []:
+                if path.exists(extracted):
+                    logging.debug("Removing extracted files folder")
+                    inventory.remove(extracted)
 
-            # Remove a single file
-            if self.single_file:
+            # Remove a single file or folder
+            if inventory.is_file(files):
                 logging.debug("Removing extra single file")
-                remove(files)
-
-            # Remove a folder
             else:
                 logging.debug("Removing extra files folder")
-                rmtree(files)
+            inventory.remove(files)
 
         return
 
+    def _remove_torrent(self, skip):
+        """Queues the torrent the media came from for removal from Deluge.
+
+        Only used for media added by the 'addmedia-deluge' script, when the
+        user's 'Deluge' settings allow it. The removal runs in the
+        background, so a slow Deluge daemon doesn't hold up the rest of the
+        job. Torrents with skipped files are kept unless 'remove_if_skips'
+        is set.
+        """
+
+        if self.torrent_hash is None or not self.deluge.enabled:
+            return
+
+        # Keep torrent if files were skipped
+        if skip and not self.deluge.remove_if_skips:
+            logging.info("Keeping torrent with skipped files in Deluge")
+            return
+
+        import mediahandler.util.torrent as Torrent
+
+        Torrent.get_client(self._settings['Deluge']).remove(self.torrent_hash)
+
     def __repr__(self):
         return '<MHandler {0}>'.format(self.__dict__)
 
@@ -392,12 +695,27 @@ def main(is_deluge=False):
     # Get arguments
     (config, args) = Args.get_arguments(is_deluge)
 
+    # Show the application report, if requested
+    if args.pop('doctor', False):
+        return print_app_report()
+
     # Set up handler
     handler = MHandler(config)
 
+    # Run as a daemon, if requested
+    if args.pop('daemon', False):
+        return handler.watch()
+    if args.pop('deluge_listen', False):
+        return handler.listen()
+
     # Set up add media args
     added = handler.add_media(validated=True, **args)
 
+    # Wait for the torrent to be removed from Deluge
+    if is_deluge:
+        import mediahandler.util.torrent as Torrent
+        Torrent.stop_client()
+
     # Return formatted list of added files
     return added
 
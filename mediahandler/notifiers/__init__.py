@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""
+Module: mediahandler.notifiers
+
+Module contains:
+
+    - |MHNotifier|
+        Parent class for all notifier submodules, which send push
+        notifications to a 3rd party service or other destination.
+
+    - |MHRetry|
+        Raised when a service asks for a request to be retried later.
+
+    - |get_notifier()|
+        Returns a notifier object for a settings section, importing its
+        submodule on first use.
+
+    - |get_session()|
+        Returns the shared HTTP session for a host.
+
+Notifier Submodules:
+
+    - |mediahandler.notifiers.file|
+
+    - |mediahandler.notifiers.pushbullet|
+
+    - |mediahandler.notifiers.pushover|
+
+    - |mediahandler.notifiers.webhook|
+
+"""
+
+import time
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from importlib import import_module
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+import mediahandler as mh
+
+# Notifier classes for each Notifications settings section. Submodules are
+# only imported when their section is configured
+__notifiers__ = {
+    'pushover': 'mediahandler.notifiers.pushover.MHPushover',
+    'pushbullet': 'mediahandler.notifiers.pushbullet.MHPushbullet',
+    'webhook': 'mediahandler.notifiers.webhook.MHWebhook',
+    'file': 'mediahandler.notifiers.file.MHFile',
+}
+
+# Headers used by services to say when to try again
+__retryheaders__ = [
+    'X-Limit-App-Reset',
+    'X-Ratelimit-Reset',
+]
+
+# Longest time, in seconds, to wait for a service to respond
+_TIMEOUT = 30
+
+# Largest number of open connections kept for each host
+_POOL_SIZE = 10
+
+# Shared HTTP sessions, by host
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+class MHNotifier(mh.MHObject, ABC):
+    """Parent class for the notifier submodule classes. Each submodule must
+    implement send().
+
+    Required argument:
+        - settings
+            Dict or MHSettings object of the notifier's settings section.
+
+    Class members, set by each submodule:
+        - url
+            Base URL of the service API.
+        - limit
+            Longest message, in characters, the service accepts.
+        - required
+            Settings which must be set for the notifier to be used.
+        - validates
+            True if the credentials can be checked with the service.
+
+    Public methods:
+        - |is_configured()|
+            Returns True if every required setting is set.
+
+        - |get_key()|
+            Returns a hash of the notifier's settings.
+
+        - |validate()|
+            Checks the credentials with the service.
+
+        - |send()|
+            Sends a message.
+
+        - |is_auth_error()|
+            Returns True if a send response means the credentials were
+            rejected.
+    """
+
+    url = None
+    limit = None
+    required = []
+    validates = False
+
+    def __init__(self, settings):
+        """Initialize the MHNotifier class.
+
+        Required argument:
+            - settings
+                Dict or MHSettings object.
+        """
+
+        super(MHNotifier, self).__init__(settings)
+
+        # Name of the settings section
+        self.name = self.__module__.split('.')[-1]
+
+    def is_configured(self):
+        """Returns True if every required setting is set.
+        """
+        return all(getattr(self, option, None) is not None
+                   for option in self.required)
+
+    def get_key(self):
+        """Returns a hash of the notifier's required settings. Used to tell
+        notifiers apart without storing their credentials.
+        """
+
+        parts = [self.name]
+        parts.extend(str(getattr(self, option)) for option in self.required)
+
+        return hashlib.sha256(':'.join(parts).encode('utf-8')).hexdigest()
+
+    def validate(self):
+        """Checks the credentials with the service. Returns an error
+        message if they are not valid.
+
+        Connection errors are raised, so the check can be retried.
+        """
+        return None
+
+    @abstractmethod
+    def send(self, conn_msg, conn_title):
+        """Sends a message. Returns the service's response.
+        """
+
+    def is_auth_error(self, resp):
+        """Returns True if a send response means the credentials were
+        rejected.
+        """
+        return False
+
+    def _request(self, path, method='GET', **kwargs):
+        """Makes a request to the service API using the shared session for
+        its host. Returns the response object.
+
+        Raises MHRetry if the service is rate limiting requests or is
+        unavailable.
+        """
+
+        url = '{0}{1}'.format(self.url, path)
+
+        # Make request
+        resp = get_session(url).request(
+            method, url, timeout=_TIMEOUT, **kwargs)
+
+        # Check for a temporary failure
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise MHRetry(
+                '{0} {1}: {2} {3}'.format(
+                    method, url, resp.status_code, resp.reason),
+                _get_retry_time(resp.headers))
+
+        # Check for response success
+        if resp.status_code >= 300:
+            logging.error(
+                "%s %s: %s %s", method, url, resp.status_code, resp.reason)
+
+        return resp
+
+    def _make_request(self, path, method='GET', **kwargs):
+        """Makes a request to the service API and returns its JSON response.
+        """
+
+        conn_resp = self._request(path, method, **kwargs).json()
+        logging.debug(conn_resp)
+
+        return conn_resp
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(self.__class__.__name__, self.__dict__)
+
+
+class MHRetry(Exception):
+    """Raised when a service asks for a request to be retried later.
+
+    Members:
+        - retry_time
+            The time, as a UNIX timestamp, the service asked to be
+            retried after, or None if it did not say.
+    """
+
+    def __init__(self, message, retry_time=None):
+        """Initialize the MHRetry class.
+        """
+
+        super(MHRetry, self).__init__(message)
+        self.retry_time = retry_time
+
+
+def get_notifier(name, settings):
+    """Returns a notifier object for a Notifications settings section,
+    importing its submodule on first use. Returns None if there is no
+    notifier for the section.
+
+    Required arguments:
+        - name
+            Name of the settings section.
+        - settings
+            Dict or MHSettings object of the section.
+    """
+
+    if name not in __notifiers__:
+        return None
+
+    (module, notifier_class) = __notifiers__[name].rsplit('.', 1)
+
+    return getattr(import_module(module), notifier_class)(settings)
+
+
+def get_session(url):
+    """Returns the shared HTTP session for the host of a URL, creating it on
+    first use. Connections are kept alive and reused by every notifier
+    sending to the host.
+    """
+
+    host = urlsplit(url)[:2]
+
+    with _SESSIONS_LOCK:
+        if host not in _SESSIONS:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            logging.debug("Creating HTTP session: %s://%s", *host)
+            session = requests.Session()
+            session.mount('{0}://{1}'.format(*host), HTTPAdapter(
+                pool_connections=1, pool_maxsize=_POOL_SIZE))
+            _SESSIONS[host] = session
+
+        return _SESSIONS[host]
+
+
+def _get_retry_time(headers):
+    """Returns the time, as a UNIX timestamp, a rate limited or unavailable
+    service asked to be retried after, or None if it did not say.
+    """
+
+    # Seconds to wait
+    retry_after = headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return time.time() + float(retry_after)
+        except ValueError:
+            pass
+
+    # Rate limit reset time
+    for header in __retryheaders__:
+        reset = headers.get(header)
+        if reset is not None:
+            try:
+                return float(reset)
+            except ValueError:
+                pass
+
+    return None
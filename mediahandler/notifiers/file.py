@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""
+Module: mediahandler.notifiers.file
+
+Module contains:
+
+    - |MHFile|
+        Child class of MHNotifier which appends messages to a local file.
+
+"""
+
+import time
+import logging
+import threading
+from json import dumps
+
+import mediahandler.notifiers
+
+# Guards writing to the file from several sender threads
+_LOCK = threading.Lock()
+
+
+class MHFile(mediahandler.notifiers.MHNotifier):
+    """Child class of MHNotifier which appends messages to a local file.
+
+    Each message is written as a line of JSON with 'time', 'title' and
+    'message' keys.
+
+    Required argument:
+        - settings
+            Dict or MHSettings object with the 'path' setting.
+    """
+
+    required = ['path']
+
+    def send(self, conn_msg, conn_title):
+        """Appends a message to the file.
+        """
+
+        logging.debug("Writing notification to file: %s", self.path)
+
+        line = dumps({
+            'time': time.time(),
+            'title': conn_title,
+            'message': conn_msg,
+        })
+
+        with _LOCK:
+            with open(self.path, 'a') as sink:
+                sink.write(line + '\n')
+
+        return True
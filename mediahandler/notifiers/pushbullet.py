@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""
+Module: mediahandler.notifiers.pushbullet
+
+Module contains:
+
+    - |MHPushbullet|
+        Child class of MHNotifier for the Pushbullet service.
+
+"""
+
+import logging
+from json import dumps
+
+import mediahandler.notifiers
+
+# Error codes for rejected credentials
+__autherrors__ = [
+    'invalid_access_token',
+    'access_token_expired',
+]
+
+
+class MHPushbullet(mediahandler.notifiers.MHNotifier):
+    """Child class of MHNotifier for the Pushbullet service.
+
+    Required argument:
+        - settings
+            Dict or MHSettings object with the 'token' setting.
+    """
+
+    url = 'https://api.pushbullet.com/v2'
+    limit = 4096
+    required = ['token']
+    validates = True
+
+    def validate(self):
+        """Validates Pushbullet API credentials. Returns an error message if
+        they are not valid.
+
+        Connection errors are raised, so the check can be retried.
+        """
+
+        logging.debug("Validating Pushbullet credentials")
+
+        # Make request
+        try:
+            resp = self._make_request('/users/me', auth=(self.token, ''))
+        except ValueError as exc:
+            return 'Pushbullet: {0}'.format(exc)
+
+        # Check result
+        if 'error' in resp.keys():
+            return 'Pushbullet: {0}'.format(resp['error']['message'])
+
+        # Return success
+        logging.info("Pushbullet API credentials successfully validated")
+
+        return None
+
+    def send(self, conn_msg, conn_title):
+        """Sends a message via the Pushbullet API.
+        """
+
+        logging.debug("Sending Pushbullet notification")
+
+        # Set up json request data
+        request_data = dumps({
+            'type': 'note',
+            'title': conn_title,
+            'body': conn_msg,
+        })
+
+        # Make request
+        return self._make_request(
+            '/pushes', 'POST', data=request_data, auth=(self.token, ''),
+            headers={'Content-Type': 'application/json'})
+
+    def is_auth_error(self, resp):
+        """Returns True if Pushbullet rejected the credentials.
+        """
+
+        error = resp.get('error')
+
+        return isinstance(error, dict) and error.get('code') in __autherrors__
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""
+Module: mediahandler.notifiers.pushover
+
+Module contains:
+
+    - |MHPushover|
+        Child class of MHNotifier for the Pushover service.
+
+"""
+
+import logging
+
+import mediahandler.notifiers
+
+
+class MHPushover(mediahandler.notifiers.MHNotifier):
+    """Child class of MHNotifier for the Pushover service.
+
+    Required argument:
+        - settings
+            Dict or MHSettings object with the 'api_key' and 'user_key'
+            settings.
+    """
+
+    url = 'https://api.pushover.net/1'
+    limit = 1024
+    required = ['api_key', 'user_key']
+    validates = True
+
+    def validate(self):
+        """Validates Pushover API credentials. Returns an error message if
+        they are not valid.
+
+        Connection errors are raised, so the check can be retried.
+        """
+
+        logging.debug("Validating Pushover credentials")
+
+        # Make request
+        try:
+            resp = self._make_request(
+                '/users/validate.json', 'POST', data=self._get_params())
+        except ValueError as exc:
+            return 'Pushover: {0}'.format(exc)
+
+        # Check result
+        if not resp.get('status'):
+            return 'Pushover: {0}'.format(resp['errors'][0])
+
+        # Return success
+        logging.info("Pushover API credentials successfully validated")
+
+        return None
+
+    def send(self, conn_msg, conn_title):
+        """Sends a message via the Pushover API.
+        """
+
+        logging.debug("Sending Pushover notification")
+
+        # Add values to the request params
+        params = self._get_params()
+        params["title"] = conn_title
+        params["message"] = conn_msg
+
+        # Make request
+        return self._make_request('/messages.json', 'POST', data=params)
+
+    def is_auth_error(self, resp):
+        """Returns True if Pushover rejected the credentials.
+        """
+        return resp.get('token') == 'invalid' or resp.get('user') == 'invalid'
+
+    def _get_params(self):
+        """Returns the credential request params.
+        """
+        return {
+            'token': self.api_key,
+            'user': self.user_key,
+        }
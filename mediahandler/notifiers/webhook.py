@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""
+Module: mediahandler.notifiers.webhook
+
+Module contains:
+
+    - |MHWebhook|
+        Child class of MHNotifier which posts messages as JSON to a URL.
+
+"""
+
+import logging
+
+import mediahandler.notifiers
+
+
+class MHWebhook(mediahandler.notifiers.MHNotifier):
+    """Child class of MHNotifier which posts messages as JSON to a URL.
+
+    Each message is sent as an object with 'title' and 'message' keys.
+
+    Required argument:
+        - settings
+            Dict or MHSettings object with the 'url' setting.
+    """
+
+    required = ['url']
+
+    def send(self, conn_msg, conn_title):
+        """Posts a message to the webhook URL. Returns the response status
+        code.
+        """
+
+        logging.debug("Sending webhook notification")
+
+        resp = self._request('', 'POST', json={
+            'title': conn_title,
+            'message': conn_msg,
+        })
+
+        return resp.status_code
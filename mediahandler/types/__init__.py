@@ -41,6 +41,8 @@ from subprocess import Popen, PIPE
 from re import findall, search, sub, IGNORECASE
 
 import mediahandler as mh
+import mediahandler.util.filebot as Filebot
+import mediahandler.util.inventory as Inventory
 
 
 class MHMediaType(mh.MHObject):
@@ -53,10 +55,14 @@ class MHMediaType(mh.MHObject):
         - push
             MHPush object.
 
-    Public method:
+    Public methods:
         - |add()|
             Main wrapper function for adding media files. Processes
             calls to Beets and Filebot.
+
+        - |add_batch()|
+            Adds several media files or folders with a single call
+            to Filebot.
     """
 
     def __init__(self, settings, push):
@@ -74,6 +80,7 @@ class MHMediaType(mh.MHObject):
 
         # Set up class members
         self.push = push
+        self.inventory = None
         self.dst_path = ''
         self.type = sub(r'^mh', '', type(self).__name__.lower())
 
@@ -142,11 +149,59 @@ class MHMediaType(mh.MHObject):
         logging.info("Starting %s handler", self.type)
 
         # Set up query
-        m_cmd = [self.filebot,
-                 '-rename', file_path,
-                 '--db', self.cmd.db,
-                 '--format', self.cmd.format,
-                 '--action', self.cmd.action]
+        m_cmd = self._get_command([file_path])
+
+        return self._media_info(m_cmd, file_path)
+
+    def add_batch(self, file_paths):
+        """Adds several media files or folders with a single call to Filebot,
+        so the JVM only starts once.
+
+        Returns a dict of each file path and its result, which is either the
+        results and skipped files tuple returned by add(), or the SystemExit
+        raised if the path could not be matched.
+        """
+
+        logging.info("Starting %s batch handler: %s files",
+                     self.type, len(file_paths))
+
+        # Set up query
+        m_cmd = self._get_command(file_paths)
+        logging.debug("Query: %s", m_cmd)
+
+        # Process query
+        output = self._run_query(m_cmd)
+
+        # Parse each path's output separately
+        results = {}
+        outputs = self._split_output(output, file_paths)
+        for file_path in file_paths:
+            try:
+                results[file_path] = self._process_output(
+                    outputs[file_path], file_path)
+            except SystemExit as err:
+                results[file_path] = err
+
+        return results
+
+    def _get_command(self, file_paths):
+        """Builds the Filebot CLI query for the provided file paths.
+        """
+
+        # If ignoring subtitles, only send video files or remove the rest
+        if self.ignore_subs:
+            logging.debug("Ignoring subtitle files")
+            if self.filter_files:
+                file_paths = self._get_video_files(file_paths)
+            else:
+                for file_path in file_paths:
+                    self._remove_bad_files(file_path)
+
+        m_cmd = [self.filebot, '-rename']
+        m_cmd.extend(file_paths)
+        m_cmd.extend(['--db', self.cmd.db,
+                      '--format', self.cmd.format,
+                      '--action', self.cmd.action])
         m_cmd.extend(self.cmd.flags)
 
         # Check for logfile
@@ -156,12 +211,7 @@ class MHMediaType(mh.MHObject):
                 '--log-file', self.log_file]
             m_cmd.extend(loginfo)
 
-        # If ignoring subtitles, remove all non-video files
-        if self.ignore_subs:
-            logging.debug("Ignoring subtitle files")
-            self._remove_bad_files(file_path)
-
-        return self._media_info(m_cmd, file_path)
+        return m_cmd
 
     def _media_info(self, cmd, file_path):
         """Makes request to Beets and Filebot.
@@ -171,6 +221,23 @@ class MHMediaType(mh.MHObject):
 
         logging.debug("Query: %s", cmd)
 
+        # Process query
+        output = self._run_query(cmd)
+
+        return self._process_output(output, file_path)
+
+    @staticmethod
+    def _run_query(cmd):
+        """Runs a Beets or Filebot query and returns its combined output.
+
+        Uses the shared Filebot server, if one is running.
+        """
+
+        # Try the Filebot server first
+        output = Filebot.run_query(cmd)
+        if output is not None:
+            return output
+
         # Process query
         query = Popen(cmd, stdout=PIPE, stderr=PIPE)
 
@@ -179,7 +246,39 @@ class MHMediaType(mh.MHObject):
         logging.debug("Query output: %s", output)
         logging.debug("Query return errors: %s", err)
 
-        return self._process_output(output + err, file_path)
+        return output + err
+
+    @staticmethod
+    def _split_output(output, file_paths):
+        """Splits the output of a batch query into the lines belonging to
+        each file path.
+
+        Lines are matched to a path by the source file named in square
+        brackets, e.g. ::
+
+            [COPY] From [/path/to/source.mkv] to [/path/to/dest.mkv]
+        """
+
+        # Convert output to str, if needed
+        if not isinstance(output, str):
+            output = output.decode('utf-8')
+
+        # Check longer paths first, in case they are nested
+        ordered = sorted(file_paths, key=len, reverse=True)
+        sources = dict((file_path, os.path.abspath(file_path))
+                       for file_path in file_paths)
+
+        outputs = dict((file_path, []) for file_path in file_paths)
+        for line in output.splitlines():
+            for file_path in ordered:
+                source = sources[file_path]
+                folder = source.rstrip(os.path.sep) + os.path.sep
+                if '[{0}]'.format(source) in line or '[' + folder in line:
+                    outputs[file_path].append(line)
+                    break
+
+        return dict((file_path, '\n'.join(lines) + '\n')
+                    for (file_path, lines) in outputs.items())
 
     def _process_output(self, output, file_path):
         """Parses response from _media_info() query.
@@ -226,23 +325,76 @@ class MHMediaType(mh.MHObject):
         """
 
         logging.info("Removing bad files")
+        inventory = self._get_inventory(file_path)
+
         # Skip if this is not a folder
-        if os.path.isfile(file_path):
+        if not inventory.is_dir(file_path):
             return
 
-        # Look for bad files and remove them
+        # Look for non-video files anywhere in the folder and remove them
         regex = r'\.{0}$'.format(self.query.file_types)
-        for item in os.listdir(file_path):
+        for entry in inventory.files(file_path):
+            if not search(regex, entry.name):
+                os.unlink(entry.path)
+                inventory.discard(entry.path)
 
-            item_path = os.path.join(file_path, item)
+    def _get_video_files(self, file_paths):
+        """Returns the video files in each of the file paths, so only they
+        are sent to Filebot and nothing is deleted.
+
+        Videos smaller than the 'sample_size' setting, in MB, are skipped
+        as samples or extras, unless they are all that a folder holds.
+        A folder with no videos is sent as it is.
+
+        Only used when the 'ignore_subs' and 'filter_files' settings are
+        True.
+        """
+
+        logging.info("Filtering video files")
+
+        regex = r'\.{0}$'.format(self.query.file_types)
+        min_size = (self.sample_size or 0) * 1024 * 1024
+
+        video_files = []
+        for file_path in file_paths:
+            inventory = self._get_inventory(file_path)
+
+            # Single files are sent as they are
+            if not inventory.is_dir(file_path):
+                video_files.append(file_path)
+                continue
+
+            videos = sorted(
+                (entry for entry in inventory.files(file_path)
+                 if search(regex, entry.name, IGNORECASE)),
+                key=lambda entry: entry.path)
+
+            # Skip samples, if there is a bigger video
+            if any(entry.size >= min_size for entry in videos):
+                for entry in videos:
+                    if entry.size < min_size:
+                        logging.debug("Skipping sample file: %s", entry.path)
+                videos = [entry for entry in videos if entry.size >= min_size]
+
+            if not videos:
+                video_files.append(file_path)
+                continue
+
+            video_files.extend(entry.path for entry in videos)
+
+        logging.debug("Video files: %s", len(video_files))
+
+        return video_files
+
+    def _get_inventory(self, file_path):
+        """Returns the job's MHInventory if it holds the file path, or a
+        new one of just the file path.
+        """
 
-            # If it's a folder, iterate again
-            if os.path.isdir(item_path):
-                self._remove_bad_files(item_path)
+        if self.inventory is not None and self.inventory.exists(file_path):
+            return self.inventory
 
-            # Otherwise check for non-video files
-            elif not search(regex, item):
-                os.unlink(item_path)
+        return Inventory.MHInventory(file_path)
 
     def _match_error(self, name):
         """Returns a match error via the MHPush object.
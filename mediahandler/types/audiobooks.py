@@ -35,10 +35,7 @@ from math import ceil
 from shutil import copy, move
 from subprocess import Popen, PIPE
 from os import path, listdir, makedirs
-
-from googleapiclient.discovery import build
-from mutagen.mp3 import MP3
-from mutagen.ogg import OggFileType
+from importlib import import_module
 
 import mediahandler as mh
 
@@ -66,6 +63,9 @@ def get_book_info(api_key, query):
 
     logging.info("Querying Google Books")
 
+    # Import modules
+    from googleapiclient.discovery import build
+
     # Connect to Google Books API
     service = build('books', 'v1', developerKey=api_key)
 
@@ -159,6 +159,7 @@ class MHAudiobook(mh.MHObject):
         # Set globals
         self.book_info = {}
         self.push = push
+        self.inventory = None
         self.orig_path = None
         self.file_type = None
         self.type = re.sub(r'^mh', '', type(self).__name__.lower())
@@ -170,8 +171,8 @@ class MHAudiobook(mh.MHObject):
                 "c": r"\.(m4b)$",
             },
             'audio': {
-                'MP3': MP3,
-                'OGG': OggFileType,
+                'MP3': 'mutagen.mp3.MP3',
+                'OGG': 'mutagen.ogg.OggFileType',
             },
         })
 
@@ -405,8 +406,11 @@ class MHAudiobook(mh.MHObject):
         book_files = []
         file_list = []
 
-        # Get list of files
-        file_list = listdir(file_dir)
+        # Get list of files, from the job's inventory if it holds them
+        if self.inventory is not None and self.inventory.is_dir(file_dir):
+            file_list = self.inventory.listdir(file_dir)
+        else:
+            file_list = listdir(file_dir)
 
         # loop through all the files in dir
         for item in sorted(file_list):
@@ -567,10 +571,14 @@ class MHAudiobook(mh.MHObject):
         total_length = 0
         book_parts = 0
 
+        # Import the mutagen class for the file type
+        (module, audio_class) = getattr(self.audio, file_type).rsplit('.', 1)
+        audio_class = getattr(import_module(module), audio_class)
+
         # Sum all the file durations
         for get_file in file_array:
             full_path = path.join(file_path, get_file)
-            audio_track = getattr(self.audio, file_type)(full_path)
+            audio_track = audio_class(full_path)
             total_length += audio_track.info.length
             logging.debug("%s:  %s", get_file, audio_track.info.length)
         logging.debug("Total book length: %s seconds", total_length)
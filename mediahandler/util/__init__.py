@@ -30,12 +30,27 @@ Submodules:
         file provided.
 
     - |mediahandler.util.extract|
-        Uses Filebot to extract compressed files for processing.
+        Extracts compressed files for processing, in-process where
+        possible and with Filebot otherwise.
+
+    - |mediahandler.util.filebot|
+        Keeps a Filebot process running to handle rename queries.
+
+    - |mediahandler.util.inventory|
+        Lists the files in a download once for every stage of a job.
+
+    - |mediahandler.util.jobs|
+        Runs queued media jobs on per-media type worker pools.
 
     - |mediahandler.util.notify|
         Sends push notifications out via 3rd party services.
 
     - |mediahandler.util.torrent|
-        Removes torrents from Deluge upon completion.
+        Connects to Deluge, sharing one connection between a client which
+        removes torrents upon completion and a listener which adds
+        downloads as their torrents finish.
+
+    - |mediahandler.util.watch|
+        Watches media type drop folders for new downloads.
 
 """
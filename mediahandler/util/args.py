@@ -51,7 +51,30 @@ from re import match, I
 
 import mediahandler as mh
 import mediahandler.util.config as Config
-import mediahandler.util.torrent as Torrent
+
+# Shared parser returned by get_parser()
+_PARSER = None
+
+# Valid add_media() keyword arguments and the parser 'dest' they set
+__mediaoptions__ = {
+    'type': 'type',
+    'query': 'query',
+    'single': 'single_track',
+    'nopush': 'no_push',
+    'config': 'config',
+}
+
+# Option strings of the parser arguments checked by get_add_media_args()
+__optionstrings__ = {
+    'type': ['-t', '--type'],
+    'config': ['-c', '--config'],
+    'query': ['-q', '--query'],
+    'single_track': ['-s', '--single'],
+    'no_push': ['-n', '--nopush'],
+}
+
+# Valid values for the -t/--type option
+__typechoices__ = [1, 2, 3, 4]
 
 
 # Custom argparse validation
@@ -225,6 +248,10 @@ class MHParser(argparse.ArgumentParser):
         # Remove added attribute
         delattr(args, 'entered')
 
+        # Look up the default config file only when it is needed
+        if 'config' in args and args.config is None:
+            args.config = Config.make_config()
+
         return args, argv
 
     def error(self, message):
@@ -260,6 +287,20 @@ class MHParser(argparse.ArgumentParser):
 def get_parser():
     """Returns the custom MHParser object for mediahandler usage.
 
+    The parser is only built once, then shared by every caller.
+    """
+
+    global _PARSER
+
+    if _PARSER is None:
+        _PARSER = _make_parser()
+
+    return _PARSER
+
+
+def _make_parser():
+    """Builds the custom MHParser object for mediahandler usage.
+
     Sets up the MHParser object details and adds all of the arguments used
     by the mediahandler CLI 'addmedia' script.
     """
@@ -285,7 +326,7 @@ def get_parser():
 
     # Required media option
     options.add_argument(
-        'media',
+        'media', nargs='?', default=argparse.SUPPRESS,
         help=(
             'REQUIRED. Set path to media files.\n' +
             'Assumes structure: /path/to/<media type>/<media>\n '),
@@ -294,17 +335,17 @@ def get_parser():
 
     # Type option
     options.add_argument(
-        '-t', '--type',
+        *__optionstrings__['type'],
         help=(
             'Force a specific media type (see below).\n' +
             'Default: <media type> derived from --files path\n '),
-        type=int, choices=[1, 2, 3, 4],
+        type=int, choices=__typechoices__,
         action=MHTypeAction
     )
 
     # Custom config file option
     options.add_argument(
-        '-c', '--config', default=Config.make_config(),
+        *__optionstrings__['config'], default=None,
         help=(
             'Set a custom config file path.\n' +
             'Default: ~/.config/mediahandler/config.yml\n '),
@@ -313,7 +354,7 @@ def get_parser():
 
     # Audiobook query option
     options.add_argument(
-        '-q', '--query',
+        *__optionstrings__['query'],
         help=(
             'Set a custom query string for audiobooks.\n' +
             'Useful for fixing "Unable to match" errors.\n '),
@@ -321,7 +362,7 @@ def get_parser():
 
     # Single track processing option
     options.add_argument(
-        '-s', '--single', default=False,
+        *__optionstrings__['single_track'], default=False,
         help=(
             'Force beets to import music as a single track.\n' +
             'Useful for fixing "items were skipped" errors.\n '),
@@ -330,13 +371,40 @@ def get_parser():
 
     # Disable push notification option
     options.add_argument(
-        '-n', '--nopush', default=False,
+        *__optionstrings__['no_push'], default=False,
         help=(
             'Disable push notifications.\n' +
             'Overrides the "enabled" config file setting.\n '),
         dest='no_push', action='store_true',
     )
 
+    # Daemon mode option
+    options.add_argument(
+        '-d', '--daemon', default=argparse.SUPPRESS,
+        help=(
+            'Run as a daemon which watches the Daemon watch_folder\n' +
+            'and adds new downloads as they arrive.\n '),
+        action='store_true',
+    )
+
+    # Deluge listener option
+    options.add_argument(
+        '--deluge-listen', default=argparse.SUPPRESS,
+        help=(
+            'Run as a daemon which connects to Deluge and adds\n' +
+            'downloads as their torrents finish.\n '),
+        dest='deluge_listen', action='store_true',
+    )
+
+    # Application report option
+    options.add_argument(
+        '--doctor', default=argparse.SUPPRESS,
+        help=(
+            'Show the path and version of each application\n' +
+            'used by mediahandler and exit.\n '),
+        action='store_true',
+    )
+
     # Show help option
     options.add_argument(
         '-h', '--help',
@@ -404,8 +472,9 @@ def get_deluge_arguments():
     get_deluge_parser() to validate them.
 
     Returns the full file path to the config file in use and a dict of
-    validated arguments from the MHParser object. Also removes the torrent
-    from Deluge, if the user's settings allow it.
+    validated arguments from the MHParser object. The torrent hash is
+    returned as 'torrent_hash', so MHandler can remove the torrent from
+    Deluge once its media has been added.
     """
 
     # Retreive full parser
@@ -427,10 +496,8 @@ def get_deluge_arguments():
     # Remove config to return separately
     config = all_args.pop('config')
 
-    # Remove torrent
-    settings = Config.parse_config(config)['Deluge']
-    if settings['enabled']:
-        Torrent.remove_deluge_torrent(settings, new_args['hash'])
+    # Torrent is removed once its media has been added
+    all_args['torrent_hash'] = new_args['hash']
 
     return config, all_args
 
@@ -458,6 +525,12 @@ def get_arguments(deluge=False):
     # Get validated args from parser
     new_args = parser.parse_args().__dict__
 
+    # Media is only optional in daemon, listener and doctor modes
+    if ('media' not in new_args and not new_args.get('daemon') and
+            not new_args.get('deluge_listen') and
+            not new_args.get('doctor')):
+        parser.error('the following arguments are required: media')
+
     # Remove config to return separately
     config = new_args.pop('config')
 
@@ -466,35 +539,109 @@ def get_arguments(deluge=False):
 
 def get_add_media_args(media, **kwargs):
     """Takes arguments passed in from the mediahandler.handler.add_media()
-    function, formats them into an array, and sends them to get_parser()
-    for validation.
+    function and validates them with the same checks as the CLI.
+
+    The values are checked directly with the MHParser argument actions,
+    so the command line does not need to be built and parsed each time.
 
     Returns a dict of validated arguments from the MHParser object.
     """
 
-    # Set up args from input
-    args = [media]
+    parser = get_parser()
+
+    # Start with the parser defaults
+    namespace = argparse.Namespace()
+    for dest in ['type', 'query', 'single_track', 'no_push']:
+        setattr(namespace, dest, parser.get_default(dest))
+
+    # Look up options, collecting any the CLI would not recognize
+    options = {}
+    unknown = []
     for key, value in kwargs.items():
 
         # Skip if value is null
         if not value:
             continue
 
-        # Set up flag & append to args array
-        flag = '--{0}'.format(key)
-        args.append(flag)
+        # Flags only take a bool, as they have no value on the CLI
+        is_flag = __mediaoptions__.get(key) in ['single_track', 'no_push']
+        is_bool = isinstance(value, bool)
 
-        #
-        if not isinstance(value, bool):
-            args.append(str(value))
+        if key not in __mediaoptions__:
+            unknown.append('--{0}'.format(key))
+            if not is_bool:
+                unknown.append(str(value))
+            continue
 
-    # Set up parser
-    parser = get_parser()
+        if is_flag and not is_bool:
+            unknown.append(str(value))
+        elif not is_flag and (is_bool or _is_option_like(value)):
+            parser.error('argument {0}: expected one argument'.format(
+                _get_option_name(__mediaoptions__[key])))
+
+        options[__mediaoptions__[key]] = value
+
+    # Validate media type
+    if 'type' in options:
+        try:
+            media_type = int(str(options['type']))
+        except ValueError:
+            parser.error("argument {0}: invalid int value: '{1}'".format(
+                _get_option_name('type'), options['type']))
+        if media_type not in __typechoices__:
+            parser.error('argument {0}: invalid choice: {1!r} '
+                         '(choose from {2})'.format(
+                             _get_option_name('type'), media_type,
+                             ', '.join(map(repr, __typechoices__))))
+        MHTypeAction(__optionstrings__['type'], 'type')(
+            parser, namespace, media_type)
+
+    # Validate media path, only detecting the type if not provided
+    namespace.entered = ['--type'] if 'type' in options else []
+    MHMediaAction([], 'media')(parser, namespace, media)
+    delattr(namespace, 'entered')
+
+    # Validate config path
+    if 'config' in options:
+        MHFilesAction(__optionstrings__['config'], 'config')(
+            parser, namespace, options['config'])
+        delattr(namespace, 'config')
+
+    # Set other values
+    if 'query' in options:
+        namespace.query = str(options['query'])
+    for dest in ['single_track', 'no_push']:
+        if dest in options:
+            setattr(namespace, dest, True)
+
+    # Unknown options are reported last, as they are by argparse
+    if unknown:
+        parser.error('unrecognized arguments: {0}'.format(' '.join(unknown)))
+
+    return namespace.__dict__
+
+
+def _get_option_name(dest):
+    """Returns the option strings of an argument as argparse shows them
+    in error messages, e.g. '-t/--type'.
+    """
 
-    # Get validated args from parser
-    new_args = parser.parse_args(args).__dict__
+    return '/'.join(__optionstrings__.get(dest, [dest]))
 
-    # Remove config to return separately
-    new_args.pop('config')
 
-    return new_args
+def _is_option_like(value):
+    """Checks whether a value would be read as an option, rather than
+    an option's argument, by argparse on the command line.
+    """
+
+    value = str(value)
+
+    # Plain values and a lone '-' are always arguments
+    if not value.startswith('-') or value == '-':
+        return False
+
+    # Negative numbers and values with spaces are also arguments
+    if match(r'^-\d+$|^-\d*\.\d+$', value) or ' ' in value:
+        return False
+
+    return True
@@ -25,21 +25,60 @@ Module contains:
     - |parse_config()|
         Parses a yaml configuration file and returns a dict of the settings.
 
+    - |clear_cache()|
+        Removes the parsed settings cache for a configuration file.
+
+    - |compile_schema()|
+        Compiles the bundled yaml schema files into a python module.
+
+    - |get_app_report()|
+        Returns the path, modification time and version of each third-party
+        application used by mediahandler.
+
+    - |print_app_report()|
+        Writes the get_app_report() output to stdout for 'addmedia --doctor'.
+
+    - |dump_pickle()|
+        Safely pickles an object to a cache file.
+
+    - |search_path()|
+        Returns the full path of an executable in the user's $PATH.
+
 """
 
 import os
+import sys
+import time
+import pickle
+import hashlib
 import shutil
 import logging
-from importlib import import_module
+import tempfile
+from importlib.util import find_spec
+from importlib.machinery import PathFinder
+from subprocess import Popen, PIPE, STDOUT
 
 import mediahandler as mh
 import mediahandler.util as Util
 
 try:
     import yaml
+    _YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 except ImportError:
     pass
 
+# Resolved application paths, shared by every parse_config() call
+_APP_CACHE = None
+
+# Layout of the settings cache file, changed when its contents change
+_CACHE_FORMAT = 2
+
+# Bundled yaml schema files compiled by compile_schema()
+__schemafiles__ = [
+    'settings.yml',
+    'require.yml',
+]
+
 
 def make_config(new_file=None):
     """Generates default yaml mediahandler configuration file.
@@ -95,21 +134,39 @@ def make_config(new_file=None):
     return config_file
 
 
-def parse_config(file_path):
+def parse_config(file_path, use_cache=True):
     """Reads and parses a yaml mediahandler configuration file.
 
-    Optional argument:
+    Required argument:
         - file_path
             Path to a valid yaml mediahandler configuration file.
 
+    Optional argument:
+        - use_cache
+            Whether or not to use the parsed settings cache. Default
+            is True.
+
     Uses settings.yml validation structure to build missing and default
     values. Sends values to the correct _get_valid_<type>() function
     for validation.
+
+    The validated settings are saved to a cache file next to the
+    configuration file, which is used until the configuration file,
+    settings.yml or require.yml change. On a cache hit only the cheap
+    checks are repeated: the applications, folders and python modules
+    found are checked to still exist, and the settings are parsed again
+    if any are missing.
     """
 
+    # Look for cached settings
+    if use_cache:
+        settings = _read_cache(file_path)
+        if settings is not None:
+            return settings
+
     # Read yaml files
     parsed = _get_yaml(file_path)
-    struct = _get_yaml(os.path.join(mh.__mediaextras__, 'settings.yml'))
+    struct = _get_schema('settings.yml')
 
     # Define section function
     def _process_section(get_section, get_options, get_parsed):
@@ -171,11 +228,191 @@ def parse_config(file_path):
             section, item['options'], parsed)
 
     # Check that appropriate modules are installed
-    _check_modules(settings)
+    apps = []
+    _check_modules(settings, apps)
+
+    # Save settings for next time
+    if use_cache:
+        _write_cache(file_path, settings, apps)
 
     return settings
 
 
+def clear_cache(file_path):
+    """Removes the parsed settings cache for a configuration file.
+
+    Required argument:
+        - file_path
+            Path to a yaml mediahandler configuration file.
+    """
+
+    cache_file = _get_cache_file(file_path)
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+
+
+def compile_schema(module_file=None):
+    """Compiles the bundled yaml schema files into a python module.
+
+    Optional argument:
+        - module_file
+            Path to write the module to. Defaults to the _schema.py file
+            in this package.
+
+    Run by setup.py when the package is built, so the settings.yml and
+    require.yml files do not need to be parsed on every run.
+    """
+
+    if module_file is None:
+        module_file = os.path.join(os.path.dirname(__file__), '_schema.py')
+
+    # Parse each schema file
+    schema = {}
+    for name in __schemafiles__:
+        with open(os.path.join(mh.__mediaextras__, name), 'rb') as yaml_io:
+            contents = yaml_io.read()
+        schema[name] = {
+            'digest': hashlib.sha1(contents).hexdigest(),
+            'data': yaml.load(contents, Loader=_YAML_LOADER),
+        }
+
+    # Write module
+    with open(module_file, 'w') as module_io:
+        module_io.write('# -*- coding: utf-8 -*-\n')
+        module_io.write('"""Generated by mediahandler.util.config.'
+                        'compile_schema(). Do not edit."""\n\n')
+        module_io.write('SCHEMA = {0!r}\n'.format(schema))
+
+    return module_file
+
+
+def get_app_report():
+    """Returns the path, modification time and version of each third-party
+    application used by mediahandler.
+
+    Returns a list of dicts, one per application listed in require.yml,
+    with its 'name', 'exec', the 'sections' which use it, and its 'path',
+    'mtime' and 'version' (or None if it was not found). Versions are saved
+    in the resolved application cache until the application changes.
+    """
+
+    report = []
+    require = _get_schema('require.yml')
+
+    for section in require:
+        for app in require[section].get('apps', []):
+
+            # Combine apps used by several sections
+            item = [i for i in report if i['exec'] == app['exec']]
+            if item:
+                item[0]['sections'].append(section)
+                continue
+
+            item = {
+                'name': app['name'],
+                'exec': app['exec'],
+                'sections': [section],
+                'path': None,
+                'mtime': None,
+                'version': None,
+            }
+            report.append(item)
+
+            # Look up app
+            found = _get_app(app['exec'], refresh=True)
+            if found is None:
+                continue
+
+            # Check the version, if it is not already known
+            if found['version'] is None and 'version' in app:
+                version = _get_app_version(found['path'], app['version'])
+                found = dict(found, version=version or '')
+                _save_app(app['exec'], found)
+
+            item.update(found)
+
+    return report
+
+
+def print_app_report():
+    """Writes the get_app_report() output to stdout for 'addmedia --doctor'.
+
+    Returns the get_app_report() list.
+    """
+
+    report = get_app_report()
+
+    sys.stdout.write('\nEM Media Handler v{0} / by {1}\n\n'.format(
+        mh.__version__, mh.__author__))
+    sys.stdout.write('Applications:\n\n')
+
+    for item in report:
+        sys.stdout.write('  {0} ({1})\n'.format(
+            item['name'], ', '.join(item['sections'])))
+
+        if item['path'] is None:
+            sys.stdout.write('    Not found in $PATH: {0}\n\n'.format(
+                item['exec']))
+            continue
+
+        sys.stdout.write('    Path:     {0}\n'.format(item['path']))
+        sys.stdout.write('    Modified: {0}\n'.format(time.strftime(
+            '%Y-%m-%d %H:%M:%S', time.localtime(item['mtime']))))
+        sys.stdout.write('    Version:  {0}\n\n'.format(
+            item['version'] or 'Unknown'))
+
+    return report
+
+
+def dump_pickle(cache_file, cache):
+    """Pickles an object to a cache file.
+
+    Used by each of the mediahandler caches. The cache is written to a
+    temporary file first, so other processes never read a partial cache.
+    """
+
+    try:
+        (handle, tmp_file) = tempfile.mkstemp(
+            dir=os.path.dirname(cache_file), prefix='.tmp-cache-')
+    except OSError as err:
+        logging.debug("Unable to write cache: %s", err)
+        return
+
+    try:
+        with os.fdopen(handle, 'wb') as cache_io:
+            pickle.dump(cache, cache_io, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as err:
+        logging.debug("Unable to write cache: %s", err)
+        os.remove(tmp_file)
+
+
+def search_path(app_exec):
+    """Returns the full path of an executable in the user's local $PATH,
+    or None if it is not found.
+    """
+
+    # Retrieve local paths
+    split_token = ';' if mh.__iswin__ else ':'
+    local_paths = os.environ['PATH'].rsplit(split_token)
+
+    # Look for app in local paths
+    for local_path in local_paths:
+        path = os.path.join(local_path, app_exec)
+
+        # If the path exists, return it
+        if os.path.isfile(path):
+            return path
+
+        # Try .exe for windows
+        if mh.__iswin__:
+            win_path = path + '.exe'
+            if os.path.isfile(win_path):
+                return win_path
+
+    return None
+
+
 def _modify_config_for_windows(config_file):
     """Modifies config file to use windows-formatted paths.
     """
@@ -292,11 +529,177 @@ def _get_yaml(yaml_file):
         yaml_contents = yaml_io.read()
 
     # Decode yaml
-    contents = yaml.load(yaml_contents)
+    contents = yaml.load(yaml_contents, Loader=_YAML_LOADER)
 
     return contents
 
 
+def _get_schema(name):
+    """Retrieves a bundled yaml schema file.
+
+    Uses the compiled schema module when it is present and matches the
+    yaml file, otherwise parses the yaml file.
+    """
+
+    yaml_file = os.path.join(mh.__mediaextras__, name)
+
+    # Look for a compiled schema
+    try:
+        from mediahandler.util._schema import SCHEMA
+        compiled = SCHEMA[name]
+    except (ImportError, KeyError):
+        return _get_yaml(yaml_file)
+
+    # Make sure it is up to date
+    with open(yaml_file, 'rb') as yaml_io:
+        digest = hashlib.sha1(yaml_io.read()).hexdigest()
+    if digest != compiled['digest']:
+        logging.debug("Compiled schema out of date: %s", name)
+        return _get_yaml(yaml_file)
+
+    return compiled['data']
+
+
+def _get_cache_file(file_path):
+    """Returns the path to the parsed settings cache for a configuration file.
+    """
+
+    (folder, name) = os.path.split(os.path.abspath(file_path))
+
+    return os.path.join(folder, '.{0}.cache'.format(name))
+
+
+def _get_cache_key(file_path):
+    """Returns the key used to check that a settings cache is current.
+
+    Made up of the modification time and size of the configuration file,
+    settings.yml and require.yml, along with the mediahandler version, the
+    cache file format and the $PATH used to find applications.
+    """
+
+    key = [mh.__version__, _CACHE_FORMAT, os.environ.get('PATH')]
+    for yaml_file in [file_path,
+                      os.path.join(mh.__mediaextras__, 'settings.yml'),
+                      os.path.join(mh.__mediaextras__, 'require.yml')]:
+        stat = os.stat(yaml_file)
+        key.append((os.path.abspath(yaml_file), stat.st_mtime_ns,
+                    stat.st_size))
+
+    return key
+
+
+def _read_cache(file_path):
+    """Returns the cached settings for a configuration file, or None if
+    there is no current cache.
+    """
+
+    cache_file = _get_cache_file(file_path)
+
+    try:
+        key = _get_cache_key(file_path)
+        with open(cache_file, 'rb') as cache_io:
+            cache = pickle.load(cache_io)
+    except (OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, IndexError, TypeError):
+        return None
+
+    # Check that the cache is current
+    if not isinstance(cache, dict) or cache.get('key') != key:
+        logging.debug("Settings cache is out of date: %s", cache_file)
+        return None
+
+    # Check that the applications found are still there
+    for app_path in cache['apps']:
+        if not os.path.isfile(app_path):
+            logging.debug("Cached application missing: %s", app_path)
+            return None
+
+    # Check that the folders validated are still there
+    for folder in cache['folders']:
+        if not os.path.exists(folder):
+            logging.debug("Cached folder missing: %s", folder)
+            return None
+
+    # Check that the modules found are still installed
+    for module in cache['modules']:
+        try:
+            _find_module(module[0], module[1])
+        except ImportError:
+            logging.debug("Cached module missing: %s.%s", *module)
+            return None
+
+    settings = cache['settings']
+
+    # Turn on logging
+    if settings['Logging']['enabled']:
+        _init_logging(settings)
+        logging.info('Logging enabled')
+
+    logging.debug("Using settings cache: %s", cache_file)
+
+    return settings
+
+
+def _write_cache(file_path, settings, apps):
+    """Saves parsed settings to the cache file for a configuration file.
+    """
+
+    dump_pickle(_get_cache_file(file_path), {
+        'key': _get_cache_key(file_path),
+        'settings': settings,
+        'apps': apps,
+        'folders': _get_folders(settings),
+        'modules': _get_modules(settings),
+    })
+
+
+def _get_folders(settings):
+    """Returns the folders that were checked when validating settings.
+
+    These are the values of folder type options and the parent folders
+    of file type options.
+    """
+
+    folders = []
+
+    # Define section function
+    def _find_folders(options, values):
+        """Adds the folders checked for a section of options.
+        """
+
+        for item_option in options:
+            value = values.get(item_option['name'])
+
+            if item_option['type'] == 'section':
+                _find_folders(item_option['options'], value or {})
+            elif value is None:
+                continue
+            elif item_option['type'] == 'folder':
+                folders.append(value)
+            elif item_option['type'] == 'file':
+                folders.append(os.path.dirname(value))
+
+    for item in _get_schema('settings.yml')['items']:
+        _find_folders(item['options'], settings.get(item['section'], {}))
+
+    return folders
+
+
+def _get_modules(settings):
+    """Returns the python modules required by user-enabled options.
+    """
+
+    modules = []
+    require = _get_schema('require.yml')
+
+    for section in require:
+        item = require[section]
+        if settings[section][item['option']]:
+            modules.extend(tuple(module) for module in item.get('modules', []))
+
+    return modules
+
+
 def _init_logging(settings):
     """Turns on logging for the mediahandler object.
 
@@ -336,12 +739,15 @@ def _init_logging(settings):
             log.setup_logger()
 
 
-def _check_modules(settings):
+def _check_modules(settings, apps=None):
     """Looks for modules and applications required by user-enabled options.
 
     Uses the require.yml settings to determine which python modules or third-
     party applications are needed for a given enabled option and then checks
     the user's system to see if they are installed.
+
+    The paths of the applications found are added to the 'apps' list,
+    if provided.
     """
 
     # Check for logging
@@ -350,7 +756,7 @@ def _check_modules(settings):
         logging.info('Logging enabled')
 
     # Retrieve module info from yaml file
-    require = _get_yaml(os.path.join(mh.__mediaextras__, 'require.yml'))
+    require = _get_schema('require.yml')
 
     # Look for modules & apps
     for section in require:
@@ -369,31 +775,43 @@ def _check_modules(settings):
             if 'apps' in item.keys():
                 for app in item['apps']:
                     _find_app(settings[section], app)
+                    if apps is not None:
+                        apps.append(settings[section][app['name'].lower()])
 
 
 def _find_module(parent_mod, sub_mod):
-    """Attempts to load a python module.
+    """Checks that a python module is installed, without importing it.
 
     Raises an ImportError if a python module and submodule is not installed
     on the user's system.
     """
 
+    # Look for the module, then for the submodule inside of it
     try:
-        # Attempt to import the module
-        import_module('{0}.{1}'.format(parent_mod, sub_mod))
-
-        return True
-
-    except ImportError:
-        # Otherwise raise an Import error
+        parent = find_spec(parent_mod)
+        found = (parent is not None and
+                 parent.submodule_search_locations is not None and
+                 PathFinder.find_spec(
+                     '{0}.{1}'.format(parent_mod, sub_mod),
+                     parent.submodule_search_locations) is not None)
+    except (ImportError, ValueError):
+        found = False
+
+    # Otherwise raise an Import error
+    if not found:
         err_msg = 'Module {0}.{1} is not installed'.format(parent_mod, sub_mod)
 
         raise ImportError(err_msg)
 
+    return True
+
 
 def _find_app(settings, app):
     """Looks for an installed application in the user's local $PATH.
 
+    Uses the resolved application cache, so the $PATH is only searched
+    when the application has not been found before or has gone missing.
+
     Raises an ImportError if the application is not found.
     """
 
@@ -401,27 +819,133 @@ def _find_app(settings, app):
     name = app['name'].lower()
     settings[name] = None
 
-    # Retrieve local paths
-    split_token = ';' if mh.__iswin__ else ':'
-    local_paths = os.environ['PATH'].rsplit(split_token)
-
-    # Look for app in local paths
-    for local_path in local_paths:
-        path = os.path.join(local_path, app['exec'])
-
-        # If the path exists, store & exit the loop
-        if os.path.isfile(path):
-            settings[name] = path
-            break
-
-        # Try .exe for windows
-        if mh.__iswin__:
-            win_path = path + '.exe'
-            if os.path.isfile(win_path):
-                settings[name] = win_path
-                break
+    # Look up app
+    found = _get_app(app['exec'])
+    if found is not None:
+        settings[name] = found['path']
 
     # If app not found, raise ImportError
     if settings[name] is None:
         error = '{0} application not found'.format(app['name'])
         raise ImportError(error)
+
+
+def _get_app_cache_file():
+    """Returns the path to the resolved application cache.
+    """
+    return os.path.join(os.path.expanduser("~"),
+                        '.config', 'mediahandler', '.apps.cache')
+
+
+def _load_app_cache():
+    """Returns the resolved application cache, loading it from disk on
+    first use. The cache is emptied if the $PATH has changed.
+    """
+
+    global _APP_CACHE
+
+    local_paths = os.environ.get('PATH')
+
+    # Load from disk
+    if _APP_CACHE is None:
+        try:
+            with open(_get_app_cache_file(), 'rb') as cache_io:
+                _APP_CACHE = pickle.load(cache_io)
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError, IndexError, TypeError):
+            _APP_CACHE = None
+
+    # Start over if the cache is unusable or for another $PATH
+    if (not isinstance(_APP_CACHE, dict) or
+            _APP_CACHE.get('PATH') != local_paths):
+        _APP_CACHE = {'PATH': local_paths, 'apps': {}}
+
+    return _APP_CACHE
+
+
+def _get_app(app_exec, refresh=False):
+    """Returns the cached info for an application executable: a dict of its
+    'path', 'mtime' and 'version'. Returns None if it is not found.
+
+    A cached path is revalidated with a single stat() call. The $PATH is
+    only searched again when the cached path is missing, or when 'refresh'
+    is True.
+    """
+
+    cache = _load_app_cache()
+    found = cache['apps'].get(app_exec)
+
+    # Check the cached path
+    if found is not None and not refresh:
+        try:
+            mtime = os.stat(found['path']).st_mtime
+        except OSError:
+            mtime = None
+
+        # Unchanged
+        if mtime == found['mtime']:
+            return found
+
+        # Updated in place, the version needs to be checked again
+        if mtime is not None:
+            found = dict(found, mtime=mtime, version=None)
+            _save_app(app_exec, found)
+            return found
+
+        logging.debug("Cached application missing: %s", found['path'])
+
+    # Search the $PATH
+    path = search_path(app_exec)
+    if path is None:
+        if app_exec in cache['apps']:
+            _save_app(app_exec, None)
+        return None
+
+    # Keep the cached version if nothing has changed
+    cached = found
+    found = {
+        'path': path,
+        'mtime': os.stat(path).st_mtime,
+        'version': None,
+    }
+    if cached is not None and cached['path'] == path:
+        if cached['mtime'] == found['mtime']:
+            return cached
+
+    _save_app(app_exec, found)
+
+    return found
+
+
+def _save_app(app_exec, found):
+    """Updates an application in the resolved application cache and writes
+    the cache to disk.
+    """
+
+    cache = _load_app_cache()
+    if found is None:
+        cache['apps'].pop(app_exec, None)
+    else:
+        cache['apps'][app_exec] = found
+
+    dump_pickle(_get_app_cache_file(), cache)
+
+
+def _get_app_version(path, version_args):
+    """Runs an application with its version arguments and returns the first
+    line of output, or None if it could not be run.
+    """
+
+    try:
+        query = Popen([path] + version_args, stdout=PIPE, stderr=STDOUT,
+                      stdin=PIPE, universal_newlines=True)
+        (output, _) = query.communicate()
+    except OSError as err:
+        logging.debug("Unable to get version of %s: %s", path, err)
+        return None
+
+    for line in output.splitlines():
+        if line.strip():
+            return line.strip()
+
+    return None
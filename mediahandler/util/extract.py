@@ -18,18 +18,648 @@
 Module: mediahandler.util.extract
 
 Module contains:
+    - |MHArchive|
+        A compressed file, made of one or more volumes.
+
     - |get_files()|
-        extracts compressed files via Filebot.
+        Extracts compressed files, in-process where possible, or via
+        Filebot.
+
+    - |find_archives()|
+        Finds the compressed files in a download.
+
+    - |can_extract()|
+        Checks whether compressed files can be extracted without Filebot.
+
+    - |extract_archive()|
+        Extracts compressed files in-process.
 
 """
 
+import os
+import re
+import time
+import shutil
 import logging
-from re import search
+import threading
 from subprocess import Popen, PIPE
+from importlib.util import find_spec
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+import mediahandler.util.config as Config
+import mediahandler.util.inventory as Inventory
+
+# Size, in bytes, of the buffer used to copy each file out of an archive
+_BUFFER_SIZE = 1024 * 1024
+
+# Largest number of archives extracted at once
+_EXTRACT_WORKERS = os.cpu_count() or 1
+
+# Largest number of archives extracted to the same filesystem at once
+_DISK_WRITERS = 2
+
+# Archive file names, as (regex, format, volume style), checked in order.
+# The regex captures the archive name and, for multi-volume archives, the
+# volume number. Volumes with the same name and style are one archive.
+__archivetypes__ = [
+    (r'(.+)\.part(\d+)\.rar', 'rar', 'part'),
+    (r'(.+)\.rar', 'rar', 'rnn'),
+    (r'(.+)\.r(\d{2,3})', 'rar', 'rnn'),
+    (r'(.+)\.7z\.(\d{3})', '7z', 'split'),
+    (r'(.+)\.7z', '7z', None),
+    (r'(.+)\.zip\.(\d{3})', 'zip', 'split'),
+    (r'(.+)\.zip', 'zip', 'znn'),
+    (r'(.+)\.z(\d{2})', 'zip', 'znn'),
+    (r'(.+)\.(?:tar\.gz|tar\.bz2|tar\.xz|tgz|tbz2|txz|tar)', 'tar', None),
+]
+
+# Leading bytes of each archive format, as (offset, bytes, format)
+__magic__ = [
+    (0, b'PK\x03\x04', 'zip'),
+    (0, b'PK\x05\x06', 'zip'),
+    (0, b'PK\x07\x08', 'zip'),
+    (0, b'Rar!\x1a\x07', 'rar'),
+    (0, b'7z\xbc\xaf\x27\x1c', '7z'),
+    (0, b'\x1f\x8b', 'tar'),
+    (0, b'BZh', 'tar'),
+    (0, b'\xfd7zXZ\x00', 'tar'),
+    (257, b'ustar', 'tar'),
+]
+
+# Number of bytes read from each archive to check its format
+_MAGIC_SIZE = 262
+
+
+class MHUnsupportedArchive(Exception):
+    """Raised when there is no in-process way to extract an archive, so
+    Filebot should be used instead.
+    """
+
+
+class MHArchive(object):
+    """A compressed file found by find_archives(), made of one or more
+    volumes.
+
+    Members:
+        - path
+            Path to the first volume, which the archive is extracted from.
+        - volumes
+            Paths to all of the volumes, in order.
+        - format
+            The archive format: 'zip', 'rar', '7z' or 'tar'.
+        - split
+            True if the archive is split in a way only the 7z application
+            can read.
+        - output
+            The folder the archive is extracted to: its name, next to the
+            first volume.
+        - size
+            Bytes written to the output folder, once extracted.
+        - inventory
+            MHInventory of the output folder, once extracted.
+        - time
+            Seconds taken to extract the archive, once extracted.
+        - error
+            The exception raised if the archive could not be extracted.
+    """
+
+    def __init__(self, name, volumes, archive_format, style=None):
+        """Initialize the MHArchive class.
+        """
+
+        self.path = volumes[0]
+        self.volumes = volumes
+        self.format = archive_format
+        self.split = (style == 'split' or
+                      (style == 'znn' and len(volumes) > 1))
+        self.output = os.path.join(
+            os.path.dirname(os.path.abspath(self.path)), name)
+        self.size = None
+        self.inventory = None
+        self.time = None
+        self.error = None
+
+    def __repr__(self):
+        return '<MHArchive {0}>'.format(self.__dict__)
+
+
+def get_files(filebot, file_name, inventory=None):
+    """Extracts compressed files, in-process where possible, or via
+    Filebot. Filebot is used whenever in-process extraction fails, and
+    the original error is logged.
+
+    Returns a list of the folders the files were extracted to, or None if
+    they could not be extracted.
+
+    Required arguments:
+        - filebot
+            Path to valid Filebot application script, or None.
+        - file_name
+            Path to valid compressed file, or folder of compressed files,
+            for extraction.
+
+    Optional argument:
+        - inventory
+            MHInventory object of the download, used to find the
+            compressed files.
+    """
+    logging.info("Getting files from compressed folder")
+
+    # Extract in-process. Archive errors are logged as they happen
+    try:
+        new_files = extract_archive(file_name, inventory)
+    except MHUnsupportedArchive as err:
+        logging.debug("Unable to extract in-process: %s", err)
+    except Exception as err:
+        logging.warning("Unable to extract %s: %s", file_name, err)
+    else:
+        if new_files is not None:
+            return new_files
+
+    # Fall back to Filebot
+    if not filebot:
+        return None
+
+    logging.info("Using Filebot to extract: %s", file_name)
+
+    return _filebot_extract(filebot, file_name)
+
+
+def find_archives(file_name, inventory=None):
+    """Finds the compressed files in a download: the file itself, or those
+    anywhere in a folder.
+
+    Files are found by name, then their leading bytes are checked, so an
+    archive with the wrong extension is still read in the right format.
+    The volumes of a multi-volume archive (.part01.rar, .rar and .r00,
+    .7z.001, .zip and .z01) are grouped into one MHArchive.
+
+    If an MHInventory of the download is given, it is used instead of
+    listing the folders again.
+
+    Returns a list of MHArchive objects, sorted by path.
+    """
+
+    # A folder, from the inventory
+    if inventory is not None and inventory.is_dir(file_name):
+        return _group_volumes(
+            entry.path for entry in inventory.files(file_name)
+            if _get_volume(entry.name) is not None)
+
+    # A single file, along with any other volumes next to it
+    if not os.path.isdir(file_name):
+        if _get_volume(os.path.basename(file_name)) is None:
+            return []
+        path = os.path.abspath(file_name)
+        folder = os.path.dirname(path)
+        if inventory is not None and inventory.is_dir(folder):
+            paths = [os.path.join(folder, name)
+                     for name in inventory.listdir(folder)
+                     if _get_volume(name) is not None and
+                     inventory.is_file(os.path.join(folder, name))]
+        else:
+            paths = [entry.path for entry in os.scandir(folder)
+                     if entry.is_file() and
+                     _get_volume(entry.name) is not None]
+        return [archive for archive in _group_volumes(paths)
+                if path in archive.volumes]
+
+    return _group_volumes(_scan_folder(file_name))
+
+
+def can_extract(file_name, inventory=None):
+    """Returns True if a compressed file, or all of those in a folder, can
+    be extracted without Filebot.
+    """
+
+    archives = find_archives(file_name, inventory)
+    if not archives:
+        return False
+
+    return all(_get_extractor(archive) is not None for archive in archives)
+
+
+def extract_archive(file_name, inventory=None):
+    """Extracts compressed files in-process, each into a folder named
+    after it next to it, the same as 'filebot -extract'. If given a
+    folder, every archive found in it by find_archives() is extracted.
+
+    Independent archives are extracted in parallel, by up to
+    _EXTRACT_WORKERS threads, with no more than _DISK_WRITERS writing to
+    the same filesystem at once. The time taken and bytes written are
+    logged for each archive.
+
+    Files are copied out of the archive through a buffer of _BUFFER_SIZE
+    bytes, so large files are never held in memory. Archives with files
+    outside the extraction folder are rejected.
+
+    If an MHInventory of the download is given, the extracted files are
+    added to it.
+
+    Returns a list of the folders the files were extracted to, or None if
+    an archive could not be extracted. Raises MHUnsupportedArchive if an
+    archive format is not supported, or needs a missing python module or
+    application.
+    """
+
+    archives = find_archives(file_name, inventory)
+    if not archives:
+        raise MHUnsupportedArchive(
+            "No known archive type: {0}".format(file_name))
+
+    # Check everything can be extracted before starting
+    extractors = []
+    for archive in archives:
+        extractor = _get_extractor(archive)
+        if extractor is None:
+            raise MHUnsupportedArchive(
+                "No extractor available: {0}".format(archive.path))
+        extractors.append(extractor)
+
+    _extract_all(list(zip(archives, extractors)))
+
+    # e.g. a zip compression method python doesn't have
+    for archive in archives:
+        if isinstance(archive.error, MHUnsupportedArchive):
+            raise archive.error
+
+    new_files = []
+    for archive in archives:
+        if archive.error is not None:
+            return None
+        if archive.output not in new_files:
+            new_files.append(archive.output)
+        if inventory is not None:
+            inventory.update(archive.inventory)
+
+    logging.debug("Extracted files: %s", new_files)
+
+    return new_files
+
+
+def _extract_all(jobs):
+    """Extracts a list of (MHArchive, extractor) jobs on a pool of worker
+    threads, sized to the number of cores and filesystems written to.
+    """
+
+    # Limit the writers on each filesystem
+    writers = {}
+    for (archive, _) in jobs:
+        device = _get_device(archive.output)
+        if device not in writers:
+            writers[device] = threading.BoundedSemaphore(_DISK_WRITERS)
+
+    workers = min(len(jobs), _EXTRACT_WORKERS, _DISK_WRITERS * len(writers))
+    logging.debug("Extracting %s archives with %s workers",
+                  len(jobs), workers)
+
+    job_queue = Queue()
+    for job in jobs:
+        job_queue.put(job)
+
+    # No need for threads with a single worker
+    if workers <= 1:
+        _extract_worker(job_queue, writers)
+        return
+
+    threads = []
+    for num in range(workers):
+        thread = threading.Thread(
+            target=_extract_worker, args=(job_queue, writers),
+            name='mh-extract-{0}'.format(num + 1))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+
+def _extract_worker(job_queue, writers):
+    """Extracts archives from the job queue until it is empty.
+    """
+
+    while True:
+        try:
+            (archive, extractor) = job_queue.get(False)
+        except Empty:
+            return
+
+        with writers[_get_device(archive.output)]:
+            _extract_one(archive, extractor)
+
+
+def _extract_one(archive, extractor):
+    """Extracts an MHArchive, recording the time taken, the bytes written
+    and any error.
+    """
+
+    logging.debug("Extracting %s to %s", archive.path, archive.output)
+    start = time.time()
+
+    try:
+        extractor(archive.path, archive.output)
+    except MHUnsupportedArchive as err:
+        archive.error = err
+    except NotImplementedError as err:
+        archive.error = MHUnsupportedArchive(str(err))
+    except Exception as err:
+        logging.warning("Unable to extract %s: %s", archive.path, err)
+        archive.error = err
+
+    archive.time = time.time() - start
+    archive.inventory = Inventory.MHInventory(archive.output)
+    archive.size = archive.inventory.size(archive.output)
+
+    logging.info("Extracted %s: %s bytes in %.2fs",
+                 os.path.basename(archive.path), archive.size, archive.time)
+
+
+def _get_device(folder):
+    """Returns the ID of the filesystem a folder is on, from the closest
+    folder which exists.
+    """
+
+    folder = os.path.abspath(folder)
+    while not os.path.exists(folder):
+        folder = os.path.dirname(folder)
+
+    return os.stat(folder).st_dev
 
 
-def get_files(filebot, file_name):
-    """Extracts compressed files via Filebot.
+def _scan_folder(folder):
+    """Yields the paths of the files in a folder which are named like
+    archives, including those in sub-folders. Links are not followed.
+    """
+
+    folders = [folder]
+    while folders:
+        # Read each folder in full, so it is closed before yielding
+        entries = list(os.scandir(folders.pop()))
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                folders.append(entry.path)
+            elif (entry.is_file(follow_symlinks=False) and
+                  _get_volume(entry.name) is not None):
+                yield entry.path
+
+
+def _group_volumes(paths):
+    """Groups archive file paths into a sorted list of MHArchive objects,
+    one per archive.
+    """
+
+    sets = {}
+    for path in paths:
+        (name, archive_format, style, number) = _get_volume(
+            os.path.basename(path))
+        key = (os.path.dirname(path), name.lower(), archive_format, style)
+        sets.setdefault(key, (name, []))[1].append((number, path))
+
+    archives = []
+    for ((_, _, archive_format, style), (name, volumes)) in sets.items():
+        volumes = [path for (_, path) in sorted(volumes)]
+        archive_format = _sniff_format(volumes[0]) or archive_format
+        archives.append(MHArchive(name, volumes, archive_format, style))
+
+    return sorted(archives, key=lambda archive: archive.path)
+
+
+def _get_volume(file_name):
+    """Returns (name, format, volume style, volume number) for an archive
+    file name, or None.
+    """
+
+    for (regex, archive_format, style) in __archivetypes__:
+        match = re.match(regex + '$', file_name, re.I)
+        if match is None:
+            continue
+
+        # Number volumes from 1, after the .rar or .zip file
+        number = 0
+        if match.lastindex > 1:
+            number = int(match.group(2)) + 1
+
+        return (match.group(1), archive_format, style, number)
+
+    return None
+
+
+def _sniff_format(file_name):
+    """Returns the archive format from the leading bytes of a file, or None
+    if they are not recognized.
+    """
+
+    try:
+        with open(file_name, 'rb') as file_io:
+            header = file_io.read(_MAGIC_SIZE)
+    except (IOError, OSError):
+        return None
+
+    for (offset, magic, archive_format) in __magic__:
+        if header[offset:offset + len(magic)] == magic:
+            return archive_format
+
+    return None
+
+
+def _get_extractor(archive):
+    """Returns the function used to extract an MHArchive, or None if it
+    can't be extracted in-process.
+    """
+
+    # Split zip and 7z files
+    if archive.split:
+        if _find_tool('7z') is not None:
+            return _extract_7z
+        return None
+
+    if archive.format == 'zip':
+        return _extract_zip
+    if archive.format == 'tar':
+        return _extract_tar
+
+    # Optional python modules, then applications
+    if archive.format == '7z':
+        if _has_module('py7zr'):
+            return _extract_py7zr
+        if _find_tool('7z') is not None:
+            return _extract_7z
+    if archive.format == 'rar':
+        if _has_module('rarfile') and _find_tool('unrar') is not None:
+            return _extract_rarfile
+        if _find_tool('unrar') is not None:
+            return _extract_unrar
+        if _find_tool('7z') is not None:
+            return _extract_7z
+
+    return None
+
+
+def _extract_zip(archive, output):
+    """Extracts a zip file with the zipfile module.
+    """
+
+    import zipfile
+
+    with zipfile.ZipFile(archive) as zip_file:
+        for info in zip_file.infolist():
+            target = _get_target(output, info.filename)
+            if info.is_dir():
+                _make_folder(target)
+                continue
+            with zip_file.open(info) as source:
+                _write_file(source, target)
+
+
+def _extract_tar(archive, output):
+    """Extracts a tar file, compressed or not, with the tarfile module.
+
+    The archive is read as a stream, one entry at a time. Only regular
+    files and folders are extracted.
+    """
+
+    import tarfile
+
+    with tarfile.open(archive, 'r|*') as tar_file:
+        for member in tar_file:
+            target = _get_target(output, member.name)
+            if member.isdir():
+                _make_folder(target)
+            elif member.isfile():
+                _write_file(tar_file.extractfile(member), target)
+            else:
+                logging.debug("Skipping special file: %s", member.name)
+
+
+def _extract_py7zr(archive, output):
+    """Extracts a 7z file with the optional py7zr module.
+    """
+
+    import py7zr
+
+    with py7zr.SevenZipFile(archive, mode='r') as seven_zip:
+        for name in seven_zip.getnames():
+            _get_target(output, name)
+        _make_folder(output)
+        seven_zip.extractall(path=output)
+
+
+def _extract_rarfile(archive, output):
+    """Extracts a rar file with the optional rarfile module.
+    """
+
+    import rarfile
+
+    with rarfile.RarFile(archive) as rar_file:
+        for info in rar_file.infolist():
+            target = _get_target(output, info.filename)
+            if info.is_dir():
+                _make_folder(target)
+                continue
+            with rar_file.open(info) as source:
+                _write_file(source, target)
+
+
+def _extract_7z(archive, output):
+    """Extracts an archive with the 7z application.
+    """
+
+    _make_folder(output)
+    _run_tool([_find_tool('7z'), 'x', '-y', '-bd',
+               '-o{0}'.format(output), archive])
+
+
+def _extract_unrar(archive, output):
+    """Extracts a rar file with the unrar application.
+    """
+
+    _make_folder(output)
+    _run_tool([_find_tool('unrar'), 'x', '-o+', '-y', archive,
+               output + os.sep])
+
+
+def _run_tool(cmd):
+    """Runs an extraction application, raising an OSError if it fails.
+    """
+
+    logging.debug("Query: %s", cmd)
+
+    m_open = Popen(cmd, stdout=PIPE, stderr=PIPE)
+    (output, err) = m_open.communicate()
+    logging.debug("Extract output: %s", output)
+
+    if m_open.returncode != 0:
+        raise OSError("{0} failed ({1}): {2}".format(
+            os.path.basename(cmd[0]), m_open.returncode, err))
+
+
+def _get_target(output, name):
+    """Returns the path an archive entry is extracted to. Raises a
+    ValueError if it would be outside the output folder.
+    """
+
+    name = name.replace('\\', '/')
+    target = os.path.normpath(os.path.join(output, name))
+
+    if (os.path.isabs(name) or
+            not target.startswith(os.path.normpath(output) + os.sep)):
+        raise ValueError("Unsafe path in archive: {0}".format(name))
+
+    return target
+
+
+def _make_folder(folder):
+    """Makes a folder and any missing parent folders.
+    """
+
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+
+def _write_file(source, target):
+    """Copies a file object to disk through a buffer of _BUFFER_SIZE bytes.
+
+    The file is written under a temporary name first, so a partly
+    extracted file is never left with the real name.
+    """
+
+    _make_folder(os.path.dirname(target))
+
+    partial = target + '.part'
+    try:
+        with open(partial, 'wb') as target_io:
+            shutil.copyfileobj(source, target_io, _BUFFER_SIZE)
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def _has_module(module):
+    """Returns True if an optional python module is installed, without
+    importing it.
+    """
+
+    try:
+        return find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _find_tool(app_exec):
+    """Returns the path to an extraction application, or None.
+    """
+    return Config.search_path(app_exec)
+
+
+def _filebot_extract(filebot, file_name):
+    """Extracts compressed files via Filebot. Returns a list of every
+    folder Filebot extracted files to, or None.
 
     Required arguments:
         - filebot
@@ -37,7 +667,6 @@ def get_files(filebot, file_name):
         - file_name
             Path to valid compressed file for extraction.
     """
-    logging.info("Getting files from compressed folder")
 
     # Set up query
     m_cmd = [filebot,
@@ -60,12 +689,10 @@ def get_files(filebot, file_name):
         pass
 
     # Process output
-    file_info = search(r"extract to \[(.*)\][\r]?\n", output)
-    if file_info is None:
+    new_files = re.findall(r"extract to \[(.*)\][\r]?\n", output)
+    if not new_files:
         return None
 
-    # Set new files
-    new_files = file_info.group(1)
     logging.debug("Extracted files: %s", new_files)
 
     return new_files
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""
+Module: mediahandler.util.filebot
+
+Module contains:
+
+    - |MHFilebotServer|
+        A long-lived Filebot process which runs rename queries sent to it
+        over a pipe, so the JVM only starts once.
+
+    - |start_server()|
+        Starts the shared Filebot server used by run_query().
+
+    - |stop_server()|
+        Stops the shared Filebot server.
+
+    - |run_query()|
+        Sends a Filebot query to the shared server, if one is running.
+
+"""
+
+import os
+import json
+import logging
+import threading
+from queue import Queue, Empty
+from subprocess import Popen, PIPE, STDOUT, TimeoutExpired
+
+import mediahandler as mh
+
+# Shared server used by run_query()
+_SERVER = None
+
+# Seconds to wait for the Filebot JVM to start
+_START_TIMEOUT = 120
+
+# Seconds to wait for the next line of a query's output before the server
+# is taken to have stopped responding
+_READ_TIMEOUT = 300
+
+# Filebot CLI options handled by the server, and how many values each takes
+__serveroptions__ = {
+    '-rename': 0,
+    '-r': 0,
+    '-non-strict': 0,
+    '--db': 1,
+    '--format': 1,
+    '--action': 1,
+    '--log': 1,
+    '--log-file': 1,
+}
+
+
+class MHFilebotServer(object):
+    """A long-lived Filebot process which runs rename queries sent to it
+    over a pipe, so the JVM only starts once.
+
+    Runs the extras/server.groovy script with 'filebot -script'. Each
+    query is converted by _get_request() into a line of JSON, which is
+    written to the process, and the output is read back until a
+    '@@MH-DONE <id>' line. Queries with options the script does not
+    handle are left to a one-off Filebot call.
+
+    The output is read by a background thread. If the process sends
+    nothing for _READ_TIMEOUT seconds, it is killed and the query is left
+    to a one-off Filebot call.
+
+    Required argument:
+        - filebot
+            Path to valid Filebot application script.
+
+    Public methods:
+        - |start()|
+            Starts the Filebot process.
+
+        - |query()|
+            Runs a Filebot query. Returns None if the server is not
+            available, so the caller can fall back to a one-off call.
+
+        - |close()|
+            Stops the Filebot process.
+    """
+
+    def __init__(self, filebot):
+        """Initialize the MHFilebotServer class.
+
+        Required argument:
+            - filebot
+                Path to valid Filebot application script.
+        """
+
+        self.filebot = filebot
+        self.script = os.path.join(mh.__mediaextras__, 'server.groovy')
+        self.process = None
+        self.lines = None
+        self.request_id = 0
+        self.disabled = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the Filebot process. Returns True if it is ready.
+        """
+
+        logging.info("Starting Filebot server")
+
+        try:
+            self.process = Popen(
+                [self.filebot, '-script', self.script],
+                stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                universal_newlines=True, bufsize=1)
+        except OSError as err:
+            logging.warning("Unable to start Filebot server: %s", err)
+            self.process = None
+            return False
+
+        # Read the output in the background, so reads can time out
+        self.lines = Queue()
+        reader = threading.Thread(
+            target=_read_lines, args=(self.process.stdout, self.lines),
+            name='mh-filebot')
+        reader.daemon = True
+        reader.start()
+
+        # Wait for the script to be ready
+        while True:
+            line = self._read_line(_START_TIMEOUT)
+            if not line:
+                logging.warning("Filebot server did not start")
+                self._stop_process()
+                return False
+            if line.strip() == '@@MH-READY':
+                break
+
+        logging.debug("Filebot server ready: %s", self.process.pid)
+
+        return True
+
+    def is_alive(self):
+        """Returns True if the Filebot process is running.
+        """
+        return self.process is not None and self.process.poll() is None
+
+    def query(self, cmd):
+        """Runs a Filebot query. Returns None if the server is not
+        available, so the caller can fall back to a one-off call.
+
+        Required argument:
+            - cmd
+                A Filebot CLI query, as used with Popen.
+        """
+
+        # Only rename queries are supported
+        if len(cmd) < 2 or cmd[0] != self.filebot or cmd[1] != '-rename':
+            return None
+
+        request = _get_request(cmd[1:])
+        if request is None:
+            return None
+
+        # The server could not be started
+        if self.disabled:
+            return None
+
+        # Another job is using the server
+        if not self._lock.acquire(False):
+            logging.debug("Filebot server busy")
+            return None
+
+        try:
+            # Restart the server if it has died
+            if not self.is_alive():
+                self._stop_process()
+                if not self.start():
+                    logging.warning("Disabling Filebot server")
+                    self.disabled = True
+                    return None
+
+            output = self._send(request)
+
+        finally:
+            self._lock.release()
+
+        # Write the output to the Filebot log file, as Filebot would
+        if output is not None and request['log_file'] is not None:
+            _write_log(request['log_file'], output)
+
+        return output
+
+    def close(self):
+        """Stops the Filebot process.
+        """
+
+        with self._lock:
+            self._stop_process()
+
+    def _send(self, request):
+        """Writes a request to the Filebot process and reads its output.
+        """
+
+        self.request_id += 1
+        request = json.dumps(dict(request, id=self.request_id))
+        done = '@@MH-DONE {0}'.format(self.request_id)
+        logging.debug("Filebot server request: %s", request)
+
+        try:
+            self.process.stdin.write(request + '\n')
+            self.process.stdin.flush()
+        except (IOError, OSError) as err:
+            logging.warning("Filebot server connection lost: %s", err)
+            self._stop_process()
+            return None
+
+        # Read output until the request is done
+        output = []
+        while True:
+            line = self._read_line(_READ_TIMEOUT)
+            if not line:
+                logging.warning("Filebot server stopped during query")
+                self._stop_process()
+                return None
+            if line.strip() == done:
+                break
+            output.append(line)
+
+        output = ''.join(output)
+        logging.debug("Query output: %s", output)
+
+        return output
+
+    def _read_line(self, timeout):
+        """Returns the next line of output from the Filebot process, or ''
+        if it has exited. Returns None if no line arrives before the
+        timeout (in seconds) expires.
+        """
+
+        try:
+            return self.lines.get(timeout=timeout)
+        except Empty:
+            logging.warning("Filebot server not responding after %ss",
+                            timeout)
+            return None
+
+    def _stop_process(self):
+        """Stops the Filebot process, if it is running. A process which
+        does not exit when asked is killed.
+        """
+
+        if self.process is None:
+            return
+
+        logging.debug("Stopping Filebot server: %s", self.process.pid)
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except TimeoutExpired:
+                self.process.kill()
+        self.process.wait()
+        self.process = None
+        self.lines = None
+
+    def __repr__(self):
+        return '<MHFilebotServer {0}>'.format(self.__dict__)
+
+
+def _get_request(args):
+    """Converts the arguments of a 'filebot -rename' query into a request
+    for the server script, or returns None if they include an option the
+    script does not handle.
+
+    The request holds the 'paths' to rename, whether folders are searched
+    'recursive'-ly, as with '-r', the rename() 'options', the 'log_level'
+    and the 'log_file'.
+    """
+
+    request = {
+        'paths': [],
+        'recursive': False,
+        'options': {'strict': True},
+        'log_level': None,
+        'log_file': None,
+    }
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+
+        # Files and folders to rename
+        if not arg.startswith('-'):
+            request['paths'].append(os.path.abspath(arg))
+            i += 1
+            continue
+
+        # Options
+        if arg not in __serveroptions__:
+            logging.debug("Filebot server does not handle option: %s", arg)
+            return None
+        values = args[i + 1:i + 1 + __serveroptions__[arg]]
+        if len(values) < __serveroptions__[arg]:
+            return None
+
+        if arg == '-r':
+            request['recursive'] = True
+        elif arg == '-non-strict':
+            request['options']['strict'] = False
+        elif arg == '--log':
+            request['log_level'] = values[0]
+        elif arg == '--log-file':
+            request['log_file'] = values[0]
+        elif arg in ['--db', '--format', '--action']:
+            request['options'][arg[2:]] = values[0]
+
+        i += 1 + len(values)
+
+    return request
+
+
+def _read_lines(stream, lines):
+    """Puts each line read from a stream on a queue, followed by '' once
+    the stream is closed.
+    """
+
+    try:
+        for line in iter(stream.readline, ''):
+            lines.put(line)
+    except (IOError, OSError, ValueError):
+        pass
+    finally:
+        stream.close()
+        lines.put('')
+
+
+def _write_log(log_file, output):
+    """Appends a query's output to a Filebot log file.
+    """
+
+    try:
+        with open(log_file, 'a') as log_io:
+            log_io.write(output)
+    except (IOError, OSError) as err:
+        logging.warning("Unable to write Filebot log file: %s", err)
+
+
+def start_server(filebot):
+    """Starts the shared Filebot server used by run_query().
+
+    Required argument:
+        - filebot
+            Path to valid Filebot application script.
+    """
+
+    global _SERVER
+
+    stop_server()
+    _SERVER = MHFilebotServer(filebot)
+    _SERVER.start()
+
+    return _SERVER
+
+
+def stop_server():
+    """Stops the shared Filebot server.
+    """
+
+    global _SERVER
+
+    if _SERVER is not None:
+        _SERVER.close()
+        _SERVER = None
+
+
+def run_query(cmd):
+    """Sends a Filebot query to the shared server, if one is running.
+
+    Returns the query output, or None if the query should be run as a
+    one-off Filebot call instead.
+    """
+
+    if _SERVER is None:
+        return None
+
+    return _SERVER.query(cmd)
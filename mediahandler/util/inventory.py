@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""
+Module: mediahandler.util.inventory
+
+Module contains:
+
+    - |MHInventory|
+        A listing of the files and folders in a download, read once and
+        shared by each stage of a job.
+
+    - |MHInventoryEntry|
+        A single file or folder in an MHInventory.
+
+"""
+
+import os
+import shutil
+import logging
+
+
+class MHInventoryEntry(object):
+    """A single file or folder in an MHInventory.
+
+    Members:
+        - path
+            Absolute path to the file or folder.
+        - size
+            Size in bytes.
+        - mtime
+            Last modification time, as a UNIX timestamp.
+        - is_dir
+            True if this is a folder.
+    """
+
+    __slots__ = ('path', 'size', 'mtime', 'is_dir')
+
+    def __init__(self, path, size, mtime, is_dir):
+        """Initialize the MHInventoryEntry class.
+        """
+
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.is_dir = is_dir
+
+    @property
+    def name(self):
+        """The file or folder name.
+        """
+        return os.path.basename(self.path)
+
+    def __repr__(self):
+        return '<MHInventoryEntry {0}>'.format(self.path)
+
+
+class MHInventory(object):
+    """A listing of the files and folders in a download, read once with
+    os.scandir and shared by each stage of a job, so a download is not
+    walked again for every check, which is slow on network mounts.
+
+    Links are recorded but never followed. The listing is not refreshed
+    on its own: stages which add files call scan() on them, and stages
+    which remove files use remove() or discard().
+
+    Arguments:
+        - path
+            Path to a file or folder to scan.
+
+    Public methods:
+        - |scan()|
+            Adds a file or folder, and everything in it, to the inventory.
+
+        - |update()|
+            Adds everything in another MHInventory to this one.
+
+        - |exists()|
+            Checks whether a path is in the inventory.
+
+        - |listdir()|
+            Returns the names in a folder, like os.listdir().
+
+        - |walk()|
+            Yields the entries anywhere in a folder.
+
+        - |files()|
+            Returns the files anywhere in a folder.
+
+        - |size()|
+            Returns the total size of a file or folder.
+
+        - |discard()|
+            Drops a path, and everything in it, from the inventory.
+
+        - |remove()|
+            Deletes a file or folder from disk and drops it from the
+            inventory.
+    """
+
+    def __init__(self, path=None):
+        """Initialize the MHInventory class.
+        """
+
+        self.entries = {}
+        self.children = {}
+
+        if path is not None:
+            self.scan(path)
+
+    def scan(self, path):
+        """Adds a file or folder, and everything in it, to the inventory.
+        Anything already known under the path is read again.
+        """
+
+        path = os.path.abspath(path)
+        logging.debug("Scanning files: %s", path)
+
+        self.discard(path)
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        is_dir = os.path.isdir(path)
+        self._add(MHInventoryEntry(
+            path, stat.st_size, stat.st_mtime, is_dir))
+        if not is_dir:
+            return
+
+        # Walk the folder tree once
+        folders = [path]
+        while folders:
+            folder = folders.pop()
+            try:
+                for entry in os.scandir(folder):
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    self._add(MHInventoryEntry(
+                        entry.path, stat.st_size, stat.st_mtime, is_dir))
+                    if is_dir:
+                        folders.append(entry.path)
+            except OSError as err:
+                logging.warning("Unable to read folder %s: %s", folder, err)
+
+    def update(self, other):
+        """Adds everything in another MHInventory to this one.
+        """
+
+        for entry in other.entries.values():
+            self.discard(entry.path)
+            self._add(entry)
+
+    def get(self, path):
+        """Returns the MHInventoryEntry for a path, or None.
+        """
+        return self.entries.get(os.path.abspath(path))
+
+    def exists(self, path):
+        """Returns True if a path is in the inventory.
+        """
+        return os.path.abspath(path) in self.entries
+
+    def is_file(self, path):
+        """Returns True if a path is a file, or a link, in the inventory.
+        """
+
+        entry = self.get(path)
+
+        return entry is not None and not entry.is_dir
+
+    def is_dir(self, path):
+        """Returns True if a path is a folder in the inventory.
+        """
+
+        entry = self.get(path)
+
+        return entry is not None and entry.is_dir
+
+    def listdir(self, folder):
+        """Returns the names of the files and folders in a folder, like
+        os.listdir().
+        """
+
+        children = self.children.get(os.path.abspath(folder), [])
+
+        return [os.path.basename(child) for child in children]
+
+    def walk(self, folder):
+        """Yields the MHInventoryEntry of every file and folder anywhere in
+        a folder, each folder before its contents.
+        """
+
+        folders = [os.path.abspath(folder)]
+        while folders:
+            for child in self.children.get(folders.pop(), []):
+                entry = self.entries[child]
+                yield entry
+                if entry.is_dir:
+                    folders.append(child)
+
+    def files(self, path):
+        """Returns the MHInventoryEntry of every file anywhere in a folder,
+        or of the file itself.
+        """
+
+        if self.is_file(path):
+            return [self.get(path)]
+
+        return [entry for entry in self.walk(path) if not entry.is_dir]
+
+    def size(self, path):
+        """Returns the total size, in bytes, of a file or the files in a
+        folder.
+        """
+        return sum(entry.size for entry in self.files(path))
+
+    def discard(self, path):
+        """Drops a path, and everything in it, from the inventory.
+        """
+
+        path = os.path.abspath(path)
+        if path not in self.entries:
+            return
+
+        for entry in list(self.walk(path)):
+            del self.entries[entry.path]
+            self.children.pop(entry.path, None)
+        del self.entries[path]
+        self.children.pop(path, None)
+
+        parent = self.children.get(os.path.dirname(path))
+        if parent is not None and path in parent:
+            parent.remove(path)
+
+    def remove(self, path):
+        """Deletes a file or folder from disk and drops it from the
+        inventory.
+
+        The files found by the scan are deleted, then the folders, deepest
+        first, so nothing is listed again. If anything new was added since
+        the scan, the rest of the folder is removed with shutil.rmtree().
+        """
+
+        path = os.path.abspath(path)
+
+        if not self.exists(path):
+            self.scan(path)
+
+        entries = [self.get(path)] + list(self.walk(path))
+        self.discard(path)
+
+        try:
+            for entry in reversed(entries):
+                if entry is None:
+                    continue
+                try:
+                    if entry.is_dir:
+                        os.rmdir(entry.path)
+                    else:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        except OSError:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                raise
+
+    def _add(self, entry):
+        """Adds a single MHInventoryEntry to the inventory.
+        """
+
+        self.entries[entry.path] = entry
+        if entry.is_dir:
+            self.children.setdefault(entry.path, [])
+
+        parent = self.children.get(os.path.dirname(entry.path))
+        if parent is not None:
+            parent.append(entry.path)
+
+    def __repr__(self):
+        return '<MHInventory {0} entries>'.format(len(self.entries))
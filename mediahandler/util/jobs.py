@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""
+Module: mediahandler.util.jobs
+
+Module contains:
+
+    - |MHJobQueue|
+        A job queue which runs add_media() requests on a pool of worker
+        threads for each media type.
+
+    - |MHJob|
+        A single queued add_media() request and its outcome.
+
+"""
+
+import logging
+import threading
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+import mediahandler as mh
+import mediahandler.util.args as Args
+
+# Media types whose tools cannot safely run more than one job at a time
+__serialtypes__ = [
+    'Music',
+]
+
+# Media types which can add several downloads with a single Filebot call
+__batchtypes__ = [
+    'TV',
+    'Movies',
+]
+
+
+class MHJob(object):
+    """A single queued add_media() request and its outcome.
+
+    Members:
+        - media
+            Path to the media files to be added.
+        - args
+            Dict of validated add_media() arguments.
+        - result
+            The add_media() return value, once done.
+        - error
+            The error message if the job failed, once done.
+    """
+
+    def __init__(self, media, args=None):
+        """Initialize the MHJob class.
+        """
+
+        self.media = media
+        self.args = args
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def stype(self):
+        """The media type string of the job.
+        """
+        return self.args['stype']
+
+    def done(self):
+        """Returns True once the job has finished.
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until the job has finished. Returns the done status.
+        """
+        return self._done.wait(timeout)
+
+    def finish(self, result=None, error=None):
+        """Records the outcome of the job and marks it as done.
+        """
+
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def __repr__(self):
+        return '<MHJob {0}>'.format(self.__dict__)
+
+
+class MHJobQueue(mh.MHObject):
+    """A job queue which runs add_media() requests on a pool of worker
+    threads for each media type.
+
+    The number of workers for each type is set by its 'workers' setting.
+    Types in __serialtypes__ always use a single worker, so their tools
+    never run concurrently, while unrelated types run in parallel.
+
+    For types in __batchtypes__, a worker takes every job waiting in its
+    queue, up to the type's 'batch_size' setting, and adds them with a
+    single call to Filebot.
+
+    Required argument:
+        - handler
+            The MHandler object used to process jobs. Each job runs on
+            its own copy of the handler.
+
+    Public methods:
+        - |submit()|
+            Validates and queues an add_media() request.
+
+        - |join()|
+            Blocks until every queued job has finished.
+
+        - |close()|
+            Stops the worker threads.
+    """
+
+    def __init__(self, handler):
+        """Initialize the MHJobQueue class.
+
+        Required argument:
+            - handler
+                The MHandler object used to process jobs.
+        """
+
+        super(MHJobQueue, self).__init__()
+
+        # Set up class members
+        self.handler = handler
+        self.queues = {}
+        self.workers = {}
+        self._lock = threading.Lock()
+
+    def submit(self, media, torrent_hash=None, **kwargs):
+        """Validates and queues an add_media() request.
+
+        Takes the same arguments as MHandler.add_media() and returns
+        an MHJob object. Set 'torrent_hash' to remove the download's
+        torrent from Deluge once it has been added.
+        """
+
+        job = MHJob(media)
+
+        # Validate arguments now, so the job can be routed by type
+        try:
+            job.args = Args.get_add_media_args(media, **kwargs)
+        except SystemExit as err:
+            logging.error("Unable to queue media: %s (%s)", media, err)
+            job.finish(error=str(err))
+            return job
+
+        if torrent_hash is not None:
+            job.args['torrent_hash'] = torrent_hash
+
+        logging.info("Queueing %s job: %s", job.stype, media)
+        self._get_queue(job.stype).put(job)
+
+        return job
+
+    def join(self):
+        """Blocks until every queued job has finished.
+        """
+
+        for job_queue in list(self.queues.values()):
+            job_queue.join()
+
+    def close(self):
+        """Waits for queued jobs to finish, then stops the worker threads.
+        """
+
+        logging.info("Stopping job queue")
+
+        with self._lock:
+            for (stype, job_queue) in self.queues.items():
+                for _ in self.workers[stype]:
+                    job_queue.put(None)
+            for threads in self.workers.values():
+                for thread in threads:
+                    thread.join()
+            self.queues = {}
+            self.workers = {}
+
+    def _get_queue(self, stype):
+        """Returns the queue for a media type, starting its workers on
+        first use.
+        """
+
+        with self._lock:
+            if stype not in self.queues:
+                self.queues[stype] = Queue()
+                self.workers[stype] = []
+
+                # Start workers
+                for num in range(self._get_worker_count(stype)):
+                    thread = threading.Thread(
+                        target=self._worker,
+                        args=(self.queues[stype],),
+                        name='mh-{0}-{1}'.format(stype.lower(), num))
+                    thread.daemon = True
+                    thread.start()
+                    self.workers[stype].append(thread)
+
+            return self.queues[stype]
+
+    def _get_worker_count(self, stype):
+        """Returns the number of workers to use for a media type.
+        """
+
+        # These tools need jobs to run one at a time
+        if stype in __serialtypes__:
+            return 1
+
+        settings = getattr(self.handler, stype.lower())
+        count = getattr(settings, 'workers', None) or 1
+        logging.debug("Using %s %s workers", count, stype)
+
+        return max(1, count)
+
+    def _get_batch_size(self, stype):
+        """Returns the largest number of jobs to add at once for a
+        media type.
+        """
+
+        if stype not in __batchtypes__:
+            return 1
+
+        settings = getattr(self.handler, stype.lower())
+        size = getattr(settings, 'batch_size', None) or 1
+
+        return max(1, size)
+
+    def _worker(self, job_queue):
+        """Processes jobs from a media type queue until a stop is received.
+        """
+
+        while True:
+            job = job_queue.get()
+            if job is None:
+                job_queue.task_done()
+                return
+
+            # Take any other waiting jobs for a batch
+            batch = [job]
+            stop = False
+            while len(batch) < self._get_batch_size(job.stype):
+                try:
+                    next_job = job_queue.get_nowait()
+                except Empty:
+                    break
+                if next_job is None:
+                    stop = True
+                    break
+                batch.append(next_job)
+
+            try:
+                if len(batch) > 1:
+                    self._run_batch(batch)
+                else:
+                    self._run_job(job)
+            finally:
+                for _ in batch:
+                    job_queue.task_done()
+
+            # Stop received while building the batch
+            if stop:
+                job_queue.task_done()
+                return
+
+    def _run_job(self, job):
+        """Runs a single job on its own copy of the handler.
+        """
+
+        logging.info("Starting %s job: %s", job.stype, job.media)
+
+        try:
+            result = self.handler.new_job().add_media(
+                validated=True, **job.args)
+        except SystemExit as err:
+            logging.error("Job failed: %s (%s)", job.media, err)
+            job.finish(error=str(err))
+        except Exception as err:
+            logging.exception("Unexpected error in job: %s", job.media)
+            job.finish(error=str(err))
+        else:
+            job.finish(result=result)
+
+    def _run_batch(self, batch):
+        """Runs several jobs of the same type with a single Filebot call.
+        """
+
+        logging.info("Starting %s batch: %s jobs", batch[0].stype, len(batch))
+
+        try:
+            outcomes = self.handler.new_job().add_media_batch(
+                [job.args for job in batch])
+        except Exception as err:
+            logging.exception("Unexpected error in batch")
+            outcomes = [err] * len(batch)
+
+        for (job, outcome) in zip(batch, outcomes):
+            if isinstance(outcome, BaseException):
+                logging.error("Job failed: %s (%s)", job.media, outcome)
+                job.finish(error=str(outcome))
+            else:
+                job.finish(result=outcome)
+
+    def __repr__(self):
+        return '<MHJobQueue {0}>'.format(self.__dict__)
@@ -23,17 +23,70 @@ Module contains:
         An object which contains the all the logic for sending
         push notifications and raising errors produced by mediahandler.
 
+    - |MHSender|
+        A background thread which delivers push notifications from the
+        outbox, so slow 3rd party services never hold up adding media.
+
+    - |MHOutbox|
+        A persistent SQLite queue of push notifications waiting to be
+        delivered.
+
+    - |get_sender()|
+        Returns the shared MHSender used by every MHPush object.
+
 """
 
-import logging
+import os
 import sys
-from json import dumps
-
-import requests
-from requests.exceptions import RequestException
+import time
+import atexit
+import pickle
+import logging
+import threading
+from json import dumps, loads
+from functools import partial
+from contextlib import contextmanager
 
 import mediahandler as mh
 import mediahandler.util.args as Args
+import mediahandler.util.config as Config
+import mediahandler.notifiers as Notifiers
+
+# Largest number of notifications waiting to be sent
+_QUEUE_SIZE = 100
+
+# Time, in seconds, a notification is kept for credentials which no
+# sender has registered, e.g. after they were changed
+_UNKNOWN_TTL = 86400
+
+# Delay, in seconds, before the first retry of a failed notification. It
+# doubles on each attempt, up to _RETRY_MAX_DELAY
+_RETRY_DELAY = 5
+_RETRY_MAX_DELAY = 3600
+
+# Number of delivery attempts before a notification is dropped
+_RETRY_ATTEMPTS = 10
+
+# Time, in seconds, a notification is reserved for one sender while it is
+# being delivered. Covers a credential check and a send, each of which may
+# wait the request timeout to connect and again to read
+_SEND_LEASE = 4 * Notifiers._TIMEOUT + 30
+
+# Longest time to wait for queued notifications when exiting
+_FLUSH_TIMEOUT = 30
+
+# How often, in seconds, flush() checks the outbox
+_FLUSH_POLL = 0.5
+
+# Shared sender used by every MHPush object
+_SENDER = None
+_SENDER_LOCK = threading.Lock()
+
+# Default time, in seconds, that validated credentials are trusted
+_VALIDATE_TTL = 86400
+
+# Guards reading and writing the credential cache
+_CACHE_LOCK = threading.Lock()
 
 
 class MHPush(mh.MHObject):
@@ -49,12 +102,16 @@ class MHPush(mh.MHObject):
     Public methods:
 
         - |send_message()|
-            Wrapper function for sending push notification
-            messages via various 3rd party services.
+            Wrapper function for adding push notification messages
+            for various 3rd party services to the outbox.
+
+        - |flush()|
+            Blocks until all outbox notifications have been sent.
 
         - |success()|
-            A wrapper for send_message() which sends a success
-            message and returns message content.
+            Sends a success message and returns message content.
+            Success messages for the same media type may be merged
+            into a single digest message.
 
         - |failure()|
             A wrapper for send_message() which sends a failure
@@ -84,13 +141,17 @@ class MHPush(mh.MHObject):
         self.disable = disable
         self.parser = Args.get_parser()
 
-        # If enabled, check credentials
+        # If enabled, set up notifiers. Credentials are validated on first send
+        self.notifiers = {}
         if self.enabled:
-            self._validate_credentials()
+            self._setup_notifiers()
 
     def send_message(self, conn_msg, msg_title=None):
         """Wrapper for sending push notifications via 3rd party services.
 
+        Messages are written to the outbox and delivered in the background
+        by the shared MHSender thread, so this returns right away.
+
         The function will exit if the disable flag is set.
         """
 
@@ -98,28 +159,29 @@ class MHPush(mh.MHObject):
         if not self.enabled or self.disable:
             return
 
-        # Set default title
-        conn_title = "EM Media Handler"
-
-        # Look for custom notify name
-        if self.notify_name is not None:
-            conn_title = self.notify_name
-
-        # Look for message title
-        if msg_title is not None:
-            conn_title = '{0}: {1}'.format(conn_title, msg_title)
+        # Set title
+        conn_title = self._get_title(msg_title)
 
-        # Send to pushover
-        if hasattr(self.pushover, 'session'):
-            self._send_pushover(conn_msg, conn_title)
+        # Add message to the outbox
+        keys = self._get_services()
+        if keys:
+            get_sender().send(keys, conn_msg, conn_title)
 
-        # Send to pushbullet
-        if hasattr(self.pushbullet, 'session'):
-            self._send_pushbullet(conn_msg, conn_title)
+    @staticmethod
+    def flush(timeout=None):
+        """Blocks until all outbox notifications which can be sent now have
+        been sent, or until the timeout (in seconds) expires. Returns True
+        if none are left.
+        """
+        return get_sender().flush(timeout)
 
-    def success(self, file_array, skipped=None):
+    def success(self, file_array, skipped=None, media_type=None):
         """Builds and sends a success notification.
 
+        Success messages are held in the outbox for 'digest_window'
+        seconds, or until 'digest_size' messages are waiting, and all
+        those for the same media type are sent as a single message.
+
         Arguments:
 
             - file_array
@@ -129,40 +191,32 @@ class MHPush(mh.MHObject):
             - skipped
                 Defaults to None. An array of any files that were
                 skipped during the add_media() sequence.
+
+            - media_type
+                Defaults to None. The media type string of the files,
+                used to group them with others of the same type.
         """
 
         logging.info("Starting success notifications")
 
         # Set success message
-        conn_text = ''
-        conn_title = 'Media Added'
-
-        # Check for added files
-        if file_array:
-            media_list = '\n+ '.join(file_array)
-            conn_text = '+ {0}\n'.format(media_list)
-
-        # Set skipped message if set
-        if skipped is not None and skipped:
-            skipped_list = '\n- '.join(skipped)
-            skipped_msg = 'Skipped files:\n- {0}\n'.format(skipped_list)
-
-            # Append to existing message, if needed
-            if conn_text == '':
-                conn_text = skipped_msg
-            else:
-                conn_text = '{0}\n{1}'.format(conn_text, skipped_msg)
-
-            # Set title for skips
-            conn_title = '{0} (with Skips)'.format(conn_title)
+        file_array = file_array or []
+        skipped = skipped or []
+        conn_text = _format_files(file_array, skipped)
 
         # Check there's a message to send
         if conn_text == '':
             logging.warning("No files or skips found to notify about")
             sys.exit("No files or skips found to notify about")
 
-        # Send message
-        self.send_message(conn_text, conn_title)
+        # Add message to the outbox
+        if self.enabled and not self.disable:
+            keys = self._get_services()
+            if keys:
+                get_sender().send_files(
+                    keys, self._get_title(), media_type, file_array,
+                    skipped, getattr(self, 'digest_window', None) or 0,
+                    getattr(self, 'digest_size', None))
 
         # Exit
         logging.warning(conn_text)
@@ -192,165 +246,859 @@ class MHPush(mh.MHObject):
 
         self.parser.error(error_details)
 
-    # 3rd party API requests function
+    def _get_title(self, msg_title=None):
+        """Returns the notification title, with the custom notify name.
+        """
+
+        # Set default title
+        conn_title = "EM Media Handler"
 
-    def _make_request(self, session, url, method='GET', params=None):
-        """Makes an API request to the provided session object
+        # Look for custom notify name
+        if self.notify_name is not None:
+            conn_title = self.notify_name
+
+        # Look for message title
+        if msg_title is not None:
+            conn_title = '{0}: {1}'.format(conn_title, msg_title)
+
+        return conn_title
+
+    def _get_services(self):
+        """Registers the send function of each notifier with the shared
+        sender. Returns their credential hashes.
         """
 
-        # Retrieve method function instance from session
-        req = getattr(session, method.lower())
+        sender = get_sender()
+        keys = []
 
-        # Make request
-        resp = req(url, data=params)
+        for (name, notifier) in self.notifiers.items():
+            key = notifier.get_key()
+            sender.register(key, partial(self._send, name), notifier.limit)
+            keys.append(key)
 
-        # Get JSON request response
-        conn_resp = resp.json()
-        logging.debug(conn_resp)
+        return keys
 
-        # Check for response success
-        if resp.status_code != 200:
-            logging.error(
-                "%s %s: %s %s",
-                method, url, resp.status_code, resp.reason)
+    def _setup_notifiers(self):
+        """Creates a notifier for each configured settings section. Only the
+        notifier submodules which are used get imported.
+        """
 
-        return conn_resp
+        for name in Notifiers.__notifiers__:
+            settings = getattr(self, name, None)
+
+            # Skip sections which are not set
+            if not isinstance(settings, self.MHSettings):
+                continue
+            if all(value is None for value in settings.__dict__.values()):
+                continue
+
+            notifier = Notifiers.get_notifier(name, settings)
+            if not notifier.is_configured():
+                logging.warning("Missing %s notification settings: %s",
+                                name, ', '.join(notifier.required))
+                continue
+
+            logging.debug("Using %s notifications", name)
+            self.notifiers[name] = notifier
 
     # 3rd party API credential validation functions
 
-    def _validate_credentials(self):
-        """Wrapper for validating API credentials for 3rd party services.
+    def _validate_credentials(self, name, refresh=False):
+        """Validates the credentials of a notifier, unless they were
+        validated within the last 'validate_ttl' seconds.
+
+        Returns True if the credentials are valid. Set 'refresh' to
+        ignore the cached result.
         """
 
-        # Pushover
-        if self.pushover.api_key is not None:
-            self._validate_pushover()
+        notifier = self.notifiers[name]
+
+        # Nothing to check
+        if not notifier.validates:
+            return True
+
+        key = notifier.get_key()
+        ttl = getattr(self, 'validate_ttl', None)
+        if ttl is None:
+            ttl = _VALIDATE_TTL
 
-        # Pushbullet
-        if self.pushbullet.token is not None:
-            self._validate_pushbullet()
+        # Look for a recent result
+        if not refresh:
+            validated = _load_cache().get(key)
+            if validated is not None and time.time() - validated < ttl:
+                logging.debug("Using cached %s validation", name)
+                return True
 
-    def _validate_pushover(self):
-        """Validates Pushover API credentials.
+        # Check with the service
+        error_msg = notifier.validate()
+        if error_msg is not None:
+            logging.error(error_msg)
+            _save_cache(key, None)
+            return False
+
+        _save_cache(key, time.time())
+
+        return True
+
+    # 3rd party API send functions
+
+    def _send(self, name, conn_msg, conn_title):
+        """Sends a message with a notifier, checking its credentials first.
         """
 
-        logging.debug("Validating Pushover credentials")
+        notifier = self.notifiers[name]
 
-        # Set up request params
-        self.pushover.url = {
-            'token': self.pushover.api_key,
-            'user': self.pushover.user_key,
-        }
+        # Check credentials
+        if not self._validate_credentials(name):
+            return None
 
-        # Create pushover session object
-        self.pushover.session = requests.Session()
-        self.pushover.session.headers.update({
-            'Content-type': 'application/x-www-form-urlencoded'
-        })
+        resp = notifier.send(conn_msg, conn_title)
 
-        # Make request
-        try:
-            resp = self._make_request(
-                self.pushover.session,
-                'https://api.pushover.net/1/users/validate.json',
-                'POST',
-                self.pushover.url
-            )
-        except RequestException as exc:
-            error_msg = 'Pushover: {0}'.format(exc.response.reason)
-            logging.error(error_msg)
-            self.parser.error(error_msg)
+        # Credentials may have been revoked since they were validated
+        if notifier.is_auth_error(resp):
+            self._validate_credentials(name, refresh=True)
 
-        # Check result
-        if not resp['status']:
-            error_msg = 'Pushover: {0}'.format(resp['errors'][0])
-            logging.error(error_msg)
-            self.parser.error(error_msg)
+        return resp
+
+    def __repr__(self):
+        return '<MHPush {0}>'.format(self.__dict__)
 
-        # Return success
-        logging.info("Pushover API credentials successfully validated")
+
+class MHOutbox(object):
+    """A persistent SQLite queue of push notifications waiting to be
+    delivered.
+
+    Messages stay in the outbox until they are sent, so they survive
+    network outages and restarts. Each message is stored with the
+    credential hash of the service it is for, never the credentials.
+
+    Digest messages hold lists of added and skipped files, as JSON, for a
+    media type. Those for the same service and media type which are added
+    within a window share a due time, so they are claimed and sent
+    together.
+
+    Required argument:
+        - outbox_file
+            Path to the SQLite database file.
+
+    Public methods:
+        - |add()|
+            Adds a message to the outbox.
+
+        - |claim()|
+            Reserves the messages which are ready to be sent.
+
+        - |remove()|
+            Removes a sent message.
+
+        - |retry()|
+            Returns a message to the outbox to be tried again later.
+
+        - |count()|
+            Returns the number of messages waiting to be sent.
+
+        - |expire()|
+            Removes old messages for unknown credential hashes.
+    """
+
+    def __init__(self, outbox_file):
+        """Initialize the MHOutbox class.
+        """
+
+        self.outbox_file = outbox_file
+
+        # Create the database
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS outbox ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'key TEXT NOT NULL, '
+                'title TEXT, '
+                'message TEXT, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'next_try REAL NOT NULL, '
+                'digest TEXT, '
+                'due REAL, '
+                'added REAL)')
+
+            # Update outboxes created before digests were added
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info(outbox)')]
+            for column in ['digest TEXT', 'due REAL', 'added REAL']:
+                if column.split()[0] not in columns:
+                    conn.execute(
+                        'ALTER TABLE outbox ADD COLUMN {0}'.format(column))
+
+            # Older messages are counted from now
+            conn.execute('UPDATE outbox SET added = ? WHERE added IS NULL',
+                         (time.time(),))
+
+    def add(self, keys, conn_msg, conn_title, size=None,
+            digest=None, window=0, digest_size=None, known=None):
+        """Adds a message to the outbox for each of the given credential
+        hashes. Returns False if the outbox would hold more than 'size'
+        messages, in which case nothing is added. If a list of 'known'
+        credential hashes is given, only messages for those and the given
+        hashes count towards the size.
+
+        Set 'digest' to the media type of a digest message. It is held
+        until 'window' seconds after the first digest message of its
+        group was added, or until the group has 'digest_size' messages.
+        """
+
+        now = time.time()
+
+        with self._connect() as conn:
+            if size is not None:
+                query = 'SELECT COUNT(*) FROM outbox'
+                params = []
+                if known is not None:
+                    params = list(set(keys) | set(known))
+                    query += ' WHERE key IN ({0})'.format(
+                        ','.join('?' * len(params)))
+                (count,) = conn.execute(query, params).fetchone()
+                if count + len(keys) > size:
+                    return False
+
+            for key in keys:
+                due = None
+
+                # Join an open digest group, or start a new one
+                if digest is not None:
+                    (due,) = conn.execute(
+                        'SELECT MIN(due) FROM outbox '
+                        'WHERE key = ? AND digest = ? AND due > ?',
+                        (key, digest, now)).fetchone()
+                    if due is None:
+                        due = now + window
+
+                conn.execute(
+                    'INSERT INTO outbox '
+                    '(key, title, message, next_try, digest, due, added) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, conn_title, conn_msg, due or now, digest, due, now))
+
+                # Send a full group right away
+                if digest is not None and digest_size and due > now:
+                    (count,) = conn.execute(
+                        'SELECT COUNT(*) FROM outbox '
+                        'WHERE key = ? AND digest = ? AND due = ?',
+                        (key, digest, due)).fetchone()
+                    if count >= digest_size:
+                        conn.execute(
+                            'UPDATE outbox SET due = ?, next_try = ? '
+                            'WHERE key = ? AND digest = ? AND due = ?',
+                            (now, now, key, digest, due))
 
         return True
 
-    def _validate_pushbullet(self):
-        """Validates Pushbullet API credentials.
+    def claim(self, keys):
+        """Reserves the messages for the given credential hashes which are
+        ready to be sent, so no other sender delivers them too.
+
+        Returns a list of (id, key, message, title, attempts, digest)
+        tuples, oldest first. Each service's messages are sent one after
+        another, so each is reserved for one more _SEND_LEASE than the
+        one before it.
+        """
+
+        if not keys:
+            return []
+
+        now = time.time()
+        claimed = []
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT id, key, message, title, attempts, digest, next_try '
+                'FROM outbox WHERE next_try <= ? AND key IN ({0}) '
+                'ORDER BY id'.format(','.join('?' * len(keys))),
+                [now] + list(keys)).fetchall()
+
+            # Only keep rows no one else has claimed since
+            leases = {}
+            for row in rows:
+                lease = leases.get(row[1], 0) + _SEND_LEASE
+                cursor = conn.execute(
+                    'UPDATE outbox SET next_try = ? '
+                    'WHERE id = ? AND next_try = ?',
+                    (now + lease, row[0], row[6]))
+                if cursor.rowcount == 1:
+                    leases[row[1]] = lease
+                    claimed.append(row[:6])
+
+        return claimed
+
+    def remove(self, row_id):
+        """Removes a sent message from the outbox.
+        """
+
+        with self._connect() as conn:
+            conn.execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+
+    def retry(self, row_id, attempts, next_try):
+        """Returns a message to the outbox, to be tried again at the
+        'next_try' UNIX timestamp.
         """
 
-        logging.debug("Validating Pushbullet credentials")
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE outbox SET attempts = ?, next_try = ? WHERE id = ?',
+                (attempts, next_try, row_id))
+
+    def count(self, keys=None, before=None):
+        """Returns the number of messages waiting to be sent, optionally for
+        the given credential hashes only. Set 'before' to a UNIX timestamp
+        to only count those which can be sent by then.
+        """
+
+        query = 'SELECT COUNT(*) FROM outbox WHERE 1'
+        params = []
+
+        if keys is not None:
+            query += ' AND key IN ({0})'.format(','.join('?' * len(keys)))
+            params.extend(keys)
+
+        if before is not None:
+            query += ' AND next_try <= ?'
+            params.append(before)
 
-        # Create pushover session object with credentials
-        self.pushbullet.session = requests.Session()
-        self.pushbullet.session.auth = (self.pushbullet.token, '')
-        self.pushbullet.session.headers.update({
-            'Content-Type': 'application/json'
-        })
+        with self._connect() as conn:
+            (count,) = conn.execute(query, params).fetchone()
+
+        return count
+
+    def expire(self, keys, before):
+        """Removes messages added before the 'before' UNIX timestamp for
+        any credential hashes other than the given ones. Returns the number
+        of messages removed.
+        """
+
+        query = 'DELETE FROM outbox WHERE added < ?'
+        params = [before]
+
+        if keys:
+            query += ' AND key NOT IN ({0})'.format(','.join('?' * len(keys)))
+            params.extend(keys)
+
+        with self._connect() as conn:
+            return conn.execute(query, params).rowcount
+
+    def next_try(self, keys):
+        """Returns the earliest time a message for the given credential
+        hashes can be sent, or None if there are none.
+        """
+
+        if not keys:
+            return None
+
+        with self._connect() as conn:
+            (next_try,) = conn.execute(
+                'SELECT MIN(next_try) FROM outbox WHERE key IN ({0})'.format(
+                    ','.join('?' * len(keys))),
+                list(keys)).fetchone()
+
+        return next_try
+
+    @contextmanager
+    def _connect(self):
+        """Opens a connection to the outbox database. The transaction is
+        committed, or rolled back on error, and the connection closed
+        when done.
+        """
 
-        # Make request
+        import sqlite3
+
+        conn = sqlite3.connect(self.outbox_file, timeout=30)
         try:
-            resp = self._make_request(
-                self.pushbullet.session,
-                'https://api.pushbullet.com/v2/users/me'
-            )
-        except RequestException as exc:
-            error_msg = 'Pushbullet: {0}'.format(exc.response.reason)
-            logging.error(error_msg)
-            self.parser.error(error_msg)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
 
-        # Check result
-        if 'error' in resp.keys():
-            error_msg = 'Pushbullet: {0}'.format(resp['error']['message'])
-            logging.error(error_msg)
-            self.parser.error(error_msg)
+    def __repr__(self):
+        return '<MHOutbox {0}>'.format(self.__dict__)
 
-        # Return success
-        logging.info("Pushbullet API credentials successfully validated")
 
-        return True
+class MHSender(object):
+    """A background thread which delivers push notifications from the
+    outbox, so slow 3rd party services never hold up adding media.
 
-    # 3rd party API send functions
+    Messages for different services are delivered in parallel. Digest
+    messages for the same service and media type which are ready at the
+    same time are merged into one. Messages longer than the service's
+    limit are shortened. Failed deliveries are retried with exponential
+    backoff, waiting longer if the service sends a rate limit reset time.
+    A message is dropped, with a warning, if the outbox already holds
+    _QUEUE_SIZE messages which can be delivered or after _RETRY_ATTEMPTS
+    failed deliveries.
+
+    Messages are only delivered for credential hashes with a registered
+    send function, so messages left over from an earlier run are sent
+    once an MHPush object with the same credentials is created. Those
+    still waiting for their credentials after _UNKNOWN_TTL seconds are
+    removed.
+
+    Arguments:
+        - outbox_file
+            Path to the outbox database. Defaults to the file returned by
+            _get_outbox_file().
+        - size
+            Largest number of messages to hold.
+
+    Public methods:
+        - |register()|
+            Sets the function used to send messages for a credential hash.
+
+        - |send()|
+            Adds a message to the outbox.
+
+        - |send_files()|
+            Adds a digest message of added and skipped files to the outbox.
+
+        - |flush()|
+            Blocks until all outbox messages which can be sent now have
+            been sent.
+    """
 
-    def _send_pushover(self, conn_msg, conn_title):
-        """Sends a message via the Pushover API.
+    def __init__(self, outbox_file=None, size=_QUEUE_SIZE):
+        """Initialize the MHSender class.
         """
 
-        logging.debug("Sending Pushover notification")
+        if outbox_file is None:
+            outbox_file = _get_outbox_file()
+
+        self.outbox = MHOutbox(outbox_file)
+        self.size = size
+        self.senders = {}
+        self.busy = False
+        self._wake = False
+        self._done = threading.Condition()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def register(self, key, sender, limit=None):
+        """Sets the function used to send messages for a credential hash.
+        The function is called with the message and title. Messages are
+        shortened to 'limit' characters, if set.
+        """
 
-        # Add values to request URL & encode
-        self.pushover.url["title"] = conn_title
-        self.pushover.url["message"] = conn_msg
+        self._start()
+
+        with self._done:
+            # Wake the sender thread to deliver any earlier messages
+            if key not in self.senders:
+                self._wake = True
+                self._done.notify_all()
+            self.senders[key] = (sender, limit)
+
+    def send(self, keys, conn_msg, conn_title):
+        """Adds a message to the outbox.
+
+        Required arguments:
+            - keys
+                List of credential hashes of the services to send the
+                message with.
+            - conn_msg
+                The message body.
+            - conn_title
+                The message title.
+        """
 
-        # Make request
-        resp = self._make_request(
-            self.pushover.session,
-            'https://api.pushover.net/1/messages.json',
-            'POST',
-            self.pushover.url
-        )
+        self._add(keys, conn_msg, conn_title)
+
+    def send_files(self, keys, conn_title, media_type, file_array, skipped,
+                   window=0, size=None):
+        """Adds a digest message of added and skipped files to the outbox.
+
+        Required arguments:
+            - keys
+                List of credential hashes of the services to send the
+                message with.
+            - conn_title
+                The title prefix, usually the notify name.
+            - media_type
+                The media type string of the files. Digest messages are
+                merged with others of the same type. Defaults to 'Media'
+                if None.
+            - file_array
+                List of files added.
+            - skipped
+                List of files skipped.
+
+        Optional arguments:
+            - window
+                Time, in seconds, to wait for more messages of the same
+                media type before sending.
+            - size
+                Number of messages of the same media type to send at
+                once, even if the window has not ended.
+        """
 
-        return resp
+        conn_msg = dumps({'added': file_array, 'skipped': skipped})
+        self._add(keys, conn_msg, conn_title,
+                  digest=media_type or 'Media', window=window,
+                  digest_size=size)
 
-    def _send_pushbullet(self, conn_msg, conn_title):
-        """Sends a message via the Pushbullet API.
+    def _add(self, keys, conn_msg, conn_title, **kwargs):
+        """Adds a message to the outbox and wakes the sender thread.
         """
 
-        logging.debug("Sending Pushbullet notification")
+        self._start()
 
-        # Set up json request data
-        request_data = dumps({
-            'type': 'note',
-            'title': conn_title,
-            'body': conn_msg,
-        })
+        # Clear out messages for credentials no longer in use
+        with self._done:
+            known = list(set(keys) | set(self.senders))
+        expired = self.outbox.expire(known, time.time() - _UNKNOWN_TTL)
+        if expired:
+            logging.warning("Dropped %s notifications for unknown services",
+                            expired)
 
-        # Make request
-        resp = self._make_request(
-            self.pushbullet.session,
-            'https://api.pushbullet.com/v2/pushes',
-            'POST',
-            request_data,
-        )
+        if not self.outbox.add(keys, conn_msg, conn_title, self.size,
+                               known=known, **kwargs):
+            logging.warning("Notification outbox full, dropping: %s",
+                            conn_title)
+            return
 
-        return resp
+        # Wake the sender thread
+        with self._done:
+            self._wake = True
+            self._done.notify_all()
+
+    def flush(self, timeout=None):
+        """Blocks until all outbox messages have been sent, or until the
+        timeout (in seconds) expires. Returns True if none are left.
+
+        Messages which cannot be retried before the timeout expires are
+        left in the outbox for a later run.
+        """
+
+        end = None if timeout is None else time.time() + timeout
+
+        with self._done:
+            while self.busy or self._wake or self._count(end):
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._done.wait(
+                    _FLUSH_POLL if remaining is None
+                    else min(remaining, _FLUSH_POLL))
+
+            unsent = self._count()
+
+        if unsent:
+            logging.warning("Unsent notifications: %s", unsent)
+
+        return not unsent
+
+    def _count(self, before=None):
+        """Returns the number of messages with a registered send function,
+        optionally only those which can be sent by the 'before' time.
+        """
+
+        if not self.senders:
+            return 0
+
+        return self.outbox.count(list(self.senders), before)
+
+    def _start(self):
+        """Starts the sender thread on first use.
+        """
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._worker, name='mh-notify')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _worker(self):
+        """Delivers messages from the outbox as they become ready.
+        """
+
+        while True:
+            with self._done:
+                # Sleep until woken up or the next retry is due
+                if not self._wake:
+                    next_try = self.outbox.next_try(list(self.senders))
+                    if next_try is None:
+                        self._done.wait()
+                    elif next_try > time.time():
+                        self._done.wait(next_try - time.time())
+                self._wake = False
+                self.busy = True
+                senders = dict(self.senders)
+
+            try:
+                self._deliver(senders)
+            except Exception:
+                logging.exception("Unable to read notification outbox")
+                time.sleep(_RETRY_DELAY)
+            finally:
+                with self._done:
+                    self.busy = False
+                    self._done.notify_all()
+
+    def _deliver(self, senders):
+        """Delivers the messages which are ready to be sent, each service in
+        its own thread.
+        """
+
+        # Group messages by service
+        messages = {}
+        for row in self.outbox.claim(list(senders)):
+            messages.setdefault(row[1], []).append(row)
+
+        threads = []
+        for (key, rows) in list(messages.items())[1:]:
+            thread = threading.Thread(
+                target=self._deliver_rows, args=(senders[key], rows))
+            thread.start()
+            threads.append(thread)
+        for (key, rows) in list(messages.items())[:1]:
+            self._deliver_rows(senders[key], rows)
+        for thread in threads:
+            thread.join()
+
+    def _deliver_rows(self, sender, rows):
+        """Delivers messages for one service, in order. When a delivery
+        fails, the rest of the messages wait for the same retry time.
+        """
+
+        (send, limit) = sender
+        retry_time = None
+
+        for (group, conn_msg, conn_title) in _merge_rows(rows, limit):
+            attempts = max(row[4] for row in group)
+
+            # An earlier message is waiting to be retried
+            if retry_time is not None:
+                for row in group:
+                    self.outbox.retry(row[0], attempts, retry_time)
+                continue
+
+            try:
+                send(conn_msg, conn_title)
+            except Exception as err:
+                retry_time = self._retry(
+                    [row[0] for row in group], attempts + 1, conn_title, err)
+            else:
+                for row in group:
+                    self.outbox.remove(row[0])
+
+    def _retry(self, row_ids, attempts, conn_title, err):
+        """Returns a failed message to the outbox with an exponential
+        backoff. Returns the retry time, or None if it was dropped.
+        """
+
+        from requests.exceptions import RequestException
+
+        # Only network and service availability errors are retried
+        if not isinstance(err, (Notifiers.MHRetry, RequestException)):
+            logging.error("Unable to send notification: %s (%s)",
+                          conn_title, err)
+            for row_id in row_ids:
+                self.outbox.remove(row_id)
+            return None
+
+        if attempts >= _RETRY_ATTEMPTS:
+            logging.error("Dropping notification after %s attempts: %s (%s)",
+                          attempts, conn_title, err)
+            for row_id in row_ids:
+                self.outbox.remove(row_id)
+            return None
+
+        # Back off, or wait for the service's reset time if it is later
+        delay = min(_RETRY_DELAY * 2 ** (attempts - 1), _RETRY_MAX_DELAY)
+        retry_time = time.time() + delay
+        if getattr(err, 'retry_time', None) is not None:
+            retry_time = max(retry_time, err.retry_time)
+
+        logging.warning("Retrying notification in %.0fs: %s (%s)",
+                        retry_time - time.time(), conn_title, err)
+        for row_id in row_ids:
+            self.outbox.retry(row_id, attempts, retry_time)
+
+        return retry_time
 
     def __repr__(self):
-        return '<MHPush {0}>'.format(self.__dict__)
+        return '<MHSender {0}>'.format(self.__dict__)
+
+
+def _merge_rows(rows, limit=None):
+    """Merges claimed outbox rows for one service into the messages to
+    send: a list of (rows, message, title) tuples.
+
+    Digest rows of the same media type become a single message, in the
+    place of the first of them. Messages are shortened to 'limit'
+    characters, if set.
+    """
+
+    messages = []
+    digests = {}
+
+    for row in rows:
+        digest = row[5]
+
+        # Plain message
+        if digest is None:
+            conn_msg = row[2]
+            if limit is not None and len(conn_msg) > limit:
+                conn_msg = conn_msg[:limit - 4] + ' ...'
+            messages.append(([row], conn_msg, row[3]))
+            continue
+
+        # Digest message
+        if digest not in digests:
+            digests[digest] = len(messages)
+            messages.append(([], None, None))
+        messages[digests[digest]][0].append(row)
+
+    # Build digest messages
+    for index in digests.values():
+        group = messages[index][0]
+        (file_array, skipped) = ([], [])
+        for row in group:
+            files = loads(row[2])
+            file_array.extend(files['added'])
+            skipped.extend(files['skipped'])
+
+        # Set title
+        media_type = group[0][5]
+        conn_title = '{0} Added'.format(
+            media_type if len(group) > 1 else 'Media')
+        if skipped:
+            conn_title = '{0} (with Skips)'.format(conn_title)
+
+        messages[index] = (
+            group,
+            _format_files(file_array, skipped, limit),
+            '{0}: {1}'.format(group[0][3], conn_title))
+
+    return messages
+
+
+def _format_files(file_array, skipped, limit=None):
+    """Builds a success message from lists of added and skipped files.
+
+    If the message would be longer than 'limit' characters, the end of
+    each list is replaced with a count of the files left out. Space the
+    skipped list does not need goes to the added list, and the other way
+    around.
+    """
+
+    header = 'Skipped files:\n' if skipped else ''
+    spacer = '\n' if file_array and skipped else ''
+
+    # Split the space between the lists
+    (added_space, skipped_space) = (None, None)
+    if limit is not None:
+        space = limit - len(header) - len(spacer)
+        skipped_length = sum(len(name) + 3 for name in skipped)
+        added_space = space - min(skipped_length, space // 2)
+
+    added_text = _format_list('+', file_array, added_space)
+    if limit is not None:
+        skipped_space = space - len(added_text)
+    skipped_text = _format_list('-', skipped, skipped_space)
+
+    conn_text = added_text
+    if skipped:
+        conn_text = '{0}{1}{2}{3}'.format(
+            added_text, spacer, header, skipped_text)
+
+    return conn_text if limit is None else conn_text[:limit]
+
+
+def _format_list(prefix, files, space=None):
+    """Builds a list of files, one per line. If it would be longer than
+    'space' characters, the files which do not fit are replaced with a
+    count of them.
+    """
+
+    lines = []
+    used = 0
+
+    for (index, name) in enumerate(files):
+        line = '{0} {1}\n'.format(prefix, name)
+        more = '{0} ... and {1} more\n'
+
+        # Leave room to say how many files are left out
+        left = len(files) - index - 1
+        reserve = len(more.format(prefix, left)) if left else 0
+
+        if space is not None and used + len(line) + reserve > space:
+            lines.append(more.format(prefix, len(files) - index))
+            break
+
+        lines.append(line)
+        used += len(line)
+
+    return ''.join(lines)
+
+
+def _get_outbox_file():
+    """Returns the path to the notification outbox database.
+    """
+
+    config_dir = os.path.join(
+        os.path.expanduser("~"), '.config', 'mediahandler')
+    if not os.path.exists(config_dir):
+        os.makedirs(config_dir)
+
+    return os.path.join(config_dir, '.notify.outbox')
+
+
+def get_sender():
+    """Returns the shared MHSender, creating it on first use. Queued
+    messages are flushed when the program exits.
+    """
+
+    global _SENDER
+
+    with _SENDER_LOCK:
+        if _SENDER is None:
+            _SENDER = MHSender()
+            atexit.register(_SENDER.flush, _FLUSH_TIMEOUT)
+
+    return _SENDER
+
+
+def _get_cache_file():
+    """Returns the path to the notification credential cache.
+    """
+    return os.path.join(os.path.expanduser("~"),
+                        '.config', 'mediahandler', '.notify.cache')
+
+
+def _load_cache():
+    """Returns the notification credential cache: a dict of the time each
+    credential hash was last validated.
+    """
+
+    try:
+        with open(_get_cache_file(), 'rb') as cache_io:
+            cache = pickle.load(cache_io)
+    except (OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, IndexError, TypeError):
+        return {}
+
+    if not isinstance(cache, dict):
+        return {}
+
+    return cache
+
+
+def _save_cache(key, validated):
+    """Records when a credential hash was validated, or removes it from
+    the credential cache if 'validated' is None.
+    """
+
+    with _CACHE_LOCK:
+        cache = _load_cache()
+        if validated is None:
+            cache.pop(key, None)
+        else:
+            cache[key] = validated
+
+        Config.dump_pickle(_get_cache_file(), cache)
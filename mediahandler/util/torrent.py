@@ -18,106 +18,882 @@
 Module: mediahandler.util.torrent
 
 Module contains:
+    - |MHDelugeTransport|
+        A synchronous connection to the Deluge daemon RPC interface.
+
+    - |MHSharedTransport|
+        Shares one Deluge connection between several users, connecting
+        on first use and disconnecting once none are using it.
+
+    - |MHTransportHandle|
+        One user's view of an MHSharedTransport.
+
+    - |MHDelugeClient|
+        A long-lived Deluge client which removes torrents from a queue in
+        a background thread, reconnecting as needed.
+
+    - |MHDelugeListener|
+        Listens for finished torrents on a Deluge connection and passes
+        their downloads to a callback.
+
+    - |get_transport()|
+        Returns a handle on the shared Deluge connection for the given
+        settings.
+
+    - |get_client()|
+        Returns the shared Deluge client for the given settings.
+
+    - |stop_client()|
+        Stops the shared Deluge client.
+
     - |remove_deluge_torrent()|
         Removes a torrent from Deluge.
 
 """
 
+import os
+import time
+import pickle
 import logging
+import threading
+from queue import Queue, Empty
 
+import mediahandler.util.config as Config
 
-def remove_deluge_torrent(settings, torrent_hash):
-    """Removes a torrent from Deluge.
+# Seconds to wait for a Deluge RPC call
+_CALL_TIMEOUT = 30
 
-    Required arguments:
+# Seconds to wait before the first reconnect, doubled on each failure
+_RETRY_DELAY = 2
+
+# Number of times to try a removal before giving up
+_RETRY_ATTEMPTS = 5
+
+# Largest number of torrents removed with one call
+_BATCH_SIZE = 100
+
+# Seconds remove_deluge_torrent() waits for the removal
+_REMOVE_TIMEOUT = 120
+
+# Seconds between checks of the listener's connection
+_LISTEN_POLL = 5
+
+# Longest wait, in seconds, between listener reconnects
+_LISTEN_MAX_DELAY = 300
+
+# Deluge event sent when a torrent finishes downloading
+_FINISHED_EVENT = 'TorrentFinishedEvent'
+
+# Shared client used by get_client(), and the settings it was made with
+_CLIENT = None
+_CLIENT_KEY = None
+_CLIENT_LOCK = threading.Lock()
+
+# Shared connection used by get_transport(), and the settings it was made
+# with. The Deluge UI client is global to the process, so it has one owner
+_TRANSPORT = None
+_TRANSPORT_KEY = None
+_TRANSPORT_LOCK = threading.Lock()
+
+# Thread running the Twisted reactor, started once per process
+_REACTOR_THREAD = None
+_REACTOR_LOCK = threading.Lock()
+
+
+class MHDelugeTransport(object):
+    """A synchronous connection to the Deluge daemon RPC interface.
+
+    Uses the Deluge UI client. The Twisted reactor it needs is started
+    once, in a background thread, and left running for the life of the
+    process, since a reactor cannot be restarted. For more information,
+    visit: http://dev.deluge-torrent.org/wiki/Development/UiClient1.2
+
+    Other transports, such as a stand-in for tests, only need to provide
+    the same public methods.
+
+    Required argument:
         - settings
             Dict or MHSettings object for Deluge info.
-        - torrent_hash
-            Valid hash of active torrent to be removed.
 
-    This is a Twisted Deferred object which hooks into the Deluge UI client.
-    For more information, visit:
-    http://dev.deluge-torrent.org/wiki/Development/UiClient1.2
+    Public methods:
+        - |connect()|
+            Connects and logs in to the Deluge daemon.
+
+        - |is_connected()|
+            Returns True if connected to the Deluge daemon.
+
+        - |call()|
+            Runs a Deluge RPC method and returns its result.
+
+        - |subscribe()|
+            Calls a function whenever the Deluge daemon sends an event.
+
+        - |disconnect()|
+            Disconnects from the Deluge daemon.
     """
 
-    logging.info("Removing torrent from Deluge")
+    def __init__(self, settings):
+        """Initialize the MHDelugeTransport class.
+        """
 
-    # Import modules
-    from twisted.internet import reactor
-    from deluge.ui.client import client
+        self.settings = settings
 
-    # Connect to Deluge daemon
-    deluge = client.connect(
-        host=settings['host'],
-        port=settings['port'],
-        username=settings['user'],
-        password=settings['pass']
-    )
+    def connect(self):
+        """Connects and logs in to the Deluge daemon.
+        """
 
-    # We create a callback function to be called upon a successful connection
-    def on_connect_success(result):
-        """Connect success callback.
+        from deluge.ui.client import client
+
+        self._call_in_reactor(
+            client.connect,
+            host=self.settings['host'],
+            port=self.settings['port'],
+            username=self.settings['user'],
+            password=self.settings['pass'])
+
+    def is_connected(self):
+        """Returns True if connected to the Deluge daemon.
+        """
+
+        from deluge.ui.client import client
+
+        return client.connected()
+
+    def call(self, method, *args):
+        """Runs a Deluge RPC method, e.g. 'core.remove_torrent', and returns
+        its result.
+        """
+
+        from deluge.ui.client import client
+
+        (namespace, name) = method.split('.', 1)
+
+        return self._call_in_reactor(
+            getattr(getattr(client, namespace), name), *args)
+
+    def subscribe(self, event, handler):
+        """Calls 'handler' with the event arguments whenever the Deluge
+        daemon sends the named event. Handlers are called in the reactor
+        thread, so they must not call back into Deluge themselves.
+
+        The Deluge UI client keeps its event handlers, and registers them
+        again with the daemon, when it reconnects.
+        """
+
+        from deluge.ui.client import client
+        from twisted.internet.threads import blockingCallFromThread
+
+        blockingCallFromThread(
+            _start_reactor(), client.register_event_handler, event, handler)
+
+    def disconnect(self):
+        """Disconnects from the Deluge daemon.
         """
 
-        logging.debug("Connection was successful: %s", result)
+        from deluge.ui.client import client
 
-        def on_remove_torrent(success):
-            """On remove callback.
+        if client.connected():
+            self._call_in_reactor(client.disconnect)
+
+    @staticmethod
+    def _call_in_reactor(func, *args, **kwargs):
+        """Runs a function returning a Deferred in the reactor thread and
+        waits for its result.
+        """
+
+        from twisted.internet.threads import blockingCallFromThread
+
+        reactor = _start_reactor()
+
+        def run():
+            """Adds a timeout to the Deferred.
             """
+            return func(*args, **kwargs).addTimeout(_CALL_TIMEOUT, reactor)
+
+        return blockingCallFromThread(reactor, run)
+
+    def __repr__(self):
+        return '<MHDelugeTransport {0}>'.format(
+            {'host': self.settings['host'], 'port': self.settings['port']})
+
+
+class MHSharedTransport(object):
+    """Shares one Deluge connection between several users, such as the
+    removal client and the listener, which would otherwise tear down each
+    other's connection and event subscriptions.
+
+    Each user talks to Deluge through its own MHTransportHandle. The
+    connection is opened when the first user connects, and closed once
+    every user has disconnected. The connections are numbered, so a user
+    can tell when someone else has reconnected since it last connected.
+
+    Required argument:
+        - transport
+            Object used to talk to Deluge, e.g. an MHDelugeTransport.
+
+    Public method:
+        - |get_handle()|
+            Returns a new handle on the connection for one user.
+    """
+
+    def __init__(self, transport):
+        """Initialize the MHSharedTransport class.
+        """
+
+        self.transport = transport
+        self.users = set()
+        self.connection = 0
+        self._lock = threading.Lock()
+
+    def get_handle(self):
+        """Returns a new handle on the connection for one user.
+        """
+
+        return MHTransportHandle(self)
+
+    def connect(self, handle):
+        """Adds a user of the connection, connecting if needed. Returns
+        the number of the connection.
+        """
+
+        with self._lock:
+            if not self.transport.is_connected():
+                self.transport.connect()
+                self.connection += 1
+            self.users.add(handle)
+
+            return self.connection
+
+    def disconnect(self, handle):
+        """Removes a user of the connection, disconnecting once there are
+        no users left.
+        """
+
+        with self._lock:
+            self.users.discard(handle)
+            if not self.users and self.transport.is_connected():
+                self.transport.disconnect()
+
+    def __repr__(self):
+        return '<MHSharedTransport {0}>'.format(self.__dict__)
+
+
+class MHTransportHandle(object):
+    """One user's view of an MHSharedTransport, with the same public
+    methods as an MHDelugeTransport.
+
+    It only counts as connected while the connection it opened, or joined,
+    is still up. After another user reconnects, it reports it is not
+    connected, so its user connects again and renews its subscriptions.
+
+    Required argument:
+        - shared
+            The MHSharedTransport to use.
+    """
+
+    def __init__(self, shared):
+        """Initialize the MHTransportHandle class.
+        """
+
+        self.shared = shared
+        self.connection = None
+
+    def connect(self):
+        """Connects to the Deluge daemon, or joins the open connection.
+        """
+
+        self.connection = self.shared.connect(self)
+
+    def is_connected(self):
+        """Returns True if the connection this handle joined is still up.
+        """
+
+        return (self.connection == self.shared.connection and
+                self.shared.transport.is_connected())
+
+    def call(self, method, *args):
+        """Runs a Deluge RPC method and returns its result.
+        """
+
+        return self.shared.transport.call(method, *args)
+
+    def subscribe(self, event, handler):
+        """Calls a function whenever the Deluge daemon sends an event.
+        """
+
+        self.shared.transport.subscribe(event, handler)
+
+    def disconnect(self):
+        """Stops using the connection. It is only closed once no one else
+        is using it.
+        """
+
+        self.connection = None
+        self.shared.disconnect(self)
+
+    def __repr__(self):
+        return '<MHTransportHandle {0}>'.format(self.__dict__)
+
+
+class MHDelugeClient(object):
+    """A long-lived Deluge client which removes torrents from a queue in a
+    background thread.
+
+    The connection to Deluge is opened on first use and kept open between
+    removals. Torrents are looked up by hash, and queued torrents are
+    removed together with a single call on Deluge 2.0 and later. If a call
+    fails, the client reconnects and tries again with an exponential
+    backoff, giving up on the torrent after _RETRY_ATTEMPTS tries. The time
+    each batch took to remove is logged and kept as 'latency'.
+
+    Required argument:
+        - settings
+            Dict or MHSettings object for Deluge info.
+
+    Optional argument:
+        - transport
+            Object used to talk to Deluge. Defaults to a handle on the
+            shared connection from get_transport().
+
+    Public methods:
+        - |remove()|
+            Adds torrents to the removal queue.
+
+        - |flush()|
+            Blocks until the removal queue is empty.
+
+        - |close()|
+            Stops the client thread and disconnects from Deluge.
+    """
+
+    def __init__(self, settings, transport=None):
+        """Initialize the MHDelugeClient class.
+        """
+
+        if transport is None:
+            transport = get_transport(settings)
+
+        self.settings = settings
+        self.transport = transport
+        self.queue = []
+        self.busy = False
+        self.can_batch = False
+        self.latency = None
+        self._closed = False
+        self._done = threading.Condition()
+        self._thread = None
+
+    def remove(self, *torrent_hashes):
+        """Adds torrents to the removal queue.
+
+        Required argument:
+            - torrent_hashes
+                Valid hashes of active torrents to be removed.
+        """
+
+        with self._done:
+            if self._closed:
+                logging.warning("Deluge client closed, not removing: %s",
+                                ', '.join(torrent_hashes))
+                return
+
+            # Start the client thread on first use
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._worker, name='mh-deluge')
+                self._thread.daemon = True
+                self._thread.start()
+
+            self.queue.extend(torrent_hashes)
+            self._done.notify_all()
+
+    def flush(self, timeout=None):
+        """Blocks until the removal queue is empty, or until the timeout (in
+        seconds) expires. Returns True if it is empty.
+        """
+
+        end = None if timeout is None else time.time() + timeout
+
+        with self._done:
+            while self.queue or self.busy:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    logging.warning("Torrents not removed: %s",
+                                    len(self.queue) + int(self.busy))
+                    return False
+                self._done.wait(remaining)
+
+        return True
+
+    def close(self, timeout=None):
+        """Stops the client thread, once the removal queue is empty or the
+        timeout (in seconds) expires, and disconnects from Deluge.
+        """
+
+        self.flush(timeout)
+
+        with self._done:
+            self._closed = True
+            self._done.notify_all()
+            thread = self._thread
 
-            if success:
-                logging.debug("Torrent remove successful")
+        if thread is not None:
+            thread.join(timeout)
+
+        self._disconnect()
+
+    def _worker(self):
+        """Removes torrents from the queue as they are added, in batches of
+        up to _BATCH_SIZE.
+        """
+
+        while True:
+            with self._done:
+                while not self.queue and not self._closed:
+                    self._done.wait()
+                if self._closed:
+                    return
+                torrent_hashes = self.queue[:_BATCH_SIZE]
+                del self.queue[:_BATCH_SIZE]
+                self.busy = True
+
+            try:
+                self._remove(torrent_hashes)
+            finally:
+                with self._done:
+                    self.busy = False
+                    self._done.notify_all()
+
+    def _remove(self, torrent_hashes):
+        """Removes torrents, reconnecting and retrying on failure. Returns
+        the list of removed hashes.
+        """
+
+        start = time.time()
+
+        for attempt in range(1, _RETRY_ATTEMPTS + 1):
+            try:
+                removed = self._remove_torrents(torrent_hashes)
+            except Exception as err:
+                logging.warning("Deluge call failed (attempt %s): %s",
+                                attempt, err)
+                self._disconnect()
             else:
-                logging.warning("Torrent remove unsuccessful")
+                self.latency = time.time() - start
+                logging.info("Removed %s of %s torrents from Deluge in %.3fs",
+                             len(removed), len(torrent_hashes), self.latency)
+                return removed
 
-            # Disconnect from the daemon & exit
-            client.disconnect()
-            reactor.stop()
+            if attempt < _RETRY_ATTEMPTS:
+                # Wait before reconnecting, unless the client is closed
+                with self._done:
+                    self._done.wait(_RETRY_DELAY * 2 ** (attempt - 1))
+                    if self._closed:
+                        break
 
-        def on_get_session_state(torrents):
-            """On session state callback.
-            """
+        self.latency = time.time() - start
+        logging.error("Unable to remove torrents from Deluge after %.3fs: %s",
+                      self.latency, ', '.join(torrent_hashes))
+
+        return []
+
+    def _remove_torrents(self, torrent_hashes):
+        """Connects to Deluge if needed and removes the torrents, leaving
+        their data in place. Returns the list of removed hashes.
+        """
+
+        logging.info("Removing torrents from Deluge: %s", len(torrent_hashes))
+
+        if not self.transport.is_connected():
+            self.transport.connect()
+            logging.debug("Connected to Deluge")
+            self.can_batch = self._can_batch()
+
+        # Look up only the torrents we want, not the whole session
+        found = self.transport.call(
+            'core.get_torrents_status', {'id': torrent_hashes}, ['hash'])
+        found = [torrent_hash for torrent_hash in torrent_hashes
+                 if torrent_hash in found]
+        for torrent_hash in torrent_hashes:
+            if torrent_hash not in found:
+                logging.warning("Torrent not found: %s", torrent_hash)
+
+        if not found:
+            return []
+
+        # Remove all of them in one call, if the daemon supports it
+        if len(found) > 1 and self.can_batch:
+            errors = dict(
+                self.transport.call('core.remove_torrents', found, False))
+        else:
+            errors = {}
+            for torrent_hash in found:
+                if not self.transport.call(
+                        'core.remove_torrent', torrent_hash, False):
+                    errors[torrent_hash] = 'remove failed'
+
+        removed = []
+        for torrent_hash in found:
+            if torrent_hash in errors:
+                logging.warning("Torrent remove unsuccessful: %s (%s)",
+                                torrent_hash, errors[torrent_hash])
+            else:
+                logging.debug("Torrent remove successful: %s", torrent_hash)
+                removed.append(torrent_hash)
+
+        return removed
+
+    def _can_batch(self):
+        """Returns True if the Deluge daemon has the remove_torrents() call,
+        added in Deluge 2.0.
+        """
+
+        version = self.transport.call('daemon.info')
+        logging.debug("Deluge daemon version: %s", version)
+
+        try:
+            return int(str(version).split('.')[0]) >= 2
+        except ValueError:
+            return False
+
+    def _disconnect(self):
+        """Disconnects from Deluge, ignoring errors.
+        """
+
+        try:
+            self.transport.disconnect()
+        except Exception as err:
+            logging.debug("Deluge disconnect failed: %s", err)
+
+    def __repr__(self):
+        return '<MHDelugeClient {0}>'.format(self.__dict__)
+
+
+class MHDelugeListener(object):
+    """Listens for finished torrents on a Deluge connection and passes
+    their downloads to a callback, so a long-running process can add them
+    without Deluge starting 'addmedia-deluge' for each one.
+
+    Subscribes to the Deluge 'TorrentFinishedEvent'. Each time it
+    connects, it also catches up on torrents which finished while it was
+    not connected. The hashes of finished torrents it has seen are saved
+    in a state file. When there is no state file, the torrents already
+    finished are recorded without being passed on, so an existing library
+    isn't added again.
+
+    Required arguments:
+        - settings
+            Dict or MHSettings object for Deluge info.
+        - callback
+            Function called with the torrent hash and the full path to
+            its download.
+
+    Optional arguments:
+        - transport
+            Object used to talk to Deluge. Defaults to a handle on the
+            shared connection from get_transport().
+        - state_file
+            Path to the state file. Defaults to the file returned by
+            _get_state_file().
+
+    Public methods:
+        - |run()|
+            Listens for finished torrents until stop() is called.
+
+        - |stop()|
+            Stops listening.
+    """
+
+    def __init__(self, settings, callback, transport=None, state_file=None):
+        """Initialize the MHDelugeListener class.
+        """
+
+        if transport is None:
+            transport = get_transport(settings)
+        if state_file is None:
+            state_file = _get_state_file()
+
+        self.settings = settings
+        self.callback = callback
+        self.transport = transport
+        self.state_file = state_file
+        self.seen = None
+        self.events = Queue()
+        self._stop = threading.Event()
+
+    def run(self):
+        """Listens for finished torrents until stop() is called,
+        reconnecting with an exponential backoff when the connection
+        fails.
+        """
+
+        logging.info("Listening for finished torrents in Deluge")
+
+        self._stop.clear()
+        self.seen = self._load_state()
+        attempt = 0
+
+        while not self._stop.is_set():
+            try:
+                if not self.transport.is_connected():
+                    self._connect()
+                    attempt = 0
+
+                # Wait for the next event
+                try:
+                    torrent_hash = self.events.get(timeout=_LISTEN_POLL)
+                except Empty:
+                    continue
+                if torrent_hash is not None:
+                    self._finished(torrent_hash)
+
+            except Exception as err:
+                attempt += 1
+                delay = min(_RETRY_DELAY * 2 ** (attempt - 1),
+                            _LISTEN_MAX_DELAY)
+                logging.warning("Deluge connection failed, retrying in "
+                                "%ss: %s", delay, err)
+                self._disconnect()
+                self._stop.wait(delay)
+
+        self._disconnect()
+
+    def stop(self):
+        """Stops listening.
+        """
+
+        self._stop.set()
+        self.events.put(None)
+
+    def _connect(self):
+        """Connects to Deluge, subscribes to finished torrent events and
+        catches up on any torrents which finished since the last
+        connection.
+        """
+
+        self.transport.connect()
+        logging.debug("Connected to Deluge")
+
+        self.transport.subscribe(_FINISHED_EVENT, self._on_event)
+        self._catch_up()
+
+    def _on_event(self, torrent_hash, *args):
+        """Deluge event handler, run in the reactor thread. Queues the
+        torrent for the listener thread.
+        """
+
+        logging.debug("Torrent finished: %s", torrent_hash)
+        self.events.put(torrent_hash)
+
+    def _catch_up(self):
+        """Passes on finished torrents which haven't been seen before.
+        """
+
+        torrents = self.transport.call(
+            'core.get_torrents_status', {},
+            ['name', 'save_path', 'is_finished'])
+        finished = dict((torrent_hash, status) for (torrent_hash, status)
+                        in torrents.items() if status.get('is_finished'))
 
-            # Look for completed torrent in list
-            found = False
-            for tor in torrents:
-                if tor == torrent_hash:
+        # First run, only record what has already finished
+        if self.seen is None:
+            logging.info("Recording %s finished torrents", len(finished))
+            self.seen = set(finished)
+        else:
+            missed = [torrent_hash for torrent_hash in finished
+                      if torrent_hash not in self.seen]
+            if missed:
+                logging.info("Catching up on %s finished torrents",
+                             len(missed))
+            for torrent_hash in missed:
+                self._finished(torrent_hash, finished[torrent_hash], False)
 
-                    # Set as found and call remove function
-                    logging.debug("Torrent found")
-                    found = True
-                    client.core.remove_torrent(
-                        torrent_hash,
-                        False).addCallback(
-                            on_remove_torrent)
-                    break
+            # Forget torrents which are no longer in Deluge
+            self.seen &= set(torrents)
 
-            if not found:
-                logging.warning("Torrent not found")
+        self._save_state()
 
-                # Disconnect from the daemon & exit
-                client.disconnect()
-                reactor.stop()
+    def _finished(self, torrent_hash, status=None, save=True):
+        """Passes a finished torrent's download to the callback, once.
+        """
+
+        if torrent_hash in self.seen:
+            return
+
+        if status is None:
+            status = self.transport.call(
+                'core.get_torrent_status', torrent_hash,
+                ['name', 'save_path'])
+            if not status:
+                logging.warning("Torrent not found: %s", torrent_hash)
+                return
+
+        media = os.path.join(status['save_path'], status['name'])
+        logging.info("Adding finished torrent: %s", media)
+
+        try:
+            self.callback(torrent_hash, media)
+        except Exception:
+            logging.exception("Unable to add finished torrent: %s", media)
+
+        self.seen.add(torrent_hash)
+        if save:
+            self._save_state()
+
+    def _load_state(self):
+        """Returns the set of finished torrent hashes saved in the state
+        file, or None if there isn't one.
+        """
+
+        try:
+            with open(self.state_file, 'rb') as state_io:
+                seen = pickle.load(state_io)
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError, IndexError, TypeError):
+            return None
 
-        # Get list of current torrent hashes
-        client.core.get_session_state().addCallback(on_get_session_state)
+        if not isinstance(seen, set):
+            return None
 
-    # We add the callback to the Deferred object we got from connect()
-    deluge.addCallback(on_connect_success)
+        return seen
 
-    # To be called when an error is encountered
-    def on_connect_fail(result):
-        """Connect fail callback.
+    def _save_state(self):
+        """Saves the set of finished torrent hashes to the state file.
         """
 
-        logging.error("Connection failed: %s", result)
+        Config.dump_pickle(self.state_file, self.seen)
+
+    def _disconnect(self):
+        """Disconnects from Deluge, ignoring errors.
+        """
+
+        try:
+            self.transport.disconnect()
+        except Exception as err:
+            logging.debug("Deluge disconnect failed: %s", err)
+
+    def __repr__(self):
+        return '<MHDelugeListener {0}>'.format(self.__dict__)
+
+
+def get_transport(settings):
+    """Returns a new handle on the shared Deluge connection for the given
+    settings, creating it on first use.
+
+    Required argument:
+        - settings
+            Dict or MHSettings object for Deluge info.
+    """
+
+    global _TRANSPORT, _TRANSPORT_KEY
+
+    key = _get_settings_key(settings)
+
+    with _TRANSPORT_LOCK:
+        if _TRANSPORT is None or _TRANSPORT_KEY != key:
+            _TRANSPORT = MHSharedTransport(MHDelugeTransport(settings))
+            _TRANSPORT_KEY = key
+
+        return _TRANSPORT.get_handle()
+
+
+def get_client(settings):
+    """Returns the shared Deluge client for the given settings, creating
+    it on first use.
+
+    Required argument:
+        - settings
+            Dict or MHSettings object for Deluge info.
+    """
+
+    global _CLIENT, _CLIENT_KEY
+
+    key = _get_settings_key(settings)
+
+    with _CLIENT_LOCK:
+        # Settings have changed
+        if _CLIENT is not None and _CLIENT_KEY != key:
+            _CLIENT.close(_CALL_TIMEOUT)
+            _CLIENT = None
+        if _CLIENT is None:
+            _CLIENT = MHDelugeClient(settings)
+            _CLIENT_KEY = key
+
+    return _CLIENT
 
-        # Disconnect from the daemon & exit
-        client.disconnect()
-        reactor.stop()
 
-    # We add the callback (in this case it's an errback, for error)
-    deluge.addErrback(on_connect_fail)
+def stop_client(timeout=_REMOVE_TIMEOUT):
+    """Stops the shared Deluge client, waiting up to the timeout (in
+    seconds) for queued removals. The shared connection is forgotten too,
+    once no one is using it.
+    """
+
+    global _CLIENT, _CLIENT_KEY, _TRANSPORT, _TRANSPORT_KEY
+
+    with _CLIENT_LOCK:
+        if _CLIENT is not None:
+            _CLIENT.close(timeout)
+            _CLIENT = None
+            _CLIENT_KEY = None
+
+    with _TRANSPORT_LOCK:
+        if _TRANSPORT is not None and not _TRANSPORT.users:
+            _TRANSPORT = None
+            _TRANSPORT_KEY = None
+
+
+def remove_deluge_torrent(settings, torrent_hash):
+    """Removes a torrent from Deluge, using the shared client, and waits
+    for the removal to finish.
+
+    Required arguments:
+        - settings
+            Dict or MHSettings object for Deluge info.
+        - torrent_hash
+            Valid hash of active torrent to be removed.
+    """
+
+    client = get_client(settings)
+    client.remove(torrent_hash)
+
+    return client.flush(_REMOVE_TIMEOUT)
+
+
+def _get_settings_key(settings):
+    """Returns the Deluge connection settings, used to tell whether they
+    have changed.
+    """
+
+    return tuple(settings[name] for name in ('host', 'port', 'user', 'pass'))
+
+
+def _get_state_file():
+    """Returns the path to the Deluge listener state file.
+    """
+
+    config_dir = os.path.join(
+        os.path.expanduser("~"), '.config', 'mediahandler')
+    if not os.path.exists(config_dir):
+        os.makedirs(config_dir)
+
+    return os.path.join(config_dir, '.deluge.state')
+
+
+def _start_reactor():
+    """Starts the Twisted reactor in a background thread on first use and
+    returns it.
+    """
+
+    global _REACTOR_THREAD
+
+    from twisted.internet import reactor
+
+    with _REACTOR_LOCK:
+        if _REACTOR_THREAD is None:
+            _REACTOR_THREAD = threading.Thread(
+                target=reactor.run, kwargs={'installSignalHandlers': False},
+                name='mh-reactor')
+            _REACTOR_THREAD.daemon = True
+            _REACTOR_THREAD.start()
 
-    # Run the twisted main loop to make everything go
-    reactor.run()
+    return reactor
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""
+Module: mediahandler.util.watch
+
+Module contains:
+
+    - |MHWatcher|
+        Watches the media type drop folders for new downloads and hands
+        them off to a callback once they have finished being written.
+
+"""
+
+import os
+import time
+import errno
+import select
+import logging
+import threading
+
+import mediahandler as mh
+
+# inotify event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Read buffer large enough for several events with names
+_EVENT_BUFFER = 4096
+
+
+class MHWatcher(mh.MHObject):
+    """Watches the media type drop folders for new downloads.
+
+    Each sub-folder of the watch folder whose name is a recognized media
+    type (e.g. 'TV', 'Movies') is treated as a drop folder. New entries
+    are held until their size and modification time stop changing for
+    'settle_time' seconds, then passed to the callback. The folders that
+    downloaded archives will be extracted to, next to them, are not taken
+    for new downloads.
+
+    Required arguments:
+        - settings
+            Dict or MHSettings object for Daemon info.
+        - callback
+            Function called with the full path of each new download.
+
+    Public methods:
+        - |run()|
+            Watches the drop folders until stop() is called.
+
+        - |stop()|
+            Stops a running watcher.
+    """
+
+    def __init__(self, settings, callback):
+        """Initialize the MHWatcher class.
+
+        Required arguments:
+            - settings
+                Dict or MHSettings object for Daemon info.
+            - callback
+                Function called with the full path of each new download.
+        """
+
+        super(MHWatcher, self).__init__(settings)
+
+        # Set up class members
+        self.callback = callback
+        self.folders = []
+        self.seen = set()
+        self.pending = {}
+        self.outputs = {}
+        self._inotify = None
+        self._stopped = threading.Event()
+
+        # Check for a watch folder
+        if self.watch_folder is None:
+            raise ValueError('A Daemon watch_folder is required')
+
+    def run(self):
+        """Watches the drop folders until stop() is called.
+        """
+
+        logging.info("Starting watcher: %s", self.watch_folder)
+
+        # Find drop folders & record what is already there
+        self.folders = self._get_drop_folders()
+        for folder in self.folders:
+            self.seen.update(self._scan_folder(folder))
+
+        # Use inotify when possible
+        if self.use_inotify:
+            self._inotify = _Inotify.create(self.folders)
+        if self._inotify is None:
+            logging.info("Using polling watcher")
+
+        try:
+            while not self._stopped.is_set():
+                self._wait_for_changes()
+                self._check_pending()
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+
+        logging.info("Watcher stopped")
+
+    def stop(self):
+        """Stops a running watcher.
+        """
+        self._stopped.set()
+
+    def _get_drop_folders(self):
+        """Returns the sub-folders of the watch folder which are named for
+        a recognized media type.
+        """
+
+        folders = []
+        for item in sorted(os.listdir(self.watch_folder)):
+            item_path = os.path.join(self.watch_folder, item)
+            if os.path.isdir(item_path) and item.lower() in mh.__mediatypes__:
+                logging.debug("Watching drop folder: %s", item_path)
+                folders.append(item_path)
+
+        if not folders:
+            logging.warning(
+                "No media type folders found in: %s", self.watch_folder)
+
+        return folders
+
+    @staticmethod
+    def _scan_folder(folder):
+        """Returns the full paths of all entries in a drop folder.
+        """
+
+        try:
+            return set(os.path.join(folder, item)
+                       for item in os.listdir(folder)
+                       if not item.startswith('.'))
+        except OSError:
+            return set()
+
+    def _wait_for_changes(self):
+        """Waits for new entries in the drop folders and adds them to the
+        pending list.
+        """
+
+        # Block on inotify events, if in use
+        if self._inotify is not None:
+            self._inotify.wait(self.poll_interval)
+        else:
+            self._stopped.wait(self.poll_interval)
+
+        # Look for new entries
+        current = set()
+        for folder in self.folders:
+            current.update(self._scan_folder(folder))
+
+        for item in current - self.seen:
+            if os.path.abspath(item) in self.outputs:
+                logging.debug("Ignoring extracted files: %s", item)
+                continue
+            logging.debug("New download found: %s", item)
+            self.pending[item] = (None, time.time())
+
+        # Forget about entries which are gone
+        self.seen = current
+        for item in list(self.pending):
+            if item not in current:
+                del self.pending[item]
+
+        # Forget extraction folders once they and their archive are gone
+        for (output, item) in list(self.outputs.items()):
+            if item not in current and not os.path.exists(output):
+                del self.outputs[output]
+
+    def _check_pending(self):
+        """Sends pending entries which have settled to the callback.
+        """
+
+        now = time.time()
+        for item in sorted(self.pending):
+            (last_state, changed) = self.pending[item]
+            state = _get_state(item)
+
+            # Gone since the last scan
+            if state is None:
+                continue
+
+            # Still changing, reset the clock
+            if state != last_state:
+                self.pending[item] = (state, now)
+                if self.settle_time > 0:
+                    continue
+
+            # Wait until it has been quiet long enough
+            elif now - changed < self.settle_time:
+                continue
+
+            del self.pending[item]
+            logging.info("Download ready: %s", item)
+            self._add_outputs(item)
+            self.callback(item)
+
+    def _add_outputs(self, item):
+        """Records the folders a downloaded archive will be extracted to,
+        so they are not taken for new downloads.
+        """
+
+        # Archives in a folder are extracted inside of it
+        if os.path.isdir(item):
+            return
+
+        import mediahandler.util.extract as Extract
+
+        try:
+            archives = Extract.find_archives(item)
+        except OSError:
+            return
+
+        for archive in archives:
+            self.outputs[archive.output] = item
+
+    def __repr__(self):
+        return '<MHWatcher {0}>'.format(self.__dict__)
+
+
+def _get_state(item):
+    """Returns the total size and latest modification time of a file or
+    folder, used to detect when a download has finished being written.
+    Returns None if a file no longer exists.
+    """
+
+    size = 0
+    mtime = 0
+    stack = [item]
+    while stack:
+        try:
+            for entry in os.scandir(stack.pop()):
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                stat = entry.stat(follow_symlinks=False)
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime)
+        except NotADirectoryError:
+            try:
+                stat = os.stat(item)
+            except OSError:
+                return None
+            return stat.st_size, stat.st_mtime
+        except OSError:
+            continue
+
+    return size, mtime
+
+
+class _Inotify(object):
+    """Minimal ctypes wrapper around the Linux inotify API.
+    """
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+
+    @classmethod
+    def create(cls, folders):
+        """Returns an _Inotify object watching the provided folders, or None
+        if inotify is not available on this system.
+        """
+
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+
+        if fd < 0:
+            return None
+
+        watcher = cls(libc, fd)
+        mask = IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO
+        for folder in folders:
+            if libc.inotify_add_watch(fd, folder.encode(), mask) < 0:
+                logging.warning("Unable to watch folder: %s", folder)
+                watcher.close()
+                return None
+
+        logging.info("Using inotify watcher")
+
+        return watcher
+
+    def wait(self, timeout):
+        """Blocks until events are available or the timeout expires, then
+        drains the event queue.
+        """
+
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+
+        # The folders are rescanned by the caller, just empty the queue
+        while True:
+            try:
+                if not os.read(self.fd, _EVENT_BUFFER):
+                    break
+            except OSError as exc:
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+        return True
+
+    def close(self):
+        """Closes the inotify file descriptor.
+        """
+        os.close(self.fd)
@@ -18,14 +18,35 @@
 """
 
 import os
+from importlib.util import find_spec
 from setuptools import setup
-from mediahandler.util.config import make_config
+from setuptools.command.build_py import build_py
+from mediahandler.util.config import make_config, compile_schema
 
 # Set up extra scripts
 _extra_scripts = []
 if os.name == 'nt':
     _extra_scripts.append('addmedia-deluge.bat')
 
+
+class BuildPy(build_py):
+    """Compiles the yaml schema files into the built package.
+
+    Skipped if PyYAML is not installed yet, in which case the schema
+    files are parsed at run time instead.
+    """
+
+    def run(self):
+        build_py.run(self)
+
+        # Compile yaml schema files
+        if find_spec('yaml') is None:
+            self.announce('PyYAML not found, skipping schema compile', 2)
+            return
+        compile_schema(os.path.join(
+            self.build_lib, 'mediahandler', 'util', '_schema.py'))
+
+
 # Set up mediahandler package
 setup(
     name='em-media-handler',
@@ -39,9 +60,11 @@ setup(
     long_description=open('README.md').read(),
     test_suite='tests.testall.suite',
     include_package_data=True,
+    cmdclass={'build_py': BuildPy},
 
     packages=[
         'mediahandler',
+        'mediahandler.notifiers',
         'mediahandler.types',
         'mediahandler.util',
     ],
@@ -72,6 +95,10 @@ setup(
             'twisted',
             'pyopenssl'
         ],
+        'extract': [
+            'py7zr',
+            'rarfile'
+        ],
     },
 
     tests_require=[
@@ -0,0 +1,516 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler Testing Module
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""Startup time benchmark module
+
+Runs the addmedia entry points in fresh python processes, using stub
+filebot, beet and php applications on the $PATH, and records the wall
+time and peak RSS of each. The Deluge benchmarks run against a fake
+daemon holding DELUGE_TORRENTS torrents. The extraction benchmarks compare
+in-process extraction with 'filebot -extract', using the stub Filebot, so
+they leave out the JVM start-up a real Filebot adds. Results are written
+as JSON, e.g.: ::
+
+    python -m tests.benchmark --output before.json
+    python -m tests.benchmark --output after.json --compare before.json
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import yaml
+
+import tests.common as common
+
+import mediahandler as mh
+import mediahandler.util.config as Config
+
+# Repository root, added to the $PYTHONPATH of each run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stub Filebot which reports each file as copied into the --format folder
+STUB_FILEBOT = '''import sys
+import os
+args = sys.argv[1:]
+if '-version' in args:
+    print('FileBot 4.9.6 (benchmark stub)')
+    sys.exit(0)
+if args[0] == '-extract':
+    import zipfile
+    dst = os.path.splitext(args[1])[0]
+    with zipfile.ZipFile(args[1]) as archive:
+        archive.extractall(dst)
+    print('extract to [{0}]'.format(dst))
+    sys.exit(0)
+files = []
+options = {}
+i = 1
+while i < len(args):
+    if args[i].startswith('-'):
+        if args[i].startswith('--'):
+            options[args[i]] = args[i + 1]
+            i += 1
+    else:
+        files.append(args[i])
+    i += 1
+dst = options['--format'].split('{')[0].rstrip(os.sep)
+for name in files:
+    if options['--db'] == 'thetvdb':
+        new = os.path.join(dst, 'Bench Show', 'Season 1',
+                           'Bench.Show.S01E01.mkv')
+    else:
+        new = os.path.join(dst, 'Bench Movie (2020).mkv')
+    print('[COPY] From [{0}] to [{1}]'.format(os.path.abspath(name), new))
+'''
+
+# Stub Beets which reports an album as tagged
+STUB_BEET = '''import sys
+if sys.argv[1:] == ['version']:
+    print('beets version 1.4.9 (benchmark stub)')
+    sys.exit(0)
+print('Tagging:')
+print('    Bench Artist - Bench Album')
+print('URL:')
+print('    https://musicbrainz.org/release/0')
+'''
+
+# Stub PHP
+STUB_PHP = '''print('PHP 7.4.0 (benchmark stub)')
+'''
+
+# Times an operation inside the process, for the in-process benchmarks
+TIMED_SNIPPET = '''
+import sys
+import json
+import time
+{setup}
+times = []
+for _ in range({loops}):
+    start = time.perf_counter()
+    {operation}
+    times.append(time.perf_counter() - start)
+sys.stdout.write('@@MH-BENCH ' + json.dumps(times) + '\\n')
+'''
+
+# Media files created for each media type
+MEDIA = {
+    'TV': 'Bench.Show.S01E01.mkv',
+    'Movies': 'Bench.Movie.2020.mkv',
+    'Music': 'Bench Album',
+}
+
+# Number of operations timed by the in-process benchmarks
+LOOPS = 20
+
+# Archive used by the extraction benchmarks: ARCHIVE_FILES files of
+# ARCHIVE_SIZE bytes each
+ARCHIVE_FILES = 4
+ARCHIVE_SIZE = 2 * 1024 * 1024
+
+# Number of copies of the archive in the folder extracted by the parallel
+# extraction benchmarks
+ARCHIVE_DISCS = 4
+EXTRACT_SETUP = '''import shutil
+import mediahandler.util.extract as Extract
+archive = {0!r}
+filebot = shutil.which('filebot')'''
+
+# Fake Deluge daemon, with DELUGE_TORRENTS torrents and a DELUGE_LATENCY
+# second round trip per call, for the Deluge benchmarks
+DELUGE_TORRENTS = 10000
+DELUGE_LATENCY = 0.001
+DELUGE_SETUP = '''import tests.common as common
+import mediahandler.util.torrent as Torrent
+hashes = ['{{0:040x}}'.format(num) for num in range({0})]
+deluge = common.MHFakeDeluge(hashes, version={1!r}, latency={2})
+deluge.connect()
+client = Torrent.MHDelugeClient({{}}, deluge)
+client.can_batch = client._can_batch()
+batch = hashes[::{0} // 100]
+removed = dict((tor, deluge.torrents[tor]) for tor in batch)'''
+
+
+class MHBenchmark(object):
+    """Sets up a temporary home folder with a config file, stub
+    applications and media files, and runs each benchmark scenario.
+    """
+
+    def __init__(self, runs=5):
+        self.runs = runs
+        self.dir = None
+        self.env = None
+        self.conf = None
+        self.media = {}
+        self.archive = None
+        self.skipped = {
+            'Audiobooks': 'requires the Google Books API',
+        }
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp(prefix='mh-bench-')
+        home = os.path.join(self.dir, 'home')
+        stubs = os.path.join(self.dir, 'bin')
+        os.makedirs(stubs)
+
+        # Stub applications
+        common.make_stub_app('filebot', STUB_FILEBOT, stubs)
+        common.make_stub_app('beet', STUB_BEET, stubs)
+        common.make_stub_app('php', STUB_PHP, stubs)
+
+        # Environment for each run
+        self.env = dict(os.environ)
+        self.env['HOME'] = home
+        self.env['PATH'] = os.pathsep.join([stubs, os.environ['PATH']])
+        self.env['PYTHONPATH'] = ROOT
+
+        # Config file
+        self.conf = os.path.join(
+            home, '.config', 'mediahandler', 'config.yml')
+        os.makedirs(os.path.dirname(self.conf))
+        with open(os.path.join(mh.__mediaextras__, 'config.yml')) as conf_io:
+            conf = yaml.safe_load(conf_io)
+        conf['General']['keep_files'] = True
+        conf['Deluge']['enabled'] = False
+        conf['Notifications']['enabled'] = False
+        conf['Logging']['log_file'] = os.path.join(self.dir, 'bench.log')
+
+        # Beets is needed as a python module too
+        try:
+            Config._find_module('beets', 'util')
+        except ImportError:
+            self.skipped['Music'] = 'requires the beets module'
+
+        # Media files & destination folders
+        for (stype, name) in MEDIA.items():
+            folder = os.path.join(self.dir, 'downloads', stype)
+            os.makedirs(folder)
+            self.media[stype] = os.path.join(folder, name)
+            if stype == 'Music':
+                os.makedirs(self.media[stype])
+                open(os.path.join(self.media[stype], '01.mp3'), 'w').close()
+            else:
+                open(self.media[stype], 'w').close()
+            dst = os.path.join(self.dir, 'media', stype)
+            os.makedirs(dst)
+            conf[stype]['enabled'] = stype not in self.skipped
+            conf[stype]['folder'] = dst
+        conf['Audiobooks']['enabled'] = False
+
+        # Archive for the extraction benchmarks
+        self.archive = os.path.join(self.dir, 'archives', 'Bench.Show.S01.zip')
+        os.makedirs(os.path.dirname(self.archive))
+        with zipfile.ZipFile(
+                self.archive, 'w', zipfile.ZIP_DEFLATED) as zip_io:
+            for num in range(ARCHIVE_FILES):
+                zip_io.writestr('Bench.Show.S01E{0:02d}.mkv'.format(num + 1),
+                                os.urandom(ARCHIVE_SIZE))
+        self.discs = os.path.join(self.dir, 'archives', 'discs')
+        os.makedirs(self.discs)
+        for num in range(ARCHIVE_DISCS):
+            shutil.copy(self.archive, os.path.join(
+                self.discs, 'Bench.Movie.Disc{0}.zip'.format(num + 1)))
+
+        with open(self.conf, 'w') as conf_io:
+            yaml.dump(conf, conf_io, indent=4, default_flow_style=False)
+
+    def cleanup(self):
+        if self.dir is not None:
+            shutil.rmtree(self.dir)
+            self.dir = None
+
+    def get_scenarios(self):
+        """Returns the benchmark scenarios, in the order they are run.
+
+        Each is a tuple of the scenario name and either a python snippet to
+        time as a whole process, or a (setup, operation) tuple to time
+        inside the process.
+        """
+
+        run_main = ('import sys; sys.argv = {0!r}\n'
+                    'import mediahandler.handler as MH\n'
+                    'MH.{1}()\n')
+        add_media = ('import mediahandler.handler as MH\n'
+                     'MH.MHandler({0!r}).add_media({1!r})\n')
+
+        scenarios = [
+            ('get_parser', (
+                'import mediahandler.util.args as Args',
+                'Args.get_parser()')),
+            ('parse_config', (
+                'import mediahandler.util.config as Config',
+                'Config.parse_config({0!r}, use_cache=False)'.format(
+                    self.conf))),
+            ('parse_config_cached', (
+                'import mediahandler.util.config as Config',
+                'Config.parse_config({0!r})'.format(self.conf))),
+        ]
+
+        # Archive extraction, in-process & with Filebot
+        extract = EXTRACT_SETUP.format(self.archive)
+        scenarios.extend([
+            ('extract_native', (
+                extract,
+                'shutil.rmtree(Extract.extract_archive(archive)[0])')),
+            ('extract_filebot', (
+                extract,
+                'shutil.rmtree('
+                'Extract._filebot_extract(filebot, archive)[0])')),
+        ])
+
+        # Several archives in one download, one at a time & in parallel
+        discs = EXTRACT_SETUP.format(self.discs)
+        extract_all = ('[shutil.rmtree(folder) for folder in '
+                       'Extract.extract_archive(archive)]')
+        scenarios.extend([
+            ('extract_folder_serial', (
+                discs + '\nExtract._EXTRACT_WORKERS = 1',
+                extract_all)),
+            ('extract_folder_parallel', (
+                discs,
+                extract_all)),
+        ])
+
+        # Deluge lookups & removals against a large session
+        deluge = DELUGE_SETUP.format(
+            DELUGE_TORRENTS, '2.0.3', DELUGE_LATENCY)
+        deluge_old = DELUGE_SETUP.format(
+            DELUGE_TORRENTS, '1.3.15', DELUGE_LATENCY)
+        restore = 'deluge.torrents.update(removed)'
+        scenarios.extend([
+            ('deluge_find_session_state', (
+                deluge,
+                "hashes[-1] in deluge.call('core.get_session_state')")),
+            ('deluge_find_status', (
+                deluge,
+                "deluge.call('core.get_torrents_status', "
+                "{'id': [hashes[-1]]}, ['hash'])")),
+            ('deluge_remove_100_single', (
+                deluge_old,
+                'client._remove(batch); ' + restore)),
+            ('deluge_remove_100_batch', (
+                deluge,
+                'client._remove(batch); ' + restore)),
+        ])
+
+        for stype in sorted(MEDIA):
+            if stype in self.skipped:
+                continue
+            scenarios.append(('main_{0}'.format(stype.lower()),
+                              run_main.format(
+                                  ['addmedia', self.media[stype]], 'main')))
+            scenarios.append(('add_media_{0}'.format(stype.lower()),
+                              add_media.format(self.conf, self.media[stype])))
+
+        scenarios.append(('deluge', run_main.format(
+            ['addmedia-deluge', common.random_string(40),
+             MEDIA['TV'], os.path.dirname(self.media['TV'])], 'deluge')))
+
+        return scenarios
+
+    def run(self, names=None):
+        """Runs each benchmark scenario and returns the results dict.
+        """
+
+        results = {}
+        for (name, scenario) in self.get_scenarios():
+            if names is not None and name not in names:
+                continue
+            results[name] = self.run_scenario(scenario)
+
+        # Media types which can't be run here
+        for (stype, reason) in self.skipped.items():
+            for name in ['main_', 'add_media_']:
+                name += stype.lower()
+                if names is None or name in names:
+                    results[name] = {'skipped': reason}
+
+        return {
+            'version': mh.__version__,
+            'commit': _get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'runs': self.runs,
+            'results': results,
+        }
+
+    def run_scenario(self, scenario):
+        """Runs a scenario once to warm up, then 'runs' times to measure.
+        """
+
+        # Set up in-process timing
+        timed = isinstance(scenario, tuple)
+        script = scenario
+        if timed:
+            script = TIMED_SNIPPET.format(
+                setup=scenario[0], operation=scenario[1], loops=LOOPS)
+
+        walls = []
+        rss = []
+        ops = []
+        for run in range(self.runs + 1):
+            (wall, peak, output) = self._run_process(script)
+            if run == 0:
+                continue
+            walls.append(wall)
+            if peak is not None:
+                rss.append(peak)
+            if timed:
+                ops.extend(_get_op_times(output))
+
+        result = {
+            'wall_ms': _get_stats(walls),
+            'peak_rss_kb': max(rss) if rss else None,
+        }
+        if timed:
+            result['op_ms'] = _get_stats(ops)
+
+        return result
+
+    def _run_process(self, script):
+        """Runs a python snippet in a new process. Returns its wall time,
+        peak RSS in KB (if available) and output.
+        """
+
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, '-c', script], env=self.env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+        output = proc.stdout.read()
+        proc.stdout.close()
+
+        # Get child usage directly, if possible
+        peak = None
+        if hasattr(os, 'wait4'):
+            (_, status, usage) = os.wait4(proc.pid, 0)
+            proc.returncode = _get_returncode(status)
+            peak = usage.ru_maxrss
+            if sys.platform == 'darwin':
+                peak //= 1024
+        else:
+            proc.wait()
+        wall = time.perf_counter() - start
+
+        if proc.returncode != 0:
+            raise RuntimeError('Benchmark run failed ({0}):\n{1}'.format(
+                proc.returncode, output))
+
+        return wall, peak, output
+
+
+def _get_returncode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _get_op_times(output):
+    for line in output.splitlines():
+        if line.startswith('@@MH-BENCH '):
+            return json.loads(line[len('@@MH-BENCH '):])
+    return []
+
+
+def _get_stats(times):
+    times = sorted(times)
+    return {
+        'min': round(times[0] * 1000, 3),
+        'median': round(times[len(times) // 2] * 1000, 3),
+        'max': round(times[-1] * 1000, 3),
+    }
+
+
+def _get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Returns the change in median wall time and peak RSS for each
+    scenario in both results dicts, as text lines.
+    """
+
+    lines = []
+    for name in sorted(new['results']):
+        before = old['results'].get(name, {})
+        after = new['results'][name]
+        if 'wall_ms' not in before or 'wall_ms' not in after:
+            continue
+        old_ms = before['wall_ms']['median']
+        new_ms = after['wall_ms']['median']
+        change = (new_ms - old_ms) / old_ms * 100 if old_ms else 0
+        line = '{0:<22} {1:>9.1f}ms -> {2:>9.1f}ms ({3:+.1f}%)'.format(
+            name, old_ms, new_ms, change)
+        if before.get('peak_rss_kb') and after.get('peak_rss_kb'):
+            line += '  rss {0}KB -> {1}KB'.format(
+                before['peak_rss_kb'], after['peak_rss_kb'])
+        lines.append(line)
+
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the addmedia entry points.')
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help='Measured runs per scenario (default: 5)')
+    parser.add_argument('-o', '--output',
+                        help='Write JSON results to a file')
+    parser.add_argument('-c', '--compare',
+                        help='Compare against a previous JSON results file')
+    parser.add_argument('scenarios', nargs='*',
+                        help='Only run these scenarios')
+    args = parser.parse_args()
+
+    with MHBenchmark(args.runs) as bench:
+        results = bench.run(args.scenarios or None)
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+    if args.compare:
+        with open(args.compare) as compare_file:
+            old = json.load(compare_file)
+        sys.stderr.write('\n'.join(compare(old, results)) + '\n')
+
+
+if __name__ == '__main__':
+    main()
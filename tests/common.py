@@ -17,9 +17,15 @@
 """Common testing functions module"""
 
 import os
+import sys
+import zlib
+import json
+import time
+import stat
 import shutil
 import string
 import tempfile
+import threading
 import warnings
 from random import choice
 
@@ -60,6 +66,104 @@ class MHTestSuite(unittest.TestSuite):
         self.tearDownSuite()
 
 
+class MHFakeDeluge(object):
+    """Stand-in for the Deluge daemon RPC interface, used as a
+    mediahandler.util.torrent transport. Keeps a dict of torrents, counts
+    the compressed size of each response like the RPC protocol sends it,
+    waits 'latency' seconds per call, sends events to subscribers and can
+    be told to drop the connection.
+    """
+
+    def __init__(self, torrents=(), failures=0, version='2.0.3', latency=0):
+        self.torrents = dict(
+            (tor, self._make_torrent(tor, tor)) for tor in torrents)
+        self.handlers = {}
+        self.failures = failures
+        self.version = version
+        self.latency = latency
+        self.connected = False
+        self.connects = 0
+        self.calls = []
+        self.payload = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.connects += 1
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    def call(self, method, *args):
+        with self.lock:
+            if not self.connected:
+                raise IOError('Not connected')
+            if self.failures:
+                self.failures -= 1
+                self.connected = False
+                raise IOError('Connection lost')
+            self.calls.append((method,) + args)
+            handler = getattr(self, '_' + method.replace('.', '_'))
+            result = handler(*args)
+            self.payload += len(zlib.compress(json.dumps(result).encode()))
+        time.sleep(self.latency)
+        return result
+
+    def subscribe(self, event, handler):
+        handlers = self.handlers.setdefault(event, [])
+        if handler not in handlers:
+            handlers.append(handler)
+
+    def finish(self, torrent_id, name, save_path='/downloads'):
+        self.torrents[torrent_id] = self._make_torrent(
+            torrent_id, name, save_path)
+        # Events are lost while disconnected
+        if self.connected:
+            for handler in self.handlers.get('TorrentFinishedEvent', []):
+                handler(torrent_id)
+
+    def disconnect(self):
+        self.connected = False
+
+    @staticmethod
+    def _make_torrent(torrent_id, name, save_path='/downloads'):
+        return {'hash': torrent_id, 'name': name, 'state': 'Seeding',
+                'save_path': save_path, 'progress': 100.0,
+                'is_finished': True}
+
+    def _daemon_info(self):
+        return self.version
+
+    def _core_get_session_state(self):
+        return list(self.torrents)
+
+    def _core_get_torrents_status(self, filter_dict, keys):
+        ids = filter_dict.get('id', list(self.torrents))
+        return dict(
+            (tor, dict((key, self.torrents[tor][key]) for key in keys))
+            for tor in ids if tor in self.torrents)
+
+    def _core_get_torrent_status(self, torrent_id, keys):
+        if torrent_id not in self.torrents:
+            return {}
+        return dict((key, self.torrents[torrent_id][key]) for key in keys)
+
+    def _core_remove_torrent(self, torrent_id, remove_data):
+        if torrent_id not in self.torrents:
+            raise KeyError(torrent_id)
+        del self.torrents[torrent_id]
+        return True
+
+    def _core_remove_torrents(self, torrent_ids, remove_data):
+        if int(self.version.split('.')[0]) < 2:
+            raise AttributeError('remove_torrents')
+        errors = []
+        for tor in torrent_ids:
+            if self.torrents.pop(tor, None) is None:
+                errors.append((tor, 'Torrent not found'))
+        return errors
+
+
 def skipUnlessHasMod(module, submodule):
     try:
         Config._find_module(module, submodule)
@@ -102,6 +206,15 @@ def make_tmp_file(text=None, tdir=None):
     return get_file.name
 
 
+def make_stub_app(name, script, tdir):
+    app_path = os.path.join(tdir, name)
+    with open(app_path, 'w') as app_file:
+        app_file.write('#!{0}\n'.format(sys.executable))
+        app_file.write(script)
+    os.chmod(app_path, os.stat(app_path).st_mode | stat.S_IEXEC)
+    return app_path
+
+
 def get_conf_file():
     return Config.make_config()
 
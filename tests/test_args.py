@@ -96,6 +96,7 @@ class ArgsTests(unittest.TestCase):
             'query': None,
             'stype': 'Audiobooks',
             'type': 4,
+            'torrent_hash': 'hash',
         }
         self.assertEqual(config, self.conf)
         self.assertDictEqual(args, expected)
@@ -136,12 +137,171 @@ class ArgsTests(unittest.TestCase):
         self.assertRaisesRegexp(
             SystemExit, regex2, Args.get_arguments)
 
+    def test_cli_daemon_args(self):
+        sys.argv = ['', '--daemon']
+        (config, args) = Args.get_arguments()
+        self.assertEqual(config, self.conf)
+        self.assertTrue(args['daemon'])
+        self.assertNotIn('media', args.keys())
+
+    def test_cli_deluge_listen_args(self):
+        sys.argv = ['', '--deluge-listen']
+        (config, args) = Args.get_arguments()
+        self.assertEqual(config, self.conf)
+        self.assertTrue(args['deluge_listen'])
+        self.assertNotIn('media', args.keys())
+
+    def test_cli_doctor_args(self):
+        sys.argv = ['', '--doctor']
+        (config, args) = Args.get_arguments()
+        self.assertTrue(args['doctor'])
+        self.assertNotIn('media', args.keys())
+
     def test_cli_bad_args(self):
         sys.argv = ['', '-s']
         regex = r'(too few arguments|the following arguments are required: media)'
         self.assertRaisesRegexp(SystemExit, regex, Args.get_arguments)
 
 
+class SharedParserTests(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = common.get_conf_file()
+        self.folder = os.path.dirname(self.conf)
+        self.tmp_folder = os.path.join(self.folder, 'TV')
+        os.makedirs(self.tmp_folder)
+        self.tmp_file = common.make_tmp_file('.mkv', self.tmp_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def test_parser_cached(self):
+        self.assertIs(Args.get_parser(), Args.get_parser())
+
+    def test_lazy_config_default(self):
+        make_config = Args.Config.make_config
+        Args.Config.make_config = None
+        try:
+            parser = Args._make_parser()
+        finally:
+            Args.Config.make_config = make_config
+        self.assertIsNone(parser.get_default('config'))
+        args = parser.parse_args([self.tmp_file])
+        self.assertEqual(args.config, self.conf)
+
+    def test_add_media_args_no_argparse(self):
+        parser = Args.get_parser()
+        parser.parse_args = None
+        try:
+            args = Args.get_add_media_args(self.tmp_file, nopush=True)
+        finally:
+            del parser.parse_args
+        expected = {
+            'media': self.tmp_file,
+            'name': os.path.basename(self.tmp_file),
+            'no_push': True,
+            'single_track': False,
+            'query': None,
+            'stype': 'TV',
+            'type': 1,
+        }
+        self.assertDictEqual(args, expected)
+
+    def test_add_media_args_match_cli(self):
+        kwargs = {'type': '2', 'query': 'Query', 'single': True,
+                  'config': self.conf}
+        args = Args.get_add_media_args(self.tmp_file, **kwargs)
+        cli_args = Args.get_parser().parse_args([
+            self.tmp_file, '--type', '2', '--query', 'Query', '--single',
+            '--config', self.conf]).__dict__
+        cli_args.pop('config')
+        self.assertDictEqual(args, cli_args)
+
+    def test_add_media_args_bad(self):
+        regex = r'unrecognized arguments: --notreal'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, notreal=True)
+        regex = r'argument -t/--type: invalid choice: 8 \(choose from'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, type=8)
+        regex = r'invalid int value'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, type='tv')
+        regex = r'media does not exist'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file + '.missing')
+        regex = r'config does not exist'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, config='/path/to/fake.yml')
+
+    def test_add_media_args_bad_flag(self):
+        regex = r'unrecognized arguments: yes$'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, single='yes')
+        regex = r'unrecognized arguments: no$'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, nopush='no')
+
+    def test_add_media_args_bad_value(self):
+        regex = r'argument -t/--type: expected one argument'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, type=True)
+        regex = r'argument -q/--query: expected one argument'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, query=True)
+        regex = r"argument -t/--type: invalid int value: '1.5'"
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, type=1.5)
+        regex = r'argument -q/--query: expected one argument'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, query='-x')
+        regex = r'argument -c/--config: expected one argument'
+        self.assertRaisesRegexp(
+            SystemExit, regex, Args.get_add_media_args,
+            self.tmp_file, config='--nopush')
+
+    def test_add_media_args_dash_value(self):
+        args = Args.get_add_media_args(self.tmp_file, query='-5')
+        self.assertEqual(args['query'], '-5')
+        args = Args.get_add_media_args(self.tmp_file, query='- Part 1')
+        self.assertEqual(args['query'], '- Part 1')
+
+    def test_add_media_args_bad_match_cli(self):
+        cases = [
+            ({'notreal': 'value'}, ['--notreal', 'value']),
+            ({'single': 'yes'}, ['--single', 'yes']),
+            ({'type': True}, ['--type']),
+            ({'type': 'tv'}, ['--type', 'tv']),
+            ({'type': 9}, ['--type', '9']),
+            ({'type': -1}, ['--type', '-1']),
+            ({'query': '-x'}, ['--query', '-x']),
+            ({'config': '-c'}, ['--config', '-c']),
+        ]
+        for (kwargs, cli) in cases:
+            errors = []
+            for func in [
+                    lambda: Args.get_add_media_args(self.tmp_file, **kwargs),
+                    lambda: Args.get_parser().parse_args(
+                        [self.tmp_file] + cli)]:
+                try:
+                    func()
+                except SystemExit as err:
+                    errors.append(str(err))
+            self.assertEqual(len(errors), 2)
+            self.assertEqual(errors[0], errors[1])
+
+
 class ParseDirTests(unittest.TestCase):
 
     def setUp(self):
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler Testing Module
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""Initialize module"""
+
+import os
+import json
+
+from tests.common import unittest
+from tests.common import MHTestSuite
+
+import tests.benchmark as Bench
+
+
+@unittest.skipUnless(os.name == 'posix', 'requires a POSIX system')
+class BenchmarkTests(unittest.TestCase):
+
+    def test_run(self):
+        names = ['get_parser', 'parse_config_cached', 'main_tv',
+                 'add_media_movies', 'deluge', 'main_audiobooks']
+        with Bench.MHBenchmark(runs=1) as bench:
+            results = bench.run(names)
+        # Results can be saved as JSON
+        results = json.loads(json.dumps(results))
+        self.assertEqual(results['runs'], 1)
+        self.assertListEqual(sorted(results['results']), sorted(names))
+        for name in names:
+            result = results['results'][name]
+            if name == 'main_audiobooks':
+                self.assertIn('skipped', result)
+                continue
+            self.assertGreater(result['wall_ms']['median'], 0)
+            self.assertGreater(result['peak_rss_kb'], 0)
+        # In-process timings
+        self.assertIn('op_ms', results['results']['get_parser'])
+        self.assertNotIn('op_ms', results['results']['main_tv'])
+
+    def test_failed_run(self):
+        with Bench.MHBenchmark(runs=1) as bench:
+            regex = r'Benchmark run failed'
+            self.assertRaisesRegexp(
+                RuntimeError, regex, bench.run_scenario, 'import notreal')
+
+    def test_compare(self):
+        old = {'results': {
+            'main_tv': {'wall_ms': {'median': 200.0}, 'peak_rss_kb': 100},
+            'main_audiobooks': {'skipped': 'reason'},
+        }}
+        new = {'results': {
+            'main_tv': {'wall_ms': {'median': 150.0}, 'peak_rss_kb': 90},
+            'main_audiobooks': {'skipped': 'reason'},
+        }}
+        lines = Bench.compare(old, new)
+        self.assertEqual(len(lines), 1)
+        self.assertRegexpMatches(lines[0], r'^main_tv .*\(-25\.0%\)')
+
+
+def suite():
+    s = MHTestSuite()
+    tests = unittest.TestLoader().loadTestsFromName(__name__)
+    s.addTest(tests)
+    return s
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite', verbosity=2)
@@ -21,6 +21,8 @@ import re
 import sys
 import shutil
 import yaml
+import mock
+from importlib.util import spec_from_file_location, module_from_spec
 
 import tests.common as common
 from tests.common import unittest
@@ -66,6 +68,96 @@ class FindModulesTests(unittest.TestCase):
             ImportError, regex, Config._find_app, settings, app)
 
 
+class AppCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        # Make stub apps in their own folder on the $PATH
+        self.dir = tempfile.mkdtemp()
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = os.pathsep.join([self.dir, self.path])
+        self.exec = 'stub-{0}'.format(common.get_test_id())
+        self.app = {'name': 'Stub', 'exec': self.exec, 'version': ['-v']}
+        self.app_path = common.make_stub_app(
+            self.exec, 'print("Stub 1.0")\n', self.dir)
+        Config._APP_CACHE = None
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        Config._APP_CACHE = None
+        shutil.rmtree(self.dir)
+
+    def test_app_cached(self):
+        settings = {}
+        Config._find_app(settings, self.app)
+        self.assertEqual(settings['stub'], self.app_path)
+        # Found again without searching the $PATH
+        search_path = Config.search_path
+        Config.search_path = None
+        try:
+            Config._find_app(settings, self.app)
+        finally:
+            Config.search_path = search_path
+        self.assertEqual(settings['stub'], self.app_path)
+
+    def test_app_cache_saved(self):
+        Config._find_app({}, self.app)
+        Config._APP_CACHE = None
+        cache = Config._load_app_cache()
+        self.assertEqual(cache['apps'][self.exec]['path'], self.app_path)
+
+    def test_app_missing(self):
+        Config._find_app({}, self.app)
+        os.remove(self.app_path)
+        regex = r'Stub application not found'
+        self.assertRaisesRegexp(
+            ImportError, regex, Config._find_app, {}, self.app)
+        self.assertNotIn(self.exec, Config._load_app_cache()['apps'])
+
+    def test_app_moved(self):
+        Config._find_app({}, self.app)
+        new_dir = tempfile.mkdtemp(dir=self.dir)
+        new_path = os.path.join(new_dir, self.exec)
+        shutil.move(self.app_path, new_path)
+        os.environ['PATH'] = os.pathsep.join([new_dir, os.environ['PATH']])
+        settings = {}
+        Config._find_app(settings, self.app)
+        self.assertEqual(settings['stub'], new_path)
+
+    def test_app_updated(self):
+        found = Config._get_app(self.exec)
+        Config._save_app(self.exec, dict(found, version='Stub 0.9'))
+        os.utime(self.app_path, (found['mtime'] + 10, found['mtime'] + 10))
+        found = Config._get_app(self.exec)
+        self.assertEqual(found['mtime'], os.stat(self.app_path).st_mtime)
+        self.assertIsNone(found['version'])
+
+    def test_app_version(self):
+        version = Config._get_app_version(self.app_path, ['-v'])
+        self.assertEqual(version, 'Stub 1.0')
+        self.assertIsNone(Config._get_app_version(
+            os.path.join(self.dir, 'missing'), ['-v']))
+
+    def test_app_report(self):
+        filebot = common.make_stub_app(
+            'filebot', 'print("FileBot 4.9")\n', self.dir)
+        report = Config.get_app_report()
+        names = [item['name'] for item in report]
+        self.assertEqual(names.count('Filebot'), 1)
+        item = report[names.index('Filebot')]
+        self.assertListEqual(sorted(item['sections']), ['Movies', 'TV'])
+        self.assertEqual(item['path'], filebot)
+        self.assertEqual(item['version'], 'FileBot 4.9')
+        # Version is only checked once
+        get_app_version = Config._get_app_version
+        Config._get_app_version = None
+        try:
+            report = Config.get_app_report()
+        finally:
+            Config._get_app_version = get_app_version
+        self.assertEqual(report[names.index('Filebot')]['version'],
+                         'FileBot 4.9')
+
+
 class CheckModulesTests(unittest.TestCase):
 
     def setUp(self):
@@ -248,6 +340,7 @@ class FileValidationConfigTests(unittest.TestCase):
         self.dir = ''
 
     def tearDown(self):
+        Config.clear_cache(self.new_conf)
         common.remove_file(self.new_conf)
         if os.path.exists(self.tmp_file):
             common.remove_file(self.tmp_file)
@@ -298,6 +391,7 @@ class MissingSectionConfigTest(unittest.TestCase):
         shutil.copy(self.old_conf, self.new_conf)
 
     def tearDown(self):
+        Config.clear_cache(self.new_conf)
         common.remove_file(self.new_conf)
 
     def test_missing_section(self):
@@ -306,13 +400,22 @@ class MissingSectionConfigTest(unittest.TestCase):
         expected = {
             'enabled': False,
             'notify_name': None,
+            'validate_ttl': 86400,
+            'digest_window': 0,
+            'digest_size': 20,
             'pushover': {
                 'api_key': None,
                 'user_key': None,
             },
             'pushbullet': {
                 'token': None,
-            }
+            },
+            'webhook': {
+                'url': None,
+            },
+            'file': {
+                'path': None,
+            },
         }
         self.assertDictEqual(expected, settings['Notifications'])
 
@@ -339,6 +442,7 @@ class MissingOptionConfigTest(unittest.TestCase):
         self.remove_conf_option()
 
     def tearDown(self):
+        Config.clear_cache(self.conf)
         common.remove_file(self.conf)
 
     def test_missing_option(self):
@@ -369,6 +473,7 @@ class MissingOptionSectionConfigTest(unittest.TestCase):
         self.remove_conf_option()
 
     def tearDown(self):
+        Config.clear_cache(self.conf)
         common.remove_file(self.conf)
 
     def test_missing_option(self):
@@ -389,6 +494,151 @@ class MissingOptionSectionConfigTest(unittest.TestCase):
             yaml.dump(conf, conf_file, indent=4, default_flow_style=False)
 
 
+class CacheConfigTests(unittest.TestCase):
+
+    def setUp(self):
+        old_conf = common.get_conf_file()
+        conf_dir = os.path.dirname(old_conf)
+        self.conf = os.path.join(conf_dir, 'temp_CCT.yml')
+        shutil.copy(old_conf, self.conf)
+        self.cache = Config._get_cache_file(self.conf)
+
+    def tearDown(self):
+        Config.clear_cache(self.conf)
+        common.remove_file(self.conf)
+
+    def test_cache_written(self):
+        settings = Config.parse_config(self.conf)
+        self.assertTrue(os.path.exists(self.cache))
+        self.assertDictEqual(Config._read_cache(self.conf), settings)
+
+    def test_cache_used(self):
+        expected = Config.parse_config(self.conf)
+        # Make yaml parsing fail
+        get_yaml = Config._get_yaml
+        Config._get_yaml = None
+        try:
+            settings = Config.parse_config(self.conf)
+        finally:
+            Config._get_yaml = get_yaml
+        self.assertDictEqual(settings, expected)
+
+    def test_cache_no_use(self):
+        Config.parse_config(self.conf, use_cache=False)
+        self.assertFalse(os.path.exists(self.cache))
+
+    def test_cache_config_changed(self):
+        Config.parse_config(self.conf)
+        # Update the config file
+        with open(self.conf) as conf_file:
+            conf = yaml.safe_load(conf_file)
+        conf['Deluge']['host'] = '10.0.0.1'
+        with open(self.conf, 'w') as conf_file:
+            yaml.dump(conf, conf_file, indent=4, default_flow_style=False)
+        self.assertIsNone(Config._read_cache(self.conf))
+        settings = Config.parse_config(self.conf)
+        self.assertEqual(settings['Deluge']['host'], '10.0.0.1')
+
+    def test_cache_missing_app(self):
+        Config.parse_config(self.conf)
+        with open(self.cache, 'rb') as cache_file:
+            cache = Config.pickle.load(cache_file)
+        cache['apps'] = [common.temp_file()]
+        with open(self.cache, 'wb') as cache_file:
+            Config.pickle.dump(cache, cache_file)
+        self.assertIsNone(Config._read_cache(self.conf))
+
+    def test_cache_missing_folder(self):
+        Config.parse_config(self.conf)
+        with open(self.cache, 'rb') as cache_file:
+            cache = Config.pickle.load(cache_file)
+        cache['folders'] = [common.temp_file()]
+        with open(self.cache, 'wb') as cache_file:
+            Config.pickle.dump(cache, cache_file)
+        self.assertIsNone(Config._read_cache(self.conf))
+
+    def test_cache_missing_module(self):
+        Config.parse_config(self.conf)
+        with open(self.cache, 'rb') as cache_file:
+            cache = Config.pickle.load(cache_file)
+        cache['modules'] = [('mh_missing', 'module')]
+        with open(self.cache, 'wb') as cache_file:
+            Config.pickle.dump(cache, cache_file)
+        self.assertIsNone(Config._read_cache(self.conf))
+
+    def test_cache_folders(self):
+        settings = Config.parse_config(self.conf)
+        settings['Logging']['log_file'] = common.temp_file()
+        folders = Config._get_folders(settings)
+        self.assertIn(os.path.dirname(common.temp_file()), folders)
+        self.assertNotIn(None, folders)
+
+    def test_cache_corrupt(self):
+        with open(self.cache, 'w') as cache_file:
+            cache_file.write(common.random_string(20))
+        self.assertIsNone(Config._read_cache(self.conf))
+        self.assertIn('Deluge', Config.parse_config(self.conf))
+
+
+class SchemaConfigTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        module_file = Config.compile_schema(
+            os.path.join(self.dir, '_schema.py'))
+        # Load the compiled module in place of the installed one
+        spec = spec_from_file_location('mediahandler.util._schema',
+                                       module_file)
+        self.module = module_from_spec(spec)
+        spec.loader.exec_module(self.module)
+        self.saved = sys.modules.get('mediahandler.util._schema')
+        sys.modules['mediahandler.util._schema'] = self.module
+        self.schema = self.module.SCHEMA
+
+    def tearDown(self):
+        if self.saved is None:
+            del sys.modules['mediahandler.util._schema']
+        else:
+            sys.modules['mediahandler.util._schema'] = self.saved
+        shutil.rmtree(self.dir)
+
+    def test_compile_schema(self):
+        self.assertListEqual(
+            sorted(self.schema.keys()), sorted(Config.__schemafiles__))
+        for name in Config.__schemafiles__:
+            yaml_file = os.path.join(Config.mh.__mediaextras__, name)
+            self.assertEqual(
+                self.schema[name]['data'], Config._get_yaml(yaml_file))
+
+    def test_get_schema(self):
+        schema = Config._get_schema('settings.yml')
+        self.assertIs(schema, self.schema['settings.yml']['data'])
+
+    def test_get_schema_out_of_date(self):
+        compiled = self.schema['require.yml']
+        digest = compiled['digest']
+        compiled['digest'] = common.random_string(40)
+        try:
+            schema = Config._get_schema('require.yml')
+        finally:
+            compiled['digest'] = digest
+        self.assertIsNot(schema, compiled['data'])
+        self.assertEqual(schema, compiled['data'])
+
+    def test_schema_skips_yaml(self):
+        with mock.patch('yaml.load') as mock_load:
+            for name in Config.__schemafiles__:
+                schema = Config._get_schema(name)
+                self.assertIs(schema, self.schema[name]['data'])
+        mock_load.assert_not_called()
+
+    def test_yaml_loader(self):
+        if getattr(yaml, '__with_libyaml__', False):
+            self.assertIs(Config._YAML_LOADER, yaml.CSafeLoader)
+        else:
+            self.assertIs(Config._YAML_LOADER, yaml.SafeLoader)
+
+
 class MakeConfigTests(unittest.TestCase):
 
     def setUp(self):
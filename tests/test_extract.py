@@ -16,11 +16,17 @@
 # included in all copies or substantial portions of the Software.
 """Initialize module"""
 
+import io
 import os
+import time
 import shutil
+import tarfile
+import threading
 import zipfile as zf
 import contextlib
 
+import mock
+
 import tests.common as common
 from tests.common import unittest
 from tests.common import tempfile
@@ -130,30 +136,324 @@ class ExtractGoodZipTests(unittest.TestCase):
 
     def test_good_extract(self):
         files = Extract.get_files(self.filebot, self.zip_name)
-        self.assertEqual(files, self.folder)
-        self.assertTrue(os.path.exists(files))
+        self.assertEqual(files, [self.folder])
+        self.assertTrue(os.path.exists(self.folder))
 
     def test_good_handler_zip_tv(self):
         # Run handler
         files = self.handler.extract_files(self.zip_name)
-        self.assertEqual(files, self.folder)
-        self.assertTrue(os.path.exists(files))
-        self.assertEqual(self.handler.extracted, self.zip_name)
+        self.assertEqual(files, [self.folder])
+        self.assertTrue(os.path.exists(self.folder))
+        self.assertEqual(self.handler.extracted, [self.folder])
 
     def test_good_handler_zip_movies(self):
         delattr(self.handler.tv, 'filebot')
         # Run handler
         files = self.handler.extract_files(self.zip_name)
-        self.assertEqual(files, self.folder)
-        self.assertTrue(os.path.exists(files))
-        self.assertEqual(self.handler.extracted, self.zip_name)
+        self.assertEqual(files, [self.folder])
+        self.assertTrue(os.path.exists(self.folder))
+        self.assertEqual(self.handler.extracted, [self.folder])
 
     def test_good_handler_zip_found(self):
+        self.assertEqual(self.handler._find_zipped(self.zip_name),
+                         [self.folder])
         # Run handler
         regex = r'Folder for TV not found: .*TV'
         self.assertRaisesRegexp(
             SystemExit, regex,
-            self.handler._find_zipped, self.zip_name)
+            self.handler._file_handler, self.zip_name)
+
+
+# Stand-in for 'filebot -extract' which reports an extraction folder
+STUB_FILEBOT = '''import sys
+print('Extract archive [{0}]'.format(sys.argv[2]))
+print('extract to [/tmp/filebot-extracted]')
+print('extract to [/tmp/filebot-extras]')
+'''
+
+
+class NativeExtractTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_zip(self, name, entries):
+        archive = os.path.join(self.dir, name)
+        with zf.ZipFile(archive, 'w') as zip_file:
+            for (entry, data) in entries:
+                zip_file.writestr(entry, data)
+        return archive
+
+    def make_tar(self, name, entries, mode='w:gz'):
+        archive = os.path.join(self.dir, name)
+        with tarfile.open(archive, mode) as tar_file:
+            for (entry, data) in entries:
+                info = tarfile.TarInfo(entry)
+                if data is None:
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = '/etc/passwd'
+                    tar_file.addfile(info)
+                    continue
+                info.size = len(data)
+                tar_file.addfile(info, io.BytesIO(data))
+        return archive
+
+    def test_zip(self):
+        archive = self.make_zip('Show.S01.zip', [
+            ('Show.S01E01.mkv', b'one'),
+            ('Extras/Show.S01E01.srt', b'subs'),
+        ])
+        (output,) = Extract.get_files(None, archive)
+        self.assertEqual(output, os.path.join(self.dir, 'Show.S01'))
+        with open(os.path.join(output, 'Extras', 'Show.S01E01.srt')) as subs:
+            self.assertEqual(subs.read(), 'subs')
+        self.assertEqual(sorted(os.listdir(output)),
+                         ['Extras', 'Show.S01E01.mkv'])
+
+    def test_tar(self):
+        archive = self.make_tar('Movie.2020.tar.gz', [
+            ('Movie.2020/Movie.2020.mkv', b'movie'),
+            ('Movie.2020/link', None),
+        ])
+        (output,) = Extract.get_files(None, archive)
+        self.assertEqual(output, os.path.join(self.dir, 'Movie.2020'))
+        # Links are skipped
+        self.assertEqual(os.listdir(os.path.join(output, 'Movie.2020')),
+                         ['Movie.2020.mkv'])
+
+    def test_folder(self):
+        self.make_zip('b.zip', [('two.mkv', b'two')])
+        self.make_zip('a.zip', [('one.mkv', b'one')])
+        output = Extract.get_files(None, self.dir)
+        self.assertEqual(output, [os.path.join(self.dir, 'a'),
+                                  os.path.join(self.dir, 'b')])
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'b', 'two.mkv')))
+
+    def test_unsafe_paths(self):
+        for entry in ['../evil.mkv', '/tmp/evil.mkv', 'ok/../../evil.mkv']:
+            archive = self.make_zip('evil.zip', [(entry, b'evil')])
+            self.assertIsNone(Extract.get_files(None, archive))
+            self.assertFalse(os.path.exists(
+                os.path.join(self.dir, 'evil.mkv')))
+        archive = self.make_tar('evil.tar', [('../evil.mkv', b'evil')], 'w')
+        self.assertIsNone(Extract.get_files(None, archive))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'evil.mkv')))
+
+    def test_bounded_buffer(self):
+        reads = []
+
+        class Source(io.BytesIO):
+            def read(self, size=-1):
+                reads.append(size)
+                return super(Source, self).read(size)
+
+        target = os.path.join(self.dir, 'out', 'file.mkv')
+        with mock.patch.object(Extract, '_BUFFER_SIZE', 1024):
+            Extract._write_file(Source(b'x' * 5000), target)
+        self.assertEqual(os.path.getsize(target), 5000)
+        self.assertTrue(reads)
+        self.assertTrue(all(0 < size <= 1024 for size in reads))
+        self.assertFalse(os.path.exists(target + '.part'))
+
+    def test_filebot_fallback(self):
+        archive = os.path.join(self.dir, 'Show.S01.rar')
+        open(archive, 'w').close()
+        filebot = common.make_stub_app('filebot', STUB_FILEBOT, self.dir)
+        with mock.patch.object(Extract, '_get_extractor', return_value=None):
+            self.assertFalse(Extract.can_extract(archive))
+            self.assertIsNone(Extract.get_files(None, archive))
+            self.assertEqual(Extract.get_files(filebot, archive),
+                             ['/tmp/filebot-extracted', '/tmp/filebot-extras'])
+
+    def test_filebot_fallback_error(self):
+        archive = os.path.join(self.dir, 'Show.S01.zip')
+        with open(archive, 'wb') as zip_file:
+            zip_file.write(b'PK\x03\x04' + b'x' * 100)
+        filebot = common.make_stub_app('filebot', STUB_FILEBOT, self.dir)
+        self.assertIsNone(Extract.get_files(None, archive))
+        # Filebot is tried when in-process extraction fails
+        with mock.patch.object(Extract, 'logging') as log:
+            self.assertEqual(Extract.get_files(filebot, archive),
+                             ['/tmp/filebot-extracted', '/tmp/filebot-extras'])
+        self.assertTrue(log.warning.called)
+
+    def test_can_extract(self):
+        archive = self.make_zip('Show.S01.zip', [('one.mkv', b'one')])
+        self.assertTrue(Extract.can_extract(archive))
+        self.assertTrue(Extract.can_extract(self.dir))
+        self.assertFalse(Extract.can_extract(os.path.join(self.dir, 'x.mkv')))
+        # Only if every archive in a folder can be extracted
+        open(os.path.join(self.dir, 'Show.S02.rar'), 'w').close()
+        with mock.patch.object(Extract, '_find_tool', return_value=None), \
+                mock.patch.object(Extract, '_has_module', return_value=False):
+            self.assertFalse(Extract.can_extract(self.dir))
+
+
+class FindArchivesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_file(self, name, data=b''):
+        file_name = os.path.join(self.dir, name)
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        with open(file_name, 'wb') as file_io:
+            file_io.write(data)
+        return file_name
+
+    def get_volumes(self, archives):
+        return [[os.path.relpath(volume, self.dir)
+                 for volume in archive.volumes] for archive in archives]
+
+    def test_multi_volume(self):
+        for name in ['Show.part02.rar', 'Show.part01.rar', 'Show.part10.rar',
+                     'Movie.r01', 'Movie.rar', 'Movie.r00',
+                     'Extras.7z.002', 'Extras.7z.001',
+                     'Docs.z01', 'Docs.zip', 'Other.zip']:
+            self.make_file(name)
+        archives = Extract.find_archives(self.dir)
+        self.assertEqual(self.get_volumes(archives), [
+            ['Docs.zip', 'Docs.z01'],
+            ['Extras.7z.001', 'Extras.7z.002'],
+            ['Movie.rar', 'Movie.r00', 'Movie.r01'],
+            ['Other.zip'],
+            ['Show.part01.rar', 'Show.part02.rar', 'Show.part10.rar'],
+        ])
+        self.assertEqual([archive.split for archive in archives],
+                         [True, True, False, False, False])
+        self.assertEqual(archives[4].output, os.path.join(self.dir, 'Show'))
+        # A single volume finds the rest of its archive
+        archives = Extract.find_archives(
+            os.path.join(self.dir, 'Show.part02.rar'))
+        self.assertEqual(self.get_volumes(archives), [
+            ['Show.part01.rar', 'Show.part02.rar', 'Show.part10.rar']])
+
+    def test_nested_folders(self):
+        self.make_file(os.path.join('CD1', 'Movie.CD1.rar'))
+        self.make_file(os.path.join('CD2', 'Sub', 'Movie.CD2.zip'))
+        self.make_file(os.path.join('CD2', 'Movie.CD2.mkv'))
+        archives = Extract.find_archives(self.dir)
+        self.assertEqual(self.get_volumes(archives), [
+            [os.path.join('CD1', 'Movie.CD1.rar')],
+            [os.path.join('CD2', 'Sub', 'Movie.CD2.zip')],
+        ])
+        self.assertEqual(archives[1].output,
+                         os.path.join(self.dir, 'CD2', 'Sub', 'Movie.CD2'))
+
+    def test_not_archives(self):
+        for name in ['zipper.mkv', 'Show.zip.nfo', 'rar.srt', 'Show.7zip']:
+            self.make_file(name)
+        self.assertEqual(Extract.find_archives(self.dir), [])
+        self.assertEqual(Extract.find_archives(
+            os.path.join(self.dir, 'zipper.mkv')), [])
+
+    def test_magic_bytes(self):
+        archive = os.path.join(self.dir, 'Show.S01.rar')
+        with zf.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('Show.S01E01.mkv', b'one')
+        self.make_file('Movie.7z', b'Rar!\x1a\x07\x01\x00')
+        self.make_file('Extras.zip', b'not a zip')
+        archives = Extract.find_archives(self.dir)
+        self.assertEqual([archive.format for archive in archives],
+                         ['zip', 'rar', 'zip'])
+        # Extracted with zipfile, whatever the extension
+        self.assertEqual(Extract._get_extractor(archives[2]),
+                         Extract._extract_zip)
+
+    def test_extract_all(self):
+        for name in ['a.zip', os.path.join('Sub', 'b.zip')]:
+            with zf.ZipFile(self.make_file(name), 'w') as zip_file:
+                zip_file.writestr('one.mkv', b'one')
+        output = Extract.get_files(None, self.dir)
+        self.assertEqual(output, [os.path.join(self.dir, 'Sub', 'b'),
+                                  os.path.join(self.dir, 'a')])
+        for folder in output:
+            self.assertTrue(os.path.exists(os.path.join(folder, 'one.mkv')))
+
+    def test_split_needs_7z(self):
+        self.make_file('Extras.7z.001', b'7z\xbc\xaf\x27\x1c')
+        (archive,) = Extract.find_archives(self.dir)
+        with mock.patch.object(Extract, '_find_tool', return_value=None):
+            self.assertIsNone(Extract._get_extractor(archive))
+        with mock.patch.object(Extract, '_find_tool', return_value='7z'):
+            self.assertEqual(Extract._get_extractor(archive),
+                             Extract._extract_7z)
+
+
+class ParallelExtractTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.names = ['Disc{0}'.format(num) for num in range(1, 5)]
+        for name in self.names:
+            with zf.ZipFile(os.path.join(self.dir, name + '.zip'),
+                            'w') as zip_file:
+                zip_file.writestr('movie.m2ts', b'x' * 1000)
+        # Track how many archives are extracted at once
+        self.running = 0
+        self.most = 0
+        self.lock = threading.Lock()
+        self.extract_zip = Extract._extract_zip
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def slow_extract(self, archive, output):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        time.sleep(0.1)
+        self.extract_zip(archive, output)
+        with self.lock:
+            self.running -= 1
+
+    def run_extract(self, workers, writers):
+        with mock.patch.object(Extract, '_extract_zip', self.slow_extract), \
+                mock.patch.object(Extract, '_EXTRACT_WORKERS', workers), \
+                mock.patch.object(Extract, '_DISK_WRITERS', writers):
+            return Extract.extract_archive(self.dir)
+
+    def test_parallel(self):
+        output = self.run_extract(4, 4)
+        self.assertEqual(output, [os.path.join(self.dir, name)
+                                  for name in self.names])
+        self.assertEqual(self.most, 4)
+        for folder in output:
+            self.assertTrue(os.path.exists(
+                os.path.join(folder, 'movie.m2ts')))
+
+    def test_disk_writers(self):
+        # Every archive is on the same filesystem
+        self.run_extract(4, 2)
+        self.assertEqual(self.most, 2)
+
+    def test_serial(self):
+        self.run_extract(1, 2)
+        self.assertEqual(self.most, 1)
+
+    def test_stats(self):
+        archives = Extract.find_archives(self.dir)
+        Extract._extract_all(
+            [(archive, Extract._extract_zip) for archive in archives])
+        for archive in archives:
+            self.assertEqual(archive.size, 1000)
+            self.assertGreaterEqual(archive.time, 0)
+            self.assertIsNone(archive.error)
+
+    def test_failure(self):
+        with open(os.path.join(self.dir, 'Disc2.zip'), 'w') as bad_zip:
+            bad_zip.write('not a zip')
+        self.assertIsNone(self.run_extract(4, 4))
+        # The other archives are still extracted
+        self.assertTrue(os.path.exists(
+            os.path.join(self.dir, 'Disc3', 'movie.m2ts')))
 
 
 def suite():
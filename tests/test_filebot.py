@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler Testing Module
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""Initialize module"""
+
+import os
+import shutil
+
+import mock
+
+import tests.common as common
+from tests.common import unittest
+from tests.common import tempfile
+from tests.common import MHTestSuite
+
+import mediahandler.types as Types
+import mediahandler.util.filebot as Filebot
+
+# Stand-in for 'filebot -script server.groovy' which speaks the same
+# protocol and reports each file as copied
+STUB_SERVER = '''import sys
+import json
+import time
+print('@@MH-READY')
+sys.stdout.flush()
+for line in sys.stdin:
+    request = json.loads(line)
+    if request['paths'][0].endswith('die'):
+        sys.exit(1)
+    if request['paths'][0].endswith('hang'):
+        time.sleep(60)
+    print('[COPY] From [{0}] to [/media/{1}]'.format(
+        request['paths'][0], request['id']))
+    print('@@MH-DONE {0}'.format(request['id']))
+    sys.stdout.flush()
+'''
+
+
+class FilebotServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filebot = common.make_stub_app('filebot', STUB_SERVER, self.dir)
+        self.server = Filebot.MHFilebotServer(self.filebot)
+
+    def tearDown(self):
+        self.server.close()
+        Filebot.stop_server()
+        shutil.rmtree(self.dir)
+
+    def test_query(self):
+        self.assertTrue(self.server.start())
+        pid = self.server.process.pid
+        # Run several queries on the same process
+        for num in range(1, 4):
+            cmd = [self.filebot, '-rename', '/tmp/file{0}.mkv'.format(num)]
+            expected = '[COPY] From [/tmp/file{0}.mkv] to [/media/{0}]\n'
+            self.assertEqual(self.server.query(cmd), expected.format(num))
+        self.assertEqual(self.server.process.pid, pid)
+
+    def test_query_unsupported(self):
+        self.assertIsNone(self.server.query(['beet', 'import']))
+        self.assertIsNone(self.server.query([self.filebot, '-extract']))
+        self.assertIsNone(self.server.process)
+
+    def test_query_busy(self):
+        self.assertTrue(self.server.start())
+        self.server._lock.acquire()
+        cmd = [self.filebot, '-rename', '/tmp/file.mkv']
+        self.assertIsNone(self.server.query(cmd))
+        self.server._lock.release()
+        self.assertIsNotNone(self.server.query(cmd))
+
+    def test_restart(self):
+        self.assertTrue(self.server.start())
+        # Server dies during a query
+        self.assertIsNone(self.server.query([self.filebot, '-rename', 'die']))
+        self.assertIsNone(self.server.process)
+        # Next query starts a new server
+        cmd = [self.filebot, '-rename', '/tmp/file.mkv']
+        self.assertIsNotNone(self.server.query(cmd))
+        self.assertTrue(self.server.is_alive())
+
+    def test_not_responding(self):
+        self.assertTrue(self.server.start())
+        process = self.server.process
+        # Server hangs during a query
+        cmd = [self.filebot, '-rename', '/tmp/hang']
+        with mock.patch.object(Filebot, '_READ_TIMEOUT', 0.2):
+            self.assertIsNone(self.server.query(cmd))
+        self.assertIsNone(self.server.process)
+        self.assertIsNotNone(process.poll())
+        # Next query starts a new server
+        cmd = [self.filebot, '-rename', '/tmp/file.mkv']
+        self.assertIsNotNone(self.server.query(cmd))
+
+    def test_start_fails(self):
+        server = Filebot.MHFilebotServer(os.path.join(self.dir, 'missing'))
+        self.assertFalse(server.start())
+        cmd = [server.filebot, '-rename', '/tmp/file.mkv']
+        self.assertIsNone(server.query(cmd))
+        self.assertTrue(server.disabled)
+
+    def test_get_request(self):
+        args = ['-rename', '/tmp/Show.S01', '/tmp/Show.S02E01.mkv',
+                '--db', 'thetvdb', '--format', '/media/{n}',
+                '--action', 'copy', '-r', '-non-strict',
+                '--log', 'all', '--log-file', '/tmp/filebot.log']
+        self.assertEqual(Filebot._get_request(args), {
+            'paths': ['/tmp/Show.S01', '/tmp/Show.S02E01.mkv'],
+            'recursive': True,
+            'options': {
+                'strict': False,
+                'db': 'thetvdb',
+                'format': '/media/{n}',
+                'action': 'copy',
+            },
+            'log_level': 'all',
+            'log_file': '/tmp/filebot.log',
+        })
+        # Defaults
+        request = Filebot._get_request(['-rename', 'Show.S01'])
+        self.assertEqual(request['paths'], [os.path.abspath('Show.S01')])
+        self.assertFalse(request['recursive'])
+        self.assertEqual(request['options'], {'strict': True})
+        self.assertIsNone(request['log_level'])
+        self.assertIsNone(request['log_file'])
+
+    def test_get_request_unsupported(self):
+        self.assertIsNone(Filebot._get_request(
+            ['-rename', '/tmp/file.mkv', '--conflict', 'override']))
+        self.assertIsNone(Filebot._get_request(
+            ['-rename', '/tmp/file.mkv', '--db']))
+        # Unsupported queries don't use the server
+        cmd = [self.filebot, '-rename', '/tmp/file.mkv', '--q', 'Show']
+        self.assertIsNone(self.server.query(cmd))
+        self.assertIsNone(self.server.process)
+
+    def test_query_log_file(self):
+        log_file = os.path.join(self.dir, 'filebot.log')
+        cmd = [self.filebot, '-rename', '/tmp/file.mkv',
+               '--log', 'all', '--log-file', log_file]
+        output = self.server.query(cmd)
+        with open(log_file) as log_io:
+            self.assertEqual(log_io.read(), output)
+
+    def test_run_query(self):
+        cmd = [self.filebot, '-rename', '/tmp/file.mkv']
+        self.assertIsNone(Filebot.run_query(cmd))
+        Filebot.start_server(self.filebot)
+        expected = '[COPY] From [/tmp/file.mkv] to [/media/1]\n'
+        self.assertEqual(Types.MHMediaType._run_query(cmd), expected)
+        Filebot.stop_server()
+        self.assertIsNone(Filebot.run_query(cmd))
+
+
+def suite():
+    s = MHTestSuite()
+    tests = unittest.TestLoader().loadTestsFromName(__name__)
+    s.addTest(tests)
+    return s
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite', verbosity=2)
@@ -19,7 +19,12 @@
 import os
 import re
 import sys
+import yaml
 import shutil
+import zipfile
+import subprocess
+
+import mock
 
 import tests.common as common
 from tests.common import unittest
@@ -27,7 +32,10 @@ from tests.common import tempfile
 from tests.common import MHTestSuite
 
 import mediahandler.handler as MH
+import mediahandler.types as Types
 import mediahandler.util.notify as Notify
+import mediahandler.util.extract as Extract
+import mediahandler.util.torrent as Torrent
 from mediahandler.util.config import _find_app
 
 
@@ -67,6 +75,55 @@ class NewHandlerTests(unittest.TestCase):
         self.assertFalse(new_handler.single_file)
 
 
+class LazyImportTests(unittest.TestCase):
+
+    def setUp(self):
+        # Make a TV-only config
+        self.dir = tempfile.mkdtemp()
+        self.conf = os.path.join(self.dir, 'config.yml')
+        with open(common.get_conf_file()) as conf_file:
+            conf = yaml.safe_load(conf_file)
+        for section in ['Deluge', 'Notifications', 'Music', 'Audiobooks']:
+            conf[section]['enabled'] = False
+        conf['TV']['enabled'] = True
+        conf['Logging']['enabled'] = False
+        with open(self.conf, 'w') as conf_file:
+            yaml.dump(conf, conf_file, default_flow_style=False)
+        # Make a stub filebot
+        common.make_stub_app('filebot', '', self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get_imports(self, script):
+        env = dict(os.environ)
+        env['PATH'] = os.pathsep.join([self.dir, env['PATH']])
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(MH.__file__))
+        proc = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, env=env)
+        (_, output) = proc.communicate()
+        self.assertEqual(proc.returncode, 0, output)
+        imports = {}
+        for line in output.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            (_, cumulative, name) = line.split('|')
+            imports[name.strip()] = int(cumulative)
+        return imports
+
+    @unittest.skipUnless(
+        sys.version_info >= (3, 7), "-X importtime requires python 3.7")
+    def test_tv_only_imports(self):
+        script = 'import mediahandler.handler as MH; MH.MHandler({0!r})'
+        imports = self.get_imports(script.format(self.conf))
+        self.assertIn('mediahandler.handler', imports)
+        for module in ['googleapiclient', 'mutagen', 'requests', 'twisted',
+                       'deluge', 'mediahandler.types.audiobooks']:
+            self.assertNotIn(module, imports)
+
+
 class HandlerTestClass(unittest.TestCase):
 
     def setUp(self):
@@ -146,7 +203,7 @@ class RemoveFileTests(HandlerTestClass):
     def test_remove_extracted(self):
         self.tmp_file = common.make_tmp_file()
         # Adjust handler settings
-        self.handler.extracted = self.dir
+        self.handler.extracted = [self.dir]
         self.handler.single_file = True
         self.handler.general.keep_files = False
         # Run handler
@@ -228,6 +285,126 @@ class FileHandlerTests(HandlerTestClass):
             SystemExit, regex, self.handler._file_handler, self.dir)
 
 
+# Stand-in for 'filebot -rename' which reports every video file in the
+# folders it is given as copied
+STUB_RENAME = '''import os
+import sys
+args = sys.argv[1:]
+action = args[args.index('--action') + 1].upper()
+dst = args[args.index('--format') + 1].split('{')[0].rstrip(os.sep)
+for arg in args[1:args.index('--db')]:
+    found = os.walk(arg)
+    if os.path.isfile(arg):
+        found = [(os.path.dirname(arg), [], [os.path.basename(arg)])]
+    for (root, _, names) in found:
+        for name in sorted(names):
+            if name.endswith('.mkv'):
+                print('[{0}] From [{1}] to [{2}]'.format(
+                    action, os.path.join(root, name),
+                    os.path.join(dst, 'Show', 'Season 1', name)))
+'''
+
+
+class ArchiveFlowTests(HandlerTestClass):
+
+    def setUp(self):
+        super(ArchiveFlowTests, self).setUp()
+        self.handler.tv.filebot = common.make_stub_app(
+            'filebot', STUB_RENAME, self.dir)
+        self.handler.tv.folder = self.dir
+        self.handler.general.keep_files = False
+        # Download with an archive and a loose video
+        self.download = os.path.join(self.dir, 'Show.S01')
+        os.makedirs(self.download)
+        archive = os.path.join(self.download, 'Show.S01.zip')
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('Show.S01E01.mkv', b'one')
+        open(os.path.join(self.download, 'Show.S01E02.mkv'), 'w').close()
+
+    def test_single_pass(self):
+        popen = mock.Mock(wraps=subprocess.Popen)
+        with mock.patch.object(Types, 'Popen', popen), \
+                mock.patch.object(Extract, 'Popen', popen):
+            added = self.handler._file_handler(self.download)
+        # Filebot is only run once, on the whole download
+        self.assertEqual(popen.call_count, 1)
+        cmd = popen.call_args[0][0]
+        self.assertEqual(cmd[1:3], ['-rename', self.download])
+        self.assertIn('Show (Season 1, Episode 1)', added)
+        self.assertIn('Show (Season 1, Episode 2)', added)
+        self.assertFalse(os.path.exists(self.download))
+
+    def test_single_archive(self):
+        archive = os.path.join(self.download, 'Show.S01.zip')
+        popen = mock.Mock(wraps=subprocess.Popen)
+        with mock.patch.object(Types, 'Popen', popen), \
+                mock.patch.object(Extract, 'Popen', popen):
+            added = self.handler._file_handler(archive)
+        self.assertEqual(popen.call_count, 1)
+        cmd = popen.call_args[0][0]
+        self.assertEqual(cmd[2], os.path.join(self.download, 'Show.S01'))
+        self.assertIn('Show (Season 1, Episode 1)', added)
+        self.assertNotIn('Episode 2', added)
+        # Archive and extracted files are removed
+        self.assertEqual(os.listdir(self.download), ['Show.S01E02.mkv'])
+
+
+    def test_outside_outputs(self):
+        archive = os.path.join(self.download, 'Show.S01.zip')
+        # Files extracted to several folders outside the download
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        extracted = []
+        for num in [1, 3]:
+            folder = os.path.join(outside, 'part{0}'.format(num))
+            os.makedirs(folder)
+            open(os.path.join(
+                folder, 'Show.S01E0{0}.mkv'.format(num)), 'w').close()
+            extracted.append(folder)
+        with mock.patch.object(Extract, 'get_files', return_value=extracted):
+            added = self.handler._file_handler(archive)
+        # Every folder is added, then removed
+        self.assertEqual(self.handler.extracted, extracted)
+        self.assertIn('Show (Season 1, Episode 1)', added)
+        self.assertIn('Show (Season 1, Episode 3)', added)
+        self.assertEqual(os.listdir(outside), [])
+
+    def test_single_scan(self):
+        self.handler.tv.ignore_subs = True
+        subs = os.path.join(self.download, 'Subs', 'English')
+        os.makedirs(subs)
+        open(os.path.join(subs, 'Show.S01E02.srt'), 'w').close()
+        scandir = mock.Mock(wraps=os.scandir)
+        listdir = mock.Mock(wraps=os.listdir)
+        with mock.patch('os.scandir', scandir), \
+                mock.patch('os.listdir', listdir):
+            added = self.handler._file_handler(self.download)
+        self.assertIn('Show (Season 1, Episode 1)', added)
+        # Each folder is read once, plus the extracted folder
+        folders = [call[0][0] for call in scandir.call_args_list]
+        self.assertEqual(len(folders), 4)
+        self.assertEqual(len(set(folders)), 4)
+        self.assertEqual(listdir.call_count, 0)
+        self.assertFalse(os.path.exists(self.download))
+
+    def test_filter_files(self):
+        self.handler.tv.ignore_subs = True
+        self.handler.tv.filter_files = True
+        subs = os.path.join(self.download, 'Show.S01E02.srt')
+        open(subs, 'w').close()
+        popen = mock.Mock(wraps=subprocess.Popen)
+        with mock.patch.object(Types, 'Popen', popen):
+            added = self.handler._file_handler(self.download)
+        # Only the video files are sent to Filebot
+        cmd = popen.call_args[0][0]
+        self.assertEqual(cmd[2:cmd.index('--db')], [
+            os.path.join(self.download, 'Show.S01', 'Show.S01E01.mkv'),
+            os.path.join(self.download, 'Show.S01E02.mkv'),
+        ])
+        self.assertIn('Show (Season 1, Episode 1)', added)
+        self.assertIn('Show (Season 1, Episode 2)', added)
+
+
 class CheckSuccessTests(HandlerTestClass):
 
     def test_results_none(self):
@@ -262,9 +439,70 @@ class CheckSuccessTests(HandlerTestClass):
         self.assertTrue(os.path.exists(self.dir))
 
 
+class RemoveTorrentTests(HandlerTestClass):
+
+    def setUp(self):
+        super(RemoveTorrentTests, self).setUp()
+        self.handler.deluge.enabled = True
+        self.handler.torrent_hash = 'hash1'
+        self.transport = common.MHFakeDeluge(['hash1'])
+        patcher = mock.patch.object(
+            Torrent, 'MHDelugeTransport', return_value=self.transport)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(Torrent.stop_client)
+
+    def test_removed_after_success(self):
+        results = ([self.dir], [])
+        self.handler._check_success(self.dir, results)
+        Torrent.stop_client(5)
+        self.assertEqual(self.transport.torrents, {})
+
+    def test_kept_on_failure(self):
+        results = ([], [])
+        self.assertRaises(
+            SystemExit, self.handler._check_success, self.dir, results)
+        Torrent.stop_client(5)
+        self.assertEqual(self.transport.connects, 0)
+        self.assertIn('hash1', self.transport.torrents)
+
+    def test_skips(self):
+        results = ([], [self.dir])
+        self.handler._check_success(self.dir, results)
+        Torrent.stop_client(5)
+        self.assertIn('hash1', self.transport.torrents)
+        # Remove anyway
+        self.handler.deluge.remove_if_skips = True
+        self.handler._check_success(self.dir, results)
+        Torrent.stop_client(5)
+        self.assertEqual(self.transport.torrents, {})
+
+    def test_disabled(self):
+        self.handler.deluge.enabled = False
+        self.handler._check_success(self.dir, ([self.dir], []))
+        self.assertEqual(self.transport.connects, 0)
+
+    def test_not_deluge(self):
+        self.handler.torrent_hash = None
+        self.handler._check_success(self.dir, ([self.dir], []))
+        self.assertEqual(self.transport.connects, 0)
+
+    def test_async(self):
+        # A slow daemon doesn't hold up the job
+        self.transport.latency = 0.5
+        results = ([self.dir], [])
+        self.handler._check_success(self.dir, results)
+        self.assertIn('hash1', self.transport.torrents)
+        client = Torrent.get_client(self.handler._settings['Deluge'])
+        Torrent.stop_client(5)
+        self.assertEqual(self.transport.torrents, {})
+        # Removal time is kept separately
+        self.assertGreaterEqual(client.latency, 1.0)
+
+
 class FindZippedTests(HandlerTestClass):
 
-    def run_process_folder_test(self, ext, filebot=False):
+    def run_process_folder_test(self, ext, filebot=False, native=False):
         # Set filebot
         if not filebot:
             delattr(self.handler.tv, 'filebot')
@@ -272,13 +510,9 @@ class FindZippedTests(HandlerTestClass):
         # Make a dummy file in dummy folder
         self.tmp_file = common.make_tmp_file(ext, self.dir)
         # Run test
-        regex = r'Filebot required to extract: {0}'.format(self.name)
-        if filebot:
-            regex = r'Unable to extract files: {0}'.format(self.name)
-        self.assertRaisesRegexp(
-            SystemExit, regex, self.handler._find_zipped, self.dir)
+        self.run_find_zipped_test(self.dir, filebot, native)
 
-    def run_single_file_test(self, ext, filebot=False):
+    def run_single_file_test(self, ext, filebot=False, native=False):
         # Set filebot
         if not filebot:
             self.handler.tv.filebot = None
@@ -286,11 +520,20 @@ class FindZippedTests(HandlerTestClass):
         # Make a dummy file
         self.tmp_file = common.make_tmp_file(ext)
         # Run test
+        self.run_find_zipped_test(self.tmp_file, filebot, native)
+
+    def run_find_zipped_test(self, files, filebot, native):
         regex = r'Filebot required to extract: {0}'.format(self.name)
-        if filebot:
+        if filebot or native:
             regex = r'Unable to extract files: {0}'.format(self.name)
-        self.assertRaisesRegexp(
-            SystemExit, regex, self.handler._find_zipped, self.tmp_file)
+        if native:
+            self.assertRaisesRegexp(
+                SystemExit, regex, self.handler._find_zipped, files)
+            return
+        # No in-process extraction available
+        with mock.patch.object(Extract, '_get_extractor', return_value=None):
+            self.assertRaisesRegexp(
+                SystemExit, regex, self.handler._find_zipped, files)
 
     def test_process_folder_zip(self):
         self.run_process_folder_test('.zip')
@@ -304,6 +547,9 @@ class FindZippedTests(HandlerTestClass):
     def test_process_folder_filebot(self):
         self.run_process_folder_test('.zip', True)
 
+    def test_process_folder_native(self):
+        self.run_process_folder_test('.zip', native=True)
+
     def test_single_file_zip(self):
         self.run_single_file_test('.zip')
 
@@ -316,6 +562,9 @@ class FindZippedTests(HandlerTestClass):
     def test_single_file_filebot(self):
         self.run_single_file_test('.zip', True)
 
+    def test_single_file_native(self):
+        self.run_single_file_test('.zip', native=True)
+
 
 class AddMediaTests(HandlerTestClass):
 
@@ -365,6 +614,29 @@ class AddMediaTests(HandlerTestClass):
         self.assertTrue(self.handler.no_push)
 
 
+class AddMediaBatchTests(HandlerTestClass):
+
+    def test_batch_outcomes(self):
+        args = {
+            'media': self.dir,
+            'name': self.name,
+            'type': 1,
+            'stype': 'TV',
+            'single_track': False,
+            'no_push': False,
+            'query': None,
+        }
+        missing = dict(args, media='/path/tv/fake', name='fake')
+        outcomes = self.handler.add_media_batch([args, missing])
+        # Check each download failed on its own
+        self.assertEqual(len(outcomes), 2)
+        self.assertIsInstance(outcomes[0], SystemExit)
+        self.assertRegexpMatches(
+            str(outcomes[0]), r'No TV files found for: {0}'.format(self.name))
+        self.assertRegexpMatches(
+            str(outcomes[1]), r'No media files found: fake')
+
+
 class AddMediaFilesTests(HandlerTestClass):
 
     def setUp(self):
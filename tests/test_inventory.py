@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler Testing Module
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""Initialize module"""
+
+import os
+import shutil
+
+from tests.common import unittest
+from tests.common import tempfile
+from tests.common import MHTestSuite
+
+import mediahandler.util.inventory as Inventory
+
+
+class InventoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = {
+            'Show.S01E01.mkv': 100,
+            os.path.join('Subs', 'Show.S01E01.srt'): 10,
+            os.path.join('Subs', 'Extra', 'Show.S01E01.nfo'): 1,
+        }
+        for (name, size) in self.files.items():
+            self.make_file(name, size)
+        self.inventory = Inventory.MHInventory(self.dir)
+
+    def tearDown(self):
+        if os.path.exists(self.dir):
+            shutil.rmtree(self.dir)
+
+    def make_file(self, name, size=0):
+        file_name = os.path.join(self.dir, name)
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        with open(file_name, 'wb') as file_io:
+            file_io.write(b'x' * size)
+        return file_name
+
+    def test_scan(self):
+        self.assertTrue(self.inventory.is_dir(self.dir))
+        self.assertEqual(sorted(self.inventory.listdir(self.dir)),
+                         ['Show.S01E01.mkv', 'Subs'])
+        self.assertEqual(sorted(
+            os.path.relpath(entry.path, self.dir)
+            for entry in self.inventory.files(self.dir)), sorted(self.files))
+        self.assertEqual(self.inventory.size(self.dir), 111)
+        entry = self.inventory.get(os.path.join(self.dir, 'Show.S01E01.mkv'))
+        self.assertEqual(entry.size, 100)
+        self.assertEqual(entry.mtime, os.path.getmtime(entry.path))
+        self.assertFalse(entry.is_dir)
+
+    def test_walk(self):
+        folder = os.path.join(self.dir, 'Subs')
+        seen = [entry.path for entry in self.inventory.walk(self.dir)]
+        # Folders come before their contents
+        self.assertLess(seen.index(folder),
+                        seen.index(os.path.join(folder, 'Show.S01E01.srt')))
+        self.assertEqual(len(seen), 5)
+
+    def test_single_file(self):
+        file_name = os.path.join(self.dir, 'Show.S01E01.mkv')
+        inventory = Inventory.MHInventory(file_name)
+        self.assertTrue(inventory.is_file(file_name))
+        self.assertEqual(inventory.size(file_name), 100)
+        self.assertEqual([entry.path for entry in inventory.files(file_name)],
+                         [file_name])
+        self.assertFalse(inventory.exists(self.dir))
+
+    def test_links(self):
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        with open(os.path.join(outside, 'secret.mkv'), 'w'):
+            pass
+        link = os.path.join(self.dir, 'Link')
+        os.symlink(outside, link)
+        inventory = Inventory.MHInventory(self.dir)
+        # Links are listed, not followed
+        self.assertTrue(inventory.is_file(link))
+        self.assertEqual(inventory.listdir(link), [])
+        inventory.remove(self.dir)
+        self.assertTrue(os.path.exists(os.path.join(outside, 'secret.mkv')))
+
+    def test_discard(self):
+        folder = os.path.join(self.dir, 'Subs')
+        self.inventory.discard(folder)
+        self.assertFalse(self.inventory.exists(folder))
+        self.assertFalse(self.inventory.exists(
+            os.path.join(folder, 'Show.S01E01.srt')))
+        self.assertEqual(self.inventory.listdir(self.dir), ['Show.S01E01.mkv'])
+        self.assertEqual(self.inventory.size(self.dir), 100)
+        # Read again
+        self.inventory.scan(folder)
+        self.assertEqual(self.inventory.size(self.dir), 111)
+
+    def test_remove(self):
+        self.inventory.remove(self.dir)
+        self.assertFalse(os.path.exists(self.dir))
+        self.assertFalse(self.inventory.exists(self.dir))
+
+    def test_remove_new_files(self):
+        # Files added after the scan are removed too
+        self.make_file(os.path.join('Subs', 'Extra', 'cover.jpg'))
+        os.remove(os.path.join(self.dir, 'Show.S01E01.mkv'))
+        self.inventory.remove(self.dir)
+        self.assertFalse(os.path.exists(self.dir))
+
+
+def suite():
+    s = MHTestSuite()
+    tests = unittest.TestLoader().loadTestsFromName(__name__)
+    s.addTest(tests)
+    return s
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite', verbosity=2)
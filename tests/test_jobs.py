@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler Testing Module
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""Initialize module"""
+
+import os
+import time
+import shutil
+import threading
+
+import tests.common as common
+from tests.common import unittest
+from tests.common import tempfile
+from tests.common import MHTestSuite
+
+import mediahandler as mh
+import mediahandler.handler as MH
+import mediahandler.util.jobs as Jobs
+
+
+class DummyHandler(mh.MHObject):
+    """Stands in for MHandler and records how many jobs run at once.
+    """
+
+    def __init__(self, settings):
+        super(DummyHandler, self).__init__(settings)
+        self.lock = threading.Lock()
+        self.running = {}
+        self.most = {}
+        self.batches = []
+
+    def new_job(self):
+        return self
+
+    def add_media(self, **kwargs):
+        stype = kwargs['stype']
+        with self.lock:
+            self.running[stype] = self.running.get(stype, 0) + 1
+            self.most[stype] = max(
+                self.most.get(stype, 0), self.running[stype])
+        time.sleep(0.1)
+        with self.lock:
+            self.running[stype] -= 1
+        if kwargs['name'].startswith('fail'):
+            self.push.failure('Failed: {0}'.format(kwargs['name']))
+        return kwargs['name']
+
+    def add_media_batch(self, batch):
+        self.batches.append([args['name'] for args in batch])
+        return [args['name'] for args in batch]
+
+
+class JobQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        # Make drop folders
+        self.dir = tempfile.mkdtemp()
+        for stype in ['TV', 'Movies', 'Music']:
+            os.makedirs(os.path.join(self.dir, stype))
+        # Set up handler
+        self.handler = DummyHandler({
+            'TV': {'workers': 2},
+            'Movies': {'workers': 3},
+            'Music': {'workers': 4},
+            'push': MH.Notify.MHPush({'enabled': False}, True),
+        })
+        self.queue = Jobs.MHJobQueue(self.handler)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.dir)
+
+    def make_media(self, stype, name):
+        media = os.path.join(self.dir, stype, name)
+        os.makedirs(media)
+        return media
+
+    def test_per_type_workers(self):
+        jobs = []
+        for stype in ['TV', 'Movies', 'Music']:
+            for num in range(4):
+                media = self.make_media(stype, 'item-{0}'.format(num))
+                jobs.append(self.queue.submit(media))
+        self.queue.join()
+        # Check results
+        for job in jobs:
+            self.assertTrue(job.done())
+            self.assertIsNone(job.error)
+            self.assertEqual(job.result, os.path.basename(job.media))
+        # Check concurrency
+        self.assertEqual(self.handler.most['TV'], 2)
+        self.assertEqual(self.handler.most['Movies'], 3)
+        self.assertEqual(self.handler.most['Music'], 1)
+
+    def test_batch_jobs(self):
+        self.handler.tv.workers = 1
+        self.handler.tv.batch_size = 3
+        # First job blocks the only worker while the others queue up
+        jobs = [self.queue.submit(self.make_media('TV', 'first'))]
+        time.sleep(0.05)
+        for num in range(4):
+            media = self.make_media('TV', 'item-{0}'.format(num))
+            jobs.append(self.queue.submit(media))
+        self.queue.join()
+        # Check results
+        self.assertListEqual(self.handler.batches, [
+            ['item-0', 'item-1', 'item-2'],
+        ])
+        for job in jobs:
+            self.assertEqual(job.result, os.path.basename(job.media))
+
+    def test_failed_job(self):
+        media = self.make_media('TV', 'fail-{0}'.format(common.get_test_id()))
+        job = self.queue.submit(media)
+        self.assertTrue(job.wait(5))
+        self.assertRegexpMatches(job.error, r'Failed: fail-')
+        self.assertIsNone(job.result)
+
+    def test_torrent_job(self):
+        media = self.make_media('TV', 'torrent')
+        job = self.queue.submit(media, torrent_hash='hash1')
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.args['torrent_hash'], 'hash1')
+        self.assertEqual(job.result, 'torrent')
+
+    def test_invalid_job(self):
+        job = self.queue.submit('/path/tv/fake')
+        self.assertTrue(job.done())
+        self.assertRegexpMatches(
+            job.error, r'File or directory provided for media does not exist')
+        self.assertDictEqual(self.queue.queues, {})
+
+
+class HandlerJobTests(unittest.TestCase):
+
+    def test_new_job(self):
+        handler = MH.MHandler(common.get_conf_file())
+        handler.single_file = True
+        handler.torrent_hash = 'hash1'
+        job = handler.new_job()
+        self.assertIsInstance(job, MH.MHandler)
+        self.assertFalse(job.single_file)
+        self.assertIsNone(job.torrent_hash)
+        self.assertIs(job.push, handler.push)
+        self.assertIsNot(job.tv, handler.tv)
+        self.assertEqual(job.tv.workers, handler.tv.workers)
+
+
+def suite():
+    s = MHTestSuite()
+    tests = unittest.TestLoader().loadTestsFromName(__name__)
+    s.addTest(tests)
+    return s
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite', verbosity=2)
@@ -20,6 +20,8 @@ import os
 import shutil
 from re import search, escape
 
+from mock import patch
+
 import tests.common as common
 from tests.common import unittest
 from tests.common import tempfile
@@ -149,6 +151,39 @@ Done ?(?????)?
         self.assertEqual(skipped, expected)
         self.assertEqual(new_file, [])
 
+    def test_split_output(self):
+        fro1 = os.path.join(self.folder, 'Show.1x01.mkv')
+        fro2 = os.path.join(self.folder, '[Group] Show 02')
+        to = os.path.join(os.path.sep, 'Media', 'TV', 'Show', 'Season 1')
+        output = """Rename episodes using [TheTVDB]
+[COPY] From [{fro1}] to [{to}/Show.S01E01.mkv]
+[COPY] From [{fro2}/Show.02.mkv] to [{to}/Show.S01E02.mkv]
+Skipped [{fro2}/Show.03.mkv] because [{to}/Show.S01E03.mkv] already exists
+Processed 3 files
+""".format(fro1=fro1, fro2=fro2, to=to)
+        outputs = self.media._split_output(output, [fro1, fro2, self.tmp_file])
+        self.assertRegexpMatches(
+            outputs[fro1], r'^\[COPY\] From .*E01.mkv\]\n$')
+        self.assertEqual(len(outputs[fro2].splitlines()), 2)
+        self.assertEqual(outputs[self.tmp_file], '\n')
+
+    def test_add_batch(self):
+        fro = common.make_tmp_file('.mkv', self.folder)
+        to = os.path.join(os.path.sep, 'Media', 'TV', 'Show.S01E01')
+        output = '[COPY] From [{0}] to [{1}.mkv]\n'.format(fro, to)
+        with patch.object(self.media, '_run_query',
+                          return_value=output) as query:
+            results = self.media.add_batch([fro, self.tmp_file])
+        # Check that a single query was made with both paths
+        self.assertEqual(query.call_count, 1)
+        cmd = query.call_args[0][0]
+        self.assertListEqual(cmd[1:4], ['-rename', fro, self.tmp_file])
+        # Check results
+        self.assertEqual(results[fro], ([to], []))
+        self.assertIsInstance(results[self.tmp_file], SystemExit)
+        self.assertRegexpMatches(
+            str(results[self.tmp_file]), r'Unable to match mediatype files')
+
     def test_remove_bad_files(self):
         # Add files to folder
         bad_folder = tempfile.mkdtemp(dir=self.folder)
@@ -164,6 +199,47 @@ Done ?(?????)?
         self.assertTrue(os.path.exists(bad_folder))
         self.assertTrue(os.path.exists(self.tmp_file))
 
+    def make_video(self, name, size):
+        file_name = os.path.join(self.folder, name)
+        with open(file_name, 'wb') as video:
+            video.truncate(size)
+        return file_name
+
+    def test_filter_files(self):
+        self.media.ignore_subs = True
+        self.media.filter_files = True
+        self.media.sample_size = 1
+        # Add files to folder
+        extras = tempfile.mkdtemp(dir=self.folder)
+        subs = common.make_tmp_file('.srt', self.folder)
+        nfo = common.make_tmp_file('.nfo', extras)
+        video1 = self.make_video('Show.S01E01.mkv', 2 * 1024 * 1024)
+        video2 = self.make_video(os.path.join(extras, 'Show.S01E02.MP4'),
+                                 2 * 1024 * 1024)
+        sample = self.make_video('sample.mkv', 1024)
+        # Only the videos are sent
+        cmd = self.media._get_command([self.folder, self.tmp_file])
+        self.assertListEqual(cmd[2:cmd.index('--db')],
+                             sorted([video1, video2]) + [self.tmp_file])
+        # Nothing is removed
+        for file_name in [subs, nfo, sample]:
+            self.assertTrue(os.path.exists(file_name))
+
+    def test_filter_files_samples(self):
+        self.media.ignore_subs = True
+        self.media.filter_files = True
+        self.media.sample_size = 1
+        # Small videos are kept if there are no others
+        video = self.make_video('Show.S01E01.mkv', 1024)
+        cmd = self.media._get_command([self.folder])
+        self.assertListEqual(cmd[2:cmd.index('--db')], [video])
+        # Folders without videos are sent as they are
+        os.unlink(video)
+        common.make_tmp_file('.srt', self.folder)
+        self.media.inventory = None
+        cmd = self.media._get_command([self.folder])
+        self.assertListEqual(cmd[2:cmd.index('--db')], [self.folder])
+
 
 def suite():
     s = MHTestSuite()
@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler Testing Module
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""Initialize module"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+import subprocess
+
+try:
+    from socketserver import ThreadingMixIn
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from SocketServer import ThreadingMixIn
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import mock
+import responses
+
+import tests.common as common
+from tests.common import unittest
+from tests.common import tempfile
+from tests.common import MHTestSuite
+
+import mediahandler.notifiers as Notifiers
+import mediahandler.util.notify as Notify
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    """Stand-in webhook server, which handles keep-alive connections in
+    their own threads."""
+
+    daemon_threads = True
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Stand-in webhook receiver which records each request."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.server.requests.append(
+            (self.client_address, json.loads(self.rfile.read(length))))
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class NotifierTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get_notifier(self):
+        settings = common.get_pushover_api()
+        notifier = Notifiers.get_notifier('pushover', settings)
+        self.assertEqual(notifier.name, 'pushover')
+        self.assertEqual(notifier.api_key, settings['api_key'])
+        self.assertTrue(notifier.is_configured())
+        self.assertIsNone(Notifiers.get_notifier('unknown', {}))
+
+    def test_send_required(self):
+        class MHNoSend(Notifiers.MHNotifier):
+            pass
+        self.assertRaises(TypeError, MHNoSend, {})
+
+    def test_not_configured(self):
+        notifier = Notifiers.get_notifier('pushover', {
+            'api_key': common.random_string(10),
+            'user_key': None,
+        })
+        self.assertFalse(notifier.is_configured())
+
+    def test_get_key(self):
+        settings = common.get_pushover_api()
+        key = Notifiers.get_notifier('pushover', settings).get_key()
+        self.assertEqual(
+            Notifiers.get_notifier('pushover', settings).get_key(), key)
+        self.assertNotIn(settings['api_key'], key)
+        settings['user_key'] = common.random_string(10)
+        self.assertNotEqual(
+            Notifiers.get_notifier('pushover', settings).get_key(), key)
+
+    def test_shared_session(self):
+        session = Notifiers.get_session('https://api.example.com/1/a')
+        self.assertIs(
+            Notifiers.get_session('https://api.example.com/2/b'), session)
+        self.assertIsNot(
+            Notifiers.get_session('https://other.example.com/'), session)
+        self.assertIsNot(
+            Notifiers.get_session('http://api.example.com/'), session)
+
+    @responses.activate
+    def test_retry_status(self):
+        responses.add(responses.POST,
+                      'https://api.pushover.net/1/messages.json',
+                      json={},
+                      headers={'X-Limit-App-Reset': '1393653600'},
+                      status=429)
+        notifier = Notifiers.get_notifier(
+            'pushover', common.get_pushover_api())
+        with self.assertRaises(Notifiers.MHRetry) as context:
+            notifier.send('msg', 'title')
+        self.assertEqual(context.exception.retry_time, 1393653600)
+
+    def test_get_retry_time(self):
+        now = time.time()
+        self.assertIsNone(Notifiers._get_retry_time({}))
+        self.assertAlmostEqual(
+            Notifiers._get_retry_time({'Retry-After': '30'}), now + 30, 0)
+        self.assertEqual(
+            Notifiers._get_retry_time({'X-Limit-App-Reset': '1393653600'}),
+            1393653600)
+        self.assertEqual(
+            Notifiers._get_retry_time({'X-Ratelimit-Reset': '1393653600'}),
+            1393653600)
+
+    def test_file(self):
+        sink = os.path.join(self.dir, 'notify.log')
+        notifier = Notifiers.get_notifier('file', {'path': sink})
+        notifier.send('msg 1', 'title 1')
+        notifier.send('msg 2', 'title 2')
+        with open(sink) as sink_file:
+            lines = [json.loads(line) for line in sink_file]
+        self.assertListEqual(
+            [(line['title'], line['message']) for line in lines],
+            [('title 1', 'msg 1'), ('title 2', 'msg 2')])
+
+    def test_webhook(self):
+        server = WebhookServer(('127.0.0.1', 0), WebhookHandler)
+        server.requests = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{0}/hook'.format(server.server_port)
+        # Send from two notifiers for the same host
+        for num in range(2):
+            notifier = Notifiers.get_notifier('webhook', {'url': url})
+            self.assertEqual(notifier.send('msg', 'title'), 204)
+        self.assertListEqual(
+            [body for (_, body) in server.requests],
+            [{'title': 'title', 'message': 'msg'}] * 2)
+        # The connection was kept alive and reused
+        (first, second) = [client for (client, _) in server.requests]
+        self.assertEqual(first, second)
+
+
+class PushNotifierTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sink = os.path.join(self.dir, 'notify.log')
+        patcher = mock.patch.object(Notify, '_SENDER', Notify.MHSender(
+            os.path.join(self.dir, 'outbox')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_push_file(self):
+        push = Notify.MHPush({
+            'enabled': True,
+            'notify_name': 'Test',
+            'pushover': {'api_key': None, 'user_key': None},
+            'file': {'path': self.sink},
+        })
+        self.assertListEqual(list(push.notifiers), ['file'])
+        push.send_message('msg', 'title')
+        self.assertTrue(push.flush(5))
+        with open(self.sink) as sink_file:
+            line = json.loads(sink_file.read())
+        self.assertEqual(line['title'], 'Test: title')
+        self.assertEqual(line['message'], 'msg')
+
+    def test_push_partial_settings(self):
+        push = Notify.MHPush({
+            'enabled': True,
+            'notify_name': 'Test',
+            'pushover': {'api_key': common.random_string(10),
+                         'user_key': None},
+        })
+        self.assertDictEqual(push.notifiers, {})
+
+    def test_lazy_import(self):
+        # Only the configured notifier submodules are imported
+        script = '\n'.join([
+            'import sys',
+            'import mediahandler.util.notify as Notify',
+            'Notify.MHPush({{"enabled": True, "notify_name": None,',
+            '               "file": {{"path": "{0}"}}}})',
+            'print(sorted(name for name in sys.modules',
+            '             if name.startswith("mediahandler.notifiers.")))',
+            'print("requests" in sys.modules)',
+        ]).format(self.sink)
+        output = subprocess.check_output(
+            [sys.executable, '-c', script], universal_newlines=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(output.split('\n')[:2], [
+            "['mediahandler.notifiers.file']",
+            'False',
+        ])
+
+
+def suite():
+    s = MHTestSuite()
+    tests = unittest.TestLoader().loadTestsFromName(__name__)
+    s.addTest(tests)
+    return s
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite', verbosity=2)
@@ -16,18 +16,45 @@
 # included in all copies or substantial portions of the Software.
 """Initialize module"""
 
+import os
+import json
+import time
+import shutil
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import mock
 import responses
 
 import tests.common as common
 from tests.common import unittest
+from tests.common import tempfile
 from tests.common import MHTestSuite
 
 import mediahandler.util.notify as Notify
+import mediahandler.notifiers as Notifiers
+import mediahandler.notifiers.pushover as Pushover
 
 
 class PushObjectTests(unittest.TestCase):
 
     def setUp(self):
+        # Keep the credential cache out of the user's home
+        self.dir = tempfile.mkdtemp()
+        self.cache = os.path.join(self.dir, '.notify.cache')
+        patcher = mock.patch.object(
+            Notify, '_get_cache_file', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(Notify, '_SENDER', Notify.MHSender(
+            os.path.join(self.dir, '.notify.outbox')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.dir)
         # Testing name
         self.name = "push-{0}".format(common.get_test_id())
         # Settings
@@ -37,54 +64,16 @@ class PushObjectTests(unittest.TestCase):
             'pushover': common.get_pushover_api(),
             'pushbullet': common.get_pushbullet_api()
         }
-        # Push object
-        self.push = None
-        with responses.RequestsMock() as rsps:
-            rsps.add(responses.GET,
-                     'https://api.pushbullet.com/v2/users/me',
-                     json={'iden': 'iden', 'title': 'title', 'body': 'body'},
-                     status=200)
-            rsps.add(responses.POST,
-                     'https://api.pushover.net/1/users/validate.json',
-                     json={'status': 1},
-                     status=200)
+        # Push object, which makes no requests until a message is sent
+        with responses.RequestsMock():
             self.push = Notify.MHPush(self.args)
+        # Mark credentials as validated
+        for service in ['pushover', 'pushbullet']:
+            Notify._save_cache(
+                self.push.notifiers[service].get_key(), time.time())
         # Disable push
         self.push.disable = True
 
-    @responses.activate
-    def test_bad_po_credentials(self):
-        responses.add(responses.POST,
-                      'https://api.pushover.net/1/users/validate.json',
-                      json={
-                          'errors': [
-                              'application token is invalid'
-                          ],
-                          'status': 0
-                      },
-                      status=400)
-        # Deactivate PB
-        self.args['pushbullet']['token'] = None
-        # Run test
-        regex = r'Pushover: application token is invalid'
-        self.assertRaisesRegexp(SystemExit, regex, Notify.MHPush, self.args)
-
-    @responses.activate
-    def test_bad_pb_credentials(self):
-        responses.add(responses.GET,
-                      'https://api.pushbullet.com/v2/users/me',
-                      json={
-                          'error': {
-                              'message': 'Access token is missing or invalid.'
-                          }
-                      },
-                      status=400)
-        # Deactivate PO
-        self.args['pushover']['api_key'] = None
-        # Run test
-        regex = r'Pushbullet: Access token is missing or invalid.'
-        self.assertRaisesRegexp(SystemExit, regex, Notify.MHPush, self.args)
-
     def test_new_push_object(self):
         # Dummy settings
         args = {
@@ -104,13 +93,14 @@ class PushObjectTests(unittest.TestCase):
                       json={'errors': ['not found'], 'status': 0},
                       status=400)
         # Bad API settings
-        self.push.pushover.url['token'] = common.random_string(30)
-        self.push.pushover.url['user'] = common.random_string(30)
+        pushover = self.push.notifiers['pushover']
+        pushover.api_key = common.random_string(30)
+        pushover.user_key = common.random_string(30)
         # Message
         msg = common.random_string(10)
         title = common.random_string(10)
         # Send message
-        resp = self.push._send_pushover(msg, title)
+        resp = pushover.send(msg, title)
         # Check response
         self.assertFalse(resp['status'])
         self.assertIn('errors', resp.keys())
@@ -125,7 +115,7 @@ class PushObjectTests(unittest.TestCase):
         msg = common.random_string(10)
         title = common.random_string(10)
         # Send message
-        resp = self.push._send_pushover(msg, title)
+        resp = self.push._send('pushover', msg, title)
         # Check response
         self.assertTrue(resp['status'])
 
@@ -136,12 +126,13 @@ class PushObjectTests(unittest.TestCase):
                       json={'error': 'not found'},
                       status=400)
         # Bad API settings
-        self.push.pushbullet.session.auth = (common.random_string(30), '')
+        pushbullet = self.push.notifiers['pushbullet']
+        pushbullet.token = common.random_string(30)
         # Message
         msg = common.random_string(10)
         title = common.random_string(10)
         # Send message
-        resp = self.push._send_pushbullet(msg, title)
+        resp = pushbullet.send(msg, title)
         # Check response
         self.assertIn('error', resp.keys())
 
@@ -156,7 +147,7 @@ class PushObjectTests(unittest.TestCase):
                       json={'iden': 'iden', 'title': title, 'body': msg},
                       status=200)
         # Send message
-        resp = self.push._send_pushbullet(msg, title)
+        resp = self.push._send('pushbullet', msg, title)
         # Check response
         self.assertIn('iden', resp.keys())
         self.assertEqual(resp['title'], title)
@@ -236,12 +227,135 @@ class PushObjectTests(unittest.TestCase):
         skipped = [skips]
         # Run test
         result = self.push.success(file_array, skipped)
+        self.assertTrue(self.push.flush(5))
+        self.assertEqual(len(responses.calls), 2)
         reg1 = r'\+ {0}'.format(
             self.name)
         reg2 = r'Skipped files:\n\- {0}'.format(skips)
         regex = r'{0}\n\n{1}'.format(reg1, reg2)
         self.assertRegexpMatches(result, regex)
 
+    @responses.activate
+    def test_bad_po_credentials(self):
+        responses.add(responses.POST,
+                      'https://api.pushover.net/1/users/validate.json',
+                      json={
+                          'errors': [
+                              'application token is invalid'
+                          ],
+                          'status': 0
+                      },
+                      status=400)
+        # Run test
+        self.assertFalse(
+            self.push._validate_credentials('pushover', refresh=True))
+        self.assertIsNone(self.push._send('pushover', 'msg', 'title'))
+        self.assertDictEqual(
+            {self.push.notifiers['pushbullet'].get_key(): mock.ANY},
+            Notify._load_cache())
+
+    @responses.activate
+    def test_bad_pb_credentials(self):
+        responses.add(responses.GET,
+                      'https://api.pushbullet.com/v2/users/me',
+                      json={
+                          'error': {
+                              'message': 'Access token is missing or invalid.'
+                          }
+                      },
+                      status=400)
+        # Run test
+        self.assertEqual(
+            self.push.notifiers['pushbullet'].validate(),
+            'Pushbullet: Access token is missing or invalid.')
+        self.assertFalse(
+            self.push._validate_credentials('pushbullet', refresh=True))
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_validation_cached(self):
+        responses.add(responses.POST,
+                      'https://api.pushover.net/1/users/validate.json',
+                      json={'status': 1},
+                      status=200)
+        responses.add(responses.POST,
+                      'https://api.pushover.net/1/messages.json',
+                      json={'status': 1},
+                      status=200)
+        os.remove(self.cache)
+        # First send validates
+        self.assertTrue(self.push._send('pushover', 'msg', 'title')['status'])
+        self.assertEqual(len(responses.calls), 2)
+        # Later sends, from any MHPush object, use the cached result
+        push = Notify.MHPush(self.args)
+        self.assertTrue(push._send('pushover', 'msg', 'title')['status'])
+        self.assertEqual(len(responses.calls), 3)
+        # Expired results are validated again
+        push.validate_ttl = 0
+        self.assertTrue(push._send('pushover', 'msg', 'title')['status'])
+        self.assertEqual(len(responses.calls), 5)
+
+    @responses.activate
+    def test_validation_key_changed(self):
+        responses.add(responses.GET,
+                      'https://api.pushbullet.com/v2/users/me',
+                      json={'iden': 'iden'},
+                      status=200)
+        self.push.notifiers['pushbullet'].token = common.random_string(30)
+        self.assertTrue(self.push._validate_credentials('pushbullet'))
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(len(Notify._load_cache()), 3)
+
+    @responses.activate
+    def test_revalidate_auth_error(self):
+        responses.add(responses.POST,
+                      'https://api.pushbullet.com/v2/pushes',
+                      json={
+                          'error': {
+                              'code': 'invalid_access_token',
+                              'message': 'Access token is missing or invalid.'
+                          }
+                      },
+                      status=401)
+        responses.add(responses.GET,
+                      'https://api.pushbullet.com/v2/users/me',
+                      json={
+                          'error': {
+                              'message': 'Access token is missing or invalid.'
+                          }
+                      },
+                      status=401)
+        # Run test
+        resp = self.push._send('pushbullet', 'msg', 'title')
+        self.assertIn('error', resp.keys())
+        self.assertEqual(len(responses.calls), 2)
+        self.assertNotIn(
+            self.push.notifiers['pushbullet'].get_key(), Notify._load_cache())
+
+    @responses.activate
+    def test_success_digest(self):
+        responses.add(responses.POST,
+                      'https://api.pushbullet.com/v2/pushes',
+                      json={'iden': 'iden', 'title': 'title', 'body': 'body'},
+                      status=200)
+        responses.add(responses.POST,
+                      'https://api.pushover.net/1/messages.json',
+                      json={'status': 1},
+                      status=200)
+        # Enable push
+        self.push.disable = False
+        self.push.digest_window = 0.2
+        # Run test
+        for num in range(3):
+            self.push.success(['{0}-{1}'.format(self.name, num)], [], 'TV')
+        self.assertEqual(len(responses.calls), 0)
+        self.assertTrue(self.push.flush(5))
+        # One message for each service
+        self.assertEqual(len(responses.calls), 2)
+        for num in range(3):
+            self.assertIn('{0}-{1}'.format(self.name, num),
+                          responses.calls[0].request.body)
+
     def test_failure_normal(self):
         # Enable push
         self.push.disable = False
@@ -250,6 +364,342 @@ class PushObjectTests(unittest.TestCase):
         # Run test
         self.assertRaisesRegexp(
             SystemExit, msg, self.push.failure, msg)
+        self.push.flush(1)
+
+
+class SenderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.outbox = os.path.join(self.dir, '.notify.outbox')
+        self.sender = Notify.MHSender(self.outbox, size=2)
+        self.sent = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def slow_send(self, msg, title):
+        time.sleep(0.2)
+        self.sent.append((msg, title))
+
+    def test_send_parallel(self):
+        self.sender.register('one', self.slow_send)
+        self.sender.register('two', self.slow_send)
+        start = time.time()
+        self.sender.send(['one', 'two'], 'msg', 'title')
+        self.assertLess(time.time() - start, 0.1)
+        self.assertTrue(self.sender.flush(5))
+        self.assertLess(time.time() - start, 0.35)
+        self.assertListEqual(self.sent, [('msg', 'title')] * 2)
+        self.assertEqual(self.sender.outbox.count(), 0)
+
+    def test_send_error(self):
+        def bad_send(msg, title):
+            raise ValueError(msg)
+        self.sender.register('bad', bad_send)
+        self.sender.register('good', self.slow_send)
+        self.sender.send(['bad', 'good'], 'msg', 'title')
+        self.assertTrue(self.sender.flush(5))
+        self.assertListEqual(self.sent, [('msg', 'title')])
+        # Errors which are not temporary are not retried
+        self.assertEqual(self.sender.outbox.count(), 0)
+
+    def test_outbox_full(self):
+        for title in ['one', 'two', 'three']:
+            self.sender.send(['key'], 'msg', title)
+        self.assertEqual(self.sender.outbox.count(), 2)
+        self.sender.register('key', self.slow_send)
+        self.assertTrue(self.sender.flush(5))
+        self.assertListEqual(
+            [title for (_, title) in self.sent], ['one', 'two'])
+
+    def test_outbox_full_unknown(self):
+        # Messages for unknown credentials do not fill the outbox
+        self.sender.outbox.add(['old'], 'msg', 'one')
+        self.sender.outbox.add(['old'], 'msg', 'two')
+        self.sender.register('key', self.slow_send)
+        self.sender.send(['key'], 'msg', 'three')
+        self.assertTrue(self.sender.flush(5))
+        self.assertListEqual(self.sent, [('msg', 'three')])
+        self.assertEqual(self.sender.outbox.count(), 2)
+
+    def test_outbox_expire(self):
+        self.sender.outbox.add(['old'], 'msg', 'one')
+        self.sender.outbox.add(['new'], 'msg', 'two')
+        self.assertEqual(self.sender.outbox.expire(['new'], time.time()), 1)
+        self.assertEqual(self.sender.outbox.count(), 1)
+        self.assertEqual(self.sender.outbox.count(['new']), 1)
+        # Recent messages are kept for a later run
+        self.sender.outbox.add(['old'], 'msg', 'three')
+        self.sender.send(['key'], 'msg', 'four')
+        self.assertEqual(self.sender.outbox.count(['old']), 1)
+
+    def test_outbox_lease(self):
+        self.assertGreater(Notify._SEND_LEASE, 4 * Notifiers._TIMEOUT)
+        for title in ['one', 'two']:
+            self.sender.outbox.add(['key'], 'msg', title)
+        start = time.time()
+        self.assertEqual(len(self.sender.outbox.claim(['key'])), 2)
+        # Each message is reserved until the ones before it can be sent
+        self.assertAlmostEqual(
+            self.sender.outbox.next_try(['key']) - start,
+            Notify._SEND_LEASE, 0)
+        self.assertEqual(
+            self.sender.outbox.count(before=start + Notify._SEND_LEASE + 1),
+            1)
+
+    def test_outbox_persistent(self):
+        # Messages without a send function stay in the outbox
+        self.sender.send(['key'], 'msg', 'title')
+        self.assertTrue(self.sender.flush(5))
+        self.assertEqual(self.sender.outbox.count(), 1)
+        # A later sender delivers them once the credentials are registered
+        sender = Notify.MHSender(self.outbox)
+        sender.register('key', self.slow_send)
+        self.assertTrue(sender.flush(5))
+        self.assertListEqual(self.sent, [('msg', 'title')])
+        self.assertEqual(sender.outbox.count(), 0)
+
+    def test_outbox_claim(self):
+        self.sender.outbox.add(['key'], 'msg', 'title')
+        self.assertEqual(len(self.sender.outbox.claim(['key'])), 1)
+        # Claimed messages are not handed out again
+        other = Notify.MHOutbox(self.outbox)
+        self.assertListEqual(other.claim(['key']), [])
+        self.assertEqual(other.count(), 1)
+        self.assertEqual(other.count(before=time.time()), 0)
+
+    def test_retry_backoff(self):
+        def fail_send(msg, title):
+            raise Notifiers.MHRetry('unavailable')
+        self.sender.register('key', fail_send)
+        start = time.time()
+        self.sender.send(['key'], 'msg', 'one')
+        self.sender.send(['key'], 'msg', 'two')
+        # Gives up early if the retry is after the timeout
+        self.assertFalse(self.sender.flush(2))
+        self.assertLess(time.time() - start, 1)
+        # Both messages wait for the first retry
+        self.assertEqual(self.sender.outbox.count(), 2)
+        self.assertEqual(self.sender.outbox.count(before=time.time()), 0)
+        next_try = self.sender.outbox.next_try(['key'])
+        self.assertAlmostEqual(next_try - start, Notify._RETRY_DELAY, 0)
+
+    def test_retry_rate_limit(self):
+        reset = time.time() + 600
+        def limited_send(msg, title):
+            raise Notifiers.MHRetry('rate limited', reset)
+        self.sender.register('key', limited_send)
+        self.sender.send(['key'], 'msg', 'title')
+        self.assertFalse(self.sender.flush(5))
+        self.assertEqual(self.sender.outbox.next_try(['key']), reset)
+
+    def test_retry_dropped(self):
+        self.sender.outbox.add(['key'], 'msg', 'title')
+        (row,) = self.sender.outbox.claim(['key'])
+        self.assertIsNone(self.sender._retry(
+            [row[0]], Notify._RETRY_ATTEMPTS, 'title', Notifiers.MHRetry('')))
+        self.assertEqual(self.sender.outbox.count(), 0)
+
+    def test_outbox_upgrade(self):
+        import sqlite3
+        outbox_file = os.path.join(self.dir, 'old.outbox')
+        conn = sqlite3.connect(outbox_file)
+        conn.execute(
+            'CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'key TEXT NOT NULL, title TEXT, message TEXT, '
+            'attempts INTEGER NOT NULL DEFAULT 0, next_try REAL NOT NULL)')
+        conn.commit()
+        conn.close()
+        outbox = Notify.MHOutbox(outbox_file)
+        self.assertTrue(outbox.add(['key'], 'msg', 'title', digest='TV'))
+        self.assertEqual(len(outbox.claim(['key'])), 1)
+
+    def test_shared_sender(self):
+        self.assertIs(Notify.get_sender(), Notify.get_sender())
+
+
+class DigestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sender = Notify.MHSender(os.path.join(self.dir, 'outbox'))
+        self.sent = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def record_send(self, msg, title):
+        self.sent.append((msg, title))
+
+    def test_digest_window(self):
+        self.sender.register('key', self.record_send)
+        start = time.time()
+        for name in ['one', 'two', 'three']:
+            self.sender.send_files(['key'], 'Name', 'TV', [name], [], 0.3)
+        self.sender.send_files(['key'], 'Name', 'Movies', ['four'], [], 0.3)
+        self.sender.send_files(['key'], 'Name', 'TV', [], ['five'], 0.3)
+        self.assertTrue(self.sender.flush(5))
+        self.assertGreaterEqual(time.time() - start, 0.3)
+        # One message for each type
+        self.assertListEqual(self.sent, [
+            ('+ one\n+ two\n+ three\n\nSkipped files:\n- five\n',
+             'Name: TV Added (with Skips)'),
+            ('+ four\n', 'Name: Media Added'),
+        ])
+
+    def test_digest_size(self):
+        self.sender.register('key', self.record_send)
+        for name in ['one', 'two', 'three', 'four']:
+            self.sender.send_files(['key'], 'Name', 'TV', [name], [], 60, 3)
+        # The first 3 are sent right away
+        self.assertFalse(self.sender.flush(1))
+        self.assertListEqual(self.sent, [
+            ('+ one\n+ two\n+ three\n', 'Name: TV Added')])
+        self.assertEqual(self.sender.outbox.count(), 1)
+
+    def test_digest_no_window(self):
+        # Messages which are ready together are still merged
+        for name in ['one', 'two']:
+            self.sender.send_files(['key'], 'Name', None, [name], [])
+        self.sender.register('key', self.record_send)
+        self.assertTrue(self.sender.flush(5))
+        self.assertListEqual(self.sent, [
+            ('+ one\n+ two\n', 'Name: Media Added')])
+
+    def test_digest_limit(self):
+        self.sender.register('key', self.record_send, 200)
+        names = ['file-{0:03d}.mkv'.format(num) for num in range(100)]
+        self.sender.send_files(['key'], 'Name', 'TV', names, names[:5])
+        self.sender.send(['key'], 'x' * 500, 'Error')
+        self.assertTrue(self.sender.flush(5))
+        (digest, message) = [msg for (msg, _) in self.sent]
+        self.assertLessEqual(len(digest), 200)
+        self.assertTrue(digest.startswith('+ file-000.mkv\n'))
+        self.assertIn('Skipped files:\n- file-000.mkv\n', digest)
+        self.assertEqual(len(message), 200)
+        self.assertTrue(message.endswith(' ...'))
+
+    def test_format_files(self):
+        self.assertEqual(
+            Notify._format_files(['one', 'two'], ['three']),
+            '+ one\n+ two\n\nSkipped files:\n- three\n')
+        self.assertEqual(Notify._format_files([], []), '')
+
+    def test_format_files_limit(self):
+        added = ['added-{0:03d}'.format(num) for num in range(100)]
+        skipped = ['skipped-{0:03d}'.format(num) for num in range(100)]
+        text = Notify._format_files(added, skipped, 1024)
+        self.assertLessEqual(len(text), 1024)
+        # Each list gets about half of the space
+        (added_text, skipped_text) = text.split('\n\nSkipped files:\n')
+        self.assertGreater(len(added_text), 400)
+        self.assertGreater(len(skipped_text), 400)
+        # Every file is listed or counted
+        for (prefix, text, files) in [('+', added_text, added),
+                                      ('-', skipped_text, skipped)]:
+            lines = text.strip().split('\n')
+            more = int(lines[-1].split()[3])
+            self.assertEqual(len(lines) - 1 + more, len(files))
+            self.assertEqual(lines[-1],
+                             '{0} ... and {1} more'.format(prefix, more))
+
+    def test_format_files_short_skips(self):
+        added = ['added-{0:03d}'.format(num) for num in range(100)]
+        text = Notify._format_files(added, ['skipped'], 500)
+        self.assertLessEqual(len(text), 500)
+        self.assertGreater(len(text), 450)
+        self.assertTrue(text.endswith('Skipped files:\n- skipped\n'))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Pushover API which sends the queued responses."""
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.server.requests.append(
+            (self.path, self.rfile.read(length).decode('utf-8')))
+        (status, headers, body) = self.server.responses.pop(0)
+        self.send_response(status)
+        for (header, value) in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServerTests(unittest.TestCase):
+
+    def setUp(self):
+        # Local stand-in for Pushover
+        self.server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.requests = []
+        self.server.responses = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        # Use temporary files and a short backoff
+        self.dir = tempfile.mkdtemp()
+        patchers = [
+            mock.patch.object(Pushover.MHPushover, 'url', url),
+            mock.patch.object(Notify, '_RETRY_DELAY', 0.1),
+            mock.patch.object(Notify, '_get_cache_file',
+                              return_value=os.path.join(self.dir, 'cache')),
+            mock.patch.object(Notify, '_SENDER', Notify.MHSender(
+                os.path.join(self.dir, 'outbox'))),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Push object
+        self.push = Notify.MHPush({
+            'enabled': True,
+            'notify_name': '',
+            'pushover': common.get_pushover_api(),
+            'pushbullet': {'token': None},
+        })
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_deliver_retry(self):
+        self.server.responses = [
+            (200, {}, {'status': 1}),
+            (503, {'Retry-After': '0'}, {}),
+            (429, {'X-Limit-App-Reset': str(time.time() + 0.3)}, {}),
+            (200, {}, {'status': 1}),
+        ]
+        # Sending does not wait on the service
+        start = time.time()
+        self.push.send_message('msg', 'title')
+        self.assertLess(time.time() - start, 0.1)
+        # Delivered after backing off
+        self.assertTrue(self.push.flush(5))
+        self.assertGreaterEqual(time.time() - start, 0.3)
+        paths = [path for (path, _) in self.server.requests]
+        self.assertListEqual(paths, [
+            '/users/validate.json',
+            '/messages.json',
+            '/messages.json',
+            '/messages.json',
+        ])
+        self.assertIn('message=msg', self.server.requests[-1][1])
+        self.assertEqual(Notify.get_sender().outbox.count(), 0)
+
+    def test_deliver_server_down(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.push.send_message('msg', 'title')
+        self.assertFalse(self.push.flush(0.05))
+        # Kept in the outbox to be tried again
+        outbox = Notify.get_sender().outbox
+        self.assertEqual(outbox.count(), 1)
+        self.assertEqual(outbox.count(before=time.time()), 0)
 
 
 def suite():
@@ -18,12 +18,19 @@
 
 import os
 import sys
+import time
 import shutil
+import threading
+
+import mock
 
 import tests.common as common
 from tests.common import unittest
+from tests.common import tempfile
 from tests.common import MHTestSuite
 
+import mediahandler.handler as MH
+import mediahandler.util.jobs as Jobs
 import mediahandler.util.args as Args
 import mediahandler.util.torrent as Torrent
 from mediahandler.util.config import parse_config
@@ -59,7 +66,8 @@ class DelugeTests(unittest.TestCase):
             'single_track': False,
             'query': None,
             'type': 1,
-            'stype': 'TV'
+            'stype': 'TV',
+            'torrent_hash': 'hash',
         }
         # Run test
         sys.argv = ['', 'hash', os.path.basename(self.tmp_file), self.folder]
@@ -93,6 +101,325 @@ class RemoveTorrentTests(unittest.TestCase):
         Torrent.remove_deluge_torrent(self.settings, 'hash')
 
 
+@mock.patch.object(Torrent, '_RETRY_DELAY', 0.01)
+class DelugeClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = {
+            'enabled': True,
+            'host': '127.0.0.1',
+            'port': 58846,
+            'user': 'user',
+            'pass': 'pass',
+        }
+
+    def tearDown(self):
+        Torrent.stop_client()
+
+    def test_remove(self):
+        transport = common.MHFakeDeluge(['hash1', 'hash2', 'hash3'])
+        client = Torrent.MHDelugeClient(self.settings, transport)
+        client.remove('hash1')
+        client.remove('hash3')
+        self.assertTrue(client.flush(5))
+        self.assertEqual(list(transport.torrents), ['hash2'])
+        # The connection is reused
+        self.assertEqual(transport.connects, 1)
+        self.assertTrue(transport.connected)
+        # The whole session is never fetched
+        methods = [call[0] for call in transport.calls]
+        self.assertNotIn('core.get_session_state', methods)
+        client.close(5)
+        self.assertFalse(transport.connected)
+        self.assertFalse(client._thread.is_alive())
+
+    def test_remove_not_found(self):
+        transport = common.MHFakeDeluge(['hash1'])
+        client = Torrent.MHDelugeClient(self.settings, transport)
+        client.remove('hash2')
+        self.assertTrue(client.flush(5))
+        self.assertEqual(list(transport.torrents), ['hash1'])
+        self.assertEqual(transport.calls[-1], (
+            'core.get_torrents_status', {'id': ['hash2']}, ['hash']))
+        client.close(5)
+
+    def test_remove_batch(self):
+        hashes = ['hash{0}'.format(num) for num in range(5)]
+        transport = common.MHFakeDeluge(hashes + ['other'])
+        client = Torrent.MHDelugeClient(self.settings, transport)
+        self.assertEqual(client._remove(hashes + ['missing']), hashes)
+        self.assertEqual(list(transport.torrents), ['other'])
+        self.assertEqual(transport.calls, [
+            ('daemon.info',),
+            ('core.get_torrents_status',
+             {'id': hashes + ['missing']}, ['hash']),
+            ('core.remove_torrents', hashes, False),
+        ])
+
+    def test_remove_batch_old_daemon(self):
+        hashes = ['hash{0}'.format(num) for num in range(5)]
+        transport = common.MHFakeDeluge(hashes, version='1.3.15')
+        client = Torrent.MHDelugeClient(self.settings, transport)
+        self.assertEqual(client._remove(hashes), hashes)
+        self.assertEqual(transport.torrents, {})
+        methods = [call[0] for call in transport.calls]
+        self.assertEqual(methods.count('core.remove_torrent'), 5)
+        self.assertNotIn('core.remove_torrents', methods)
+
+    def test_reconnect(self):
+        transport = common.MHFakeDeluge(['hash1', 'hash2'], failures=2)
+        client = Torrent.MHDelugeClient(self.settings, transport)
+        client.remove('hash1', 'hash2')
+        self.assertTrue(client.flush(5))
+        self.assertEqual(transport.torrents, {})
+        self.assertEqual(transport.connects, 3)
+        client.close(5)
+
+    def test_give_up(self):
+        transport = common.MHFakeDeluge(['hash1', 'hash2'],
+                                        failures=Torrent._RETRY_ATTEMPTS)
+        client = Torrent.MHDelugeClient(self.settings, transport)
+        self.assertEqual(client._remove(['hash1']), [])
+        # The next batch still works
+        self.assertEqual(client._remove(['hash2']), ['hash2'])
+        self.assertEqual(list(transport.torrents), ['hash1'])
+
+    def test_closed(self):
+        transport = common.MHFakeDeluge(['hash1'])
+        client = Torrent.MHDelugeClient(self.settings, transport)
+        client.close(5)
+        client.remove('hash1')
+        self.assertTrue(client.flush(5))
+        self.assertEqual(list(transport.torrents), ['hash1'])
+        self.assertEqual(transport.connects, 0)
+
+    def test_remove_deluge_torrent(self):
+        transport = common.MHFakeDeluge(['hash1', 'hash2'])
+        with mock.patch.object(Torrent, 'MHDelugeTransport',
+                               return_value=transport):
+            self.assertTrue(
+                Torrent.remove_deluge_torrent(self.settings, 'hash1'))
+            self.assertTrue(
+                Torrent.remove_deluge_torrent(self.settings, 'hash2'))
+        self.assertEqual(transport.torrents, {})
+        self.assertEqual(transport.connects, 1)
+        # Same settings share a client
+        client = Torrent.get_client(self.settings)
+        self.assertIs(client, Torrent.get_client(dict(self.settings)))
+        # New settings get a new one
+        self.settings['port'] = 58847
+        self.assertIsNot(client, Torrent.get_client(self.settings))
+        self.assertFalse(transport.connected)
+
+
+@mock.patch.object(Torrent, '_RETRY_DELAY', 0.01)
+@mock.patch.object(Torrent, '_LISTEN_POLL', 0.01)
+class DelugeListenerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.dir, '.deluge.state')
+        self.transport = common.MHFakeDeluge(['old1', 'old2'])
+        self.added = []
+        self.listener = None
+        self.thread = None
+
+    def tearDown(self):
+        self.stop()
+        shutil.rmtree(self.dir)
+
+    def start(self):
+        self.listener = Torrent.MHDelugeListener(
+            {}, self.add, self.transport, self.state_file)
+        self.thread = threading.Thread(target=self.listener.run)
+        self.thread.start()
+        self.wait_for(lambda: self.listener.seen is not None and
+                      self.transport.connected)
+
+    def stop(self):
+        if self.thread is not None:
+            self.listener.stop()
+            self.thread.join(5)
+            self.assertFalse(self.thread.is_alive())
+            self.thread = None
+
+    def add(self, torrent_hash, media):
+        self.added.append((torrent_hash, media))
+
+    def wait_for(self, check):
+        end = time.time() + 5
+        while not check():
+            self.assertLess(time.time(), end)
+            time.sleep(0.01)
+
+    def test_first_run(self):
+        self.start()
+        # Torrents finished before the first run are not added
+        self.assertEqual(self.added, [])
+        self.assertEqual(self.listener.seen, set(['old1', 'old2']))
+        self.assertTrue(os.path.exists(self.state_file))
+
+    def test_finished_event(self):
+        self.start()
+        self.transport.finish('new1', 'Show.S01E01')
+        self.wait_for(lambda: self.added)
+        self.assertEqual(self.added, [
+            ('new1', os.path.join('/downloads', 'Show.S01E01'))])
+        # Only added once
+        self.transport.finish('new1', 'Show.S01E01')
+        self.transport.finish('new2', 'Show.S01E02')
+        self.wait_for(lambda: len(self.added) == 2)
+        self.assertEqual(self.added[1][0], 'new2')
+        self.assertEqual(self.transport.connects, 1)
+
+    def test_catch_up_on_start(self):
+        self.start()
+        self.stop()
+        # Finished while not running
+        self.transport.finish('new1', 'Movie.2020', '/downloads/movies')
+        del self.transport.torrents['old1']
+        self.start()
+        self.wait_for(lambda: self.added)
+        self.assertEqual(self.added, [
+            ('new1', os.path.join('/downloads/movies', 'Movie.2020'))])
+        self.assertEqual(self.listener.seen, set(['old2', 'new1']))
+
+    def test_catch_up_on_reconnect(self):
+        self.start()
+        # Connection drops and a torrent finishes in the meantime
+        self.transport.failures = 1
+        self.transport.disconnect()
+        self.transport.finish('new1', 'Show.S01E01')
+        self.wait_for(lambda: self.added)
+        self.assertEqual(self.added[0][0], 'new1')
+        self.assertGreaterEqual(self.transport.connects, 2)
+        # Events still arrive after reconnecting
+        self.transport.finish('new2', 'Show.S01E02')
+        self.wait_for(lambda: len(self.added) == 2)
+
+    def test_callback_error(self):
+        self.add = mock.Mock(side_effect=ValueError('bad'))
+        self.start()
+        self.transport.finish('new1', 'Show.S01E01')
+        self.wait_for(lambda: self.add.called)
+        self.wait_for(lambda: 'new1' in self.listener.seen)
+        self.assertTrue(self.thread.is_alive())
+
+
+@mock.patch.object(Torrent, '_RETRY_DELAY', 0.01)
+@mock.patch.object(Torrent, '_LISTEN_POLL', 0.01)
+class SharedTransportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.settings = {
+            'enabled': True,
+            'host': '127.0.0.1',
+            'port': 58846,
+            'user': 'user',
+            'pass': 'pass',
+        }
+        self.transport = common.MHFakeDeluge(['old1', 'old2'])
+        patcher = mock.patch.object(
+            Torrent, 'MHDelugeTransport', return_value=self.transport)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.added = []
+        self.listener = Torrent.MHDelugeListener(
+            self.settings, self.add,
+            state_file=os.path.join(self.dir, '.deluge.state'))
+        self.thread = threading.Thread(target=self.listener.run)
+
+    def tearDown(self):
+        self.listener.stop()
+        if self.thread.ident is not None:
+            self.thread.join(5)
+        Torrent.stop_client()
+        shutil.rmtree(self.dir)
+
+    def add(self, torrent_hash, media):
+        self.added.append((torrent_hash, media))
+
+    def wait_for(self, check):
+        end = time.time() + 5
+        while not check():
+            self.assertLess(time.time(), end)
+            time.sleep(0.01)
+
+    def start(self):
+        self.thread.start()
+        self.wait_for(lambda: self.listener.seen is not None and
+                      self.transport.connected)
+
+    def test_get_transport(self):
+        handle = Torrent.get_transport(self.settings)
+        self.assertIsNot(handle, Torrent.get_transport(self.settings))
+        self.assertIs(handle.shared,
+                      Torrent.get_transport(dict(self.settings)).shared)
+        self.settings['port'] = 58847
+        self.assertIsNot(handle.shared,
+                         Torrent.get_transport(self.settings).shared)
+
+    def test_client_close(self):
+        self.start()
+        client = Torrent.get_client(self.settings)
+        client.remove('old1')
+        self.assertTrue(client.flush(5))
+        self.assertEqual(self.transport.connects, 1)
+        # Closing the client leaves the listener connected
+        Torrent.stop_client(5)
+        self.assertTrue(self.transport.connected)
+        self.transport.finish('new1', 'Show.S01E01')
+        self.wait_for(lambda: self.added)
+        self.assertEqual(self.added[0][0], 'new1')
+
+    def test_listener_stop(self):
+        self.start()
+        client = Torrent.get_client(self.settings)
+        client.remove('old1')
+        self.assertTrue(client.flush(5))
+        # Stopping the listener leaves the client connected
+        self.listener.stop()
+        self.thread.join(5)
+        self.assertTrue(self.transport.connected)
+        client.remove('old2')
+        self.assertTrue(client.flush(5))
+        self.assertEqual(self.transport.torrents, {})
+        self.assertEqual(self.transport.connects, 1)
+        # The last user disconnects
+        Torrent.stop_client(5)
+        self.assertFalse(self.transport.connected)
+
+    def test_client_reconnect(self):
+        self.start()
+        client = Torrent.get_client(self.settings)
+        # The client reconnects after the connection drops
+        self.transport.failures = 1
+        self.transport.disconnect()
+        client.remove('old1')
+        self.assertTrue(client.flush(5))
+        # The listener notices, subscribes again and catches up
+        self.wait_for(lambda: self.listener.transport.is_connected())
+        self.transport.finish('new1', 'Show.S01E01')
+        self.wait_for(lambda: self.added)
+        self.assertEqual(self.added[0][0], 'new1')
+
+
+class HandlerListenTests(unittest.TestCase):
+
+    def test_listen(self):
+        handler = MH.MHandler(common.get_conf_file())
+        with mock.patch.object(Torrent, 'MHDelugeListener') as listener, \
+                mock.patch.object(Jobs.MHJobQueue, 'submit') as submit:
+            handler.listen()
+            listener.return_value.run.assert_called_once_with()
+            # Finished torrents are queued with their hash
+            callback = listener.call_args[0][1]
+            callback('hash1', '/downloads/tv/Show.S01E01')
+        submit.assert_called_once_with(
+            '/downloads/tv/Show.S01E01', torrent_hash='hash1')
+
+
 def suite():
     s = MHTestSuite()
     tests = unittest.TestLoader().loadTestsFromName(__name__)
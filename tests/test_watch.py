@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# This file is a part of EM Media Handler Testing Module
+# Copyright (c) 2014-2021 Erin Morelli
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+"""Initialize module"""
+
+import os
+import sys
+import time
+import shutil
+import zipfile
+import threading
+
+import mock
+
+import tests.common as common
+from tests.common import unittest
+from tests.common import tempfile
+from tests.common import MHTestSuite
+
+import mediahandler.handler as MH
+import mediahandler.util.watch as Watch
+
+
+class WatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        # Make a watch folder with drop folders
+        self.dir = tempfile.mkdtemp()
+        self.tv = os.path.join(self.dir, 'TV')
+        os.makedirs(self.tv)
+        os.makedirs(os.path.join(self.dir, 'Other'))
+        # Watcher settings
+        self.settings = {
+            'watch_folder': self.dir,
+            'use_inotify': False,
+            'poll_interval': 0.05,
+            'settle_time': 0,
+        }
+        # Found downloads
+        self.found = []
+        self.thread = None
+
+    def tearDown(self):
+        if self.thread is not None:
+            self.watcher.stop()
+            self.thread.join(5)
+        shutil.rmtree(self.dir)
+
+    def start_watcher(self):
+        self.watcher = Watch.MHWatcher(self.settings, self.found.append)
+        self.thread = threading.Thread(target=self.watcher.run)
+        self.thread.start()
+        # Wait for the drop folders to be found
+        for retry in range(100):
+            if self.watcher.folders:
+                break
+            time.sleep(0.01)
+
+    def wait_for_found(self, count=1):
+        for retry in range(200):
+            if len(self.found) >= count:
+                break
+            time.sleep(0.01)
+
+    def test_missing_watch_folder(self):
+        self.settings['watch_folder'] = None
+        regex = r'A Daemon watch_folder is required'
+        self.assertRaisesRegexp(
+            ValueError, regex, Watch.MHWatcher, self.settings, None)
+
+    def test_drop_folders(self):
+        watcher = Watch.MHWatcher(self.settings, None)
+        self.assertListEqual(watcher._get_drop_folders(), [self.tv])
+
+    def test_ignore_existing(self):
+        existing = common.make_tmp_file('.mkv', self.tv)
+        self.start_watcher()
+        new_file = common.make_tmp_file('.mkv', self.tv)
+        self.wait_for_found()
+        self.assertListEqual(self.found, [new_file])
+        self.assertNotIn(existing, self.found)
+
+    def test_new_folder(self):
+        self.start_watcher()
+        new_folder = os.path.join(self.tv, 'Show.S01E01')
+        os.makedirs(new_folder)
+        common.make_tmp_file('.mkv', new_folder)
+        self.wait_for_found()
+        self.assertListEqual(self.found, [new_folder])
+
+    def test_settle_time(self):
+        self.settings['settle_time'] = 60
+        self.start_watcher()
+        common.make_tmp_file('.mkv', self.tv)
+        time.sleep(0.2)
+        self.assertListEqual(self.found, [])
+        self.assertEqual(len(self.watcher.pending), 1)
+
+    def test_ignore_extracted(self):
+        self.start_watcher()
+        archive = os.path.join(self.tv, 'Show.zip')
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('Show.S01E01.mkv', b'one')
+        self.wait_for_found()
+        self.assertListEqual(self.found, [archive])
+        # The folder the job extracts to is not a new download
+        os.makedirs(os.path.join(self.tv, 'Show'))
+        new_file = common.make_tmp_file('.mkv', self.tv)
+        self.wait_for_found(2)
+        self.assertListEqual(self.found, [archive, new_file])
+
+    def test_state_missing_file(self):
+        existing = common.make_tmp_file('.mkv', self.tv)
+        self.assertEqual(Watch._get_state(existing)[0], 0)
+        # Removed between listing and checking it
+        missing = os.path.join(self.tv, 'missing.mkv')
+        with mock.patch('os.scandir', side_effect=NotADirectoryError):
+            self.assertIsNone(Watch._get_state(missing))
+
+    @unittest.skipUnless(
+        sys.platform.startswith("linux"), "requires a Linux system")
+    def test_inotify(self):
+        self.settings['use_inotify'] = True
+        self.settings['poll_interval'] = 5
+        self.start_watcher()
+        # Wait for inotify to be set up
+        for retry in range(100):
+            if self.watcher._inotify is not None:
+                break
+            time.sleep(0.01)
+        self.assertIsNotNone(self.watcher._inotify)
+        new_file = common.make_tmp_file('.mkv', self.tv)
+        self.wait_for_found()
+        self.assertListEqual(self.found, [new_file])
+
+
+class HandlerWatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = common.get_conf_file()
+        self.handler = MH.MHandler(self.conf)
+
+    def test_no_watch_folder(self):
+        self.handler.daemon.watch_folder = None
+        regex = r'A Daemon watch_folder is required'
+        self.assertRaisesRegexp(SystemExit, regex, self.handler.watch)
+
+
+def suite():
+    s = MHTestSuite()
+    tests = unittest.TestLoader().loadTestsFromName(__name__)
+    s.addTest(tests)
+    return s
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite', verbosity=2)